@@ -0,0 +1,207 @@
+# backfill_conversations.py
+"""
+Backfill embeddings and context analysis on stored conversations.
+
+Conversations saved before embeddings were persisted, or before the context
+engine normalized topics, are missing `embedding` or `context.topics`. This
+walks the collection in _id order, in batches of --batch-size:
+
+  - the embedding of each document's summary (or user message) and the
+    candidate terms and entities of its user message come from nlp.pipe
+    batches, spread over --workers processes (0 runs them in this process)
+  - topics are ranked against each user's document frequencies, as at save
+    time; documents that had no topics before are counted in topic_stats,
+    and recomputed ones (--all) move their counts from the old topics to the new
+  - every batch is written with one bulk_write, and the last _id written is
+    checkpointed, so an interrupted run picks up where it stopped
+
+    python -m app.commands.backfill_conversations                   # what's missing
+    python -m app.commands.backfill_conversations --fields embedding --user shivani
+    python -m app.commands.backfill_conversations --all --restart   # recompute everything
+    python -m app.commands.backfill_conversations --dry-run
+
+--dry-run runs the analysis and reports what would be written, without
+writing anything or moving the checkpoint. Rollups are not touched; run
+app.commands.backfill_rollups afterwards if topics changed. Thread centroids
+are corrected the next time each user's memory is loaded.
+"""
+import argparse
+import itertools
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+from app.services import context_engine, nlp_executor
+from app.services.filtering import entry_text
+from app.utils import db
+
+FIELDS = ("embedding", "context")
+SOURCE_FIELDS = {"user_id": 1, "user_message": 1, "summary": 1, "context": 1, "embedding": 1}
+
+
+def missing_query(fields, user_id: Optional[str] = None, recompute: bool = False) -> dict:
+    """Documents that need at least one of `fields` (all documents with recompute)."""
+    query = {"user_id": user_id} if user_id is not None else {}
+    if not recompute:
+        conditions = {
+            "embedding": {"embedding": {"$exists": False}},
+            "context": {"context.topics": {"$exists": False}},
+        }
+        query["$or"] = [conditions[field] for field in fields]
+    return query
+
+
+def needs(doc: dict, field: str, recompute: bool) -> bool:
+    if recompute:
+        return True
+    if field == "embedding":
+        return doc.get("embedding") is None
+    return "topics" not in (doc.get("context") or {})
+
+
+def analyze_chunk(embed_texts: List[str], context_texts: List[str]):
+    """Worker: embeddings and (terms, entities) for the texts, from one nlp.pipe pass each."""
+    embeddings = [vector.tolist() for vector in nlp_executor.embed_batch(embed_texts)] if embed_texts else []
+    analyses = nlp_executor.analyze_batch(context_texts) if context_texts else []
+    return embeddings, [(analysis["terms"], analysis["entities"]) for analysis in analyses]
+
+
+def plan(batch: List[dict], fields, recompute: bool):
+    """Which documents of a batch get which field, and the texts to analyze for them."""
+    embed = [doc for doc in batch if "embedding" in fields and needs(doc, "embedding", recompute) and entry_text(doc)]
+    context = [doc for doc in batch if "context" in fields and needs(doc, "context", recompute)]
+    return embed, context, [entry_text(doc) for doc in embed], [doc.get("user_message", "") for doc in context]
+
+
+def build_updates(embed_docs, context_docs, embeddings, analyses):
+    """
+    The $set per document, plus per user the topic lists to count (documents
+    that had none) and the (old, new) topic lists to re-count (documents that had some).
+    """
+    updates = {}
+    for doc, vector in zip(embed_docs, embeddings):
+        updates.setdefault(doc["_id"], {})["embedding"] = vector
+
+    by_user = {}
+    for doc, analysis in zip(context_docs, analyses):
+        by_user.setdefault(doc.get("user_id"), []).append((doc, analysis))
+    new_topics, changed_topics = {}, {}
+    for user_id, pairs in by_user.items():
+        contexts = context_engine.rank_contexts([terms for _, (terms, _) in pairs],
+                                                [entities for _, (_, entities) in pairs], user_id)
+        for (doc, _), context in zip(pairs, contexts):
+            fields = updates.setdefault(doc["_id"], {})
+            fields["context"] = context
+            fields["topic"] = context["topics"][0] if context["topics"] else "general"
+            if user_id is None:
+                continue
+            old_topics = (doc.get("context") or {}).get("topics")
+            if old_topics is None:
+                new_topics.setdefault(user_id, []).append(context["topics"])
+            else:
+                changed_topics.setdefault(user_id, []).append((old_topics, context["topics"]))
+
+    operations = [UpdateOne({"_id": _id}, {"$set": fields}) for _id, fields in updates.items()]
+    return operations, new_topics, changed_topics
+
+
+def backfill(fields=FIELDS, user_id: Optional[str] = None, recompute: bool = False, batch_size: int = 512,
+             workers: int = 0, dry_run: bool = False, restart: bool = False, report_every: float = 5.0) -> dict:
+    name = "backfill_conversations:" + ",".join(sorted(fields)) + (f":{user_id}" if user_id else "") + (":all" if recompute else "")
+    checkpoint = None if restart else db.get_checkpoint(name)
+    after = checkpoint["last_id"] if checkpoint else None
+    totals = {"processed": checkpoint.get("processed", 0) if checkpoint else 0,
+              "updated": checkpoint.get("updated", 0) if checkpoint else 0}
+    if after is not None:
+        print(f"Resuming {name} after _id {after} ({totals['processed']} documents already processed)")
+
+    cursor = db.iter_conversations_by_id(missing_query(fields, user_id, recompute), SOURCE_FIELDS, after, batch_size)
+    batches = iter(lambda: list(itertools.islice(cursor, batch_size)), [])
+
+    pool = None
+    if workers > 0:
+        # spawn, not fork: don't copy the Mongo client's sockets into the workers.
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=nlp_executor.load_models)
+    else:
+        nlp_executor.load_models()
+
+    def submit(batch):
+        embed_docs, context_docs, embed_texts, context_texts = plan(batch, fields, recompute)
+        if pool is None:
+            result = analyze_chunk(embed_texts, context_texts)
+        else:
+            result = pool.submit(analyze_chunk, embed_texts, context_texts)
+        return batch, embed_docs, context_docs, result
+
+    start = last_report = time.perf_counter()
+    run_processed = 0
+    in_flight = deque()
+    try:
+        while True:
+            # Keep every worker busy; batches are written back in _id order.
+            while len(in_flight) < max(workers, 1) * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                in_flight.append(submit(batch))
+            if not in_flight:
+                break
+
+            batch, embed_docs, context_docs, result = in_flight.popleft()
+            embeddings, analyses = result.result() if pool is not None else result
+            operations, new_topics, changed_topics = build_updates(embed_docs, context_docs, embeddings, analyses)
+            if not dry_run:
+                db.bulk_update_conversations(operations)
+                for topic_user, topic_lists in new_topics.items():
+                    context_engine.record_topics(topic_user, topic_lists)
+                for topic_user, changes in changed_topics.items():
+                    context_engine.replace_topics(topic_user, changes)
+            totals["processed"] += len(batch)
+            totals["updated"] += len(operations)
+            run_processed += len(batch)
+            if not dry_run:
+                db.save_checkpoint(name, {"last_id": batch[-1]["_id"], **totals})
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                print(f"  {totals['processed']} processed, {totals['updated']} "
+                      f"{'would be ' if dry_run else ''}updated, {run_processed / (now - start):.0f} docs/s")
+                last_report = now
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if not dry_run:
+        # Finished: the next run starts over (and only finds what is still missing).
+        db.clear_checkpoint(name)
+
+    elapsed = time.perf_counter() - start
+    totals["docs_per_second"] = run_processed / elapsed if elapsed > 0 else 0.0
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", nargs="+", choices=FIELDS, default=list(FIELDS))
+    parser.add_argument("--user", help="Only this user's conversations")
+    parser.add_argument("--all", action="store_true", help="Recompute documents that already have the fields")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="NLP worker processes (0: analyze in this process)")
+    parser.add_argument("--dry-run", action="store_true", help="Analyze and report, but write nothing")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    db.ensure_indexes()
+    totals = backfill(args.fields, args.user, args.all, args.batch_size, args.workers, args.dry_run, args.restart)
+    print(f"{'Dry run: ' if args.dry_run else ''}{totals['processed']} processed, "
+          f"{totals['updated']} {'would be ' if args.dry_run else ''}updated, "
+          f"{totals['docs_per_second']:.0f} docs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# backfill_rollups.py
+"""
+Rebuild the emotional-history rollups from stored conversations.
+
+New conversations update their rollups as they are saved; run this once to fold
+in history written before rollups existed, or to rebuild them from scratch:
+
+    python -m app.commands.backfill_rollups              # every user
+    python -m app.commands.backfill_rollups --user shivani
+
+Existing rollups for the selected users are cleared first, so the command is
+safe to re-run. Run it while the API is idle: conversations saved during the
+rebuild can be counted twice.
+"""
+import argparse
+import time
+
+from app.services import rollups
+from app.utils import db
+
+ROLLUP_FIELDS = {"user_id": 1, "thread_id": 1, "topic": 1, "sentiment": 1, "timestamp": 1}
+
+
+def backfill(user_id=None, batch_size: int = 1000) -> int:
+    db.delete_rollups(user_id)
+    query = {"user_id": user_id} if user_id is not None else {}
+    processed = 0
+    batch = []
+    for doc in db.iter_conversations_by_id(query, ROLLUP_FIELDS, batch_size=batch_size):
+        if "timestamp" not in doc or "user_id" not in doc:
+            continue
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            rollups.record_conversations(batch)
+            processed += len(batch)
+            batch = []
+    rollups.record_conversations(batch)
+    return processed + len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--user", help="Only rebuild this user's rollups")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db.ensure_indexes()
+    start = time.perf_counter()
+    processed = backfill(args.user, args.batch_size)
+    print(f"Rolled up {processed} conversations in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,125 @@ from pymongo import MongoClient
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))  # seconds, per request
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5"))
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "20"))
+
+# Gemini rate control (per process; 0 disables a limit). Set these to the project's quota
+# divided by the number of workers. Each bucket can burst GEMINI_BURST_SECONDS of quota on
+# top of a minute's refill, so leave that much headroom below the quota.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "2000"))  # requests per minute
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "4000000"))  # tokens per minute (estimated)
+GEMINI_BURST_SECONDS = float(os.getenv("GEMINI_BURST_SECONDS", "3"))
+# 429/5xx/transport errors: retries, and the backoff base and cap in seconds
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "20"))
+
+# Gemini response cache: in-process LRU/TTL, plus an optional tier shared through MongoDB
+GEMINI_CACHE_ENABLED = os.getenv("GEMINI_CACHE_ENABLED", "1") == "1"
+GEMINI_CACHE_SIZE = int(os.getenv("GEMINI_CACHE_SIZE", "1024"))
+GEMINI_CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", "600"))  # seconds
+GEMINI_CACHE_SHARED = os.getenv("GEMINI_CACHE_SHARED", "0") == "1"
+
+# spaCy model shared by every service; it needs word vectors (pip install en_core_web_md)
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_md")
+
+# Sentiment scorer: "lexicon" (batched, scores the spaCy tokens context analysis already has)
+# or "textblob" (the original per-message TextBlob analyzer; same lexicon and score buckets)
+SENTIMENT_ENGINE = os.getenv("SENTIMENT_ENGINE", "lexicon")
+
+# Vent summaries: "gemini" (one Gemini call per vent) or "extractive" (the
+# SUMMARY_MAX_SENTENCES sentences closest to the vent's vector, from the local spaCy pass)
+SUMMARIZER = os.getenv("SUMMARIZER", "gemini")
+SUMMARY_MAX_SENTENCES = int(os.getenv("SUMMARY_MAX_SENTENCES", "2"))
+
+# CPU-bound NLP for /chat: 0 runs it on the event loop's thread pool; N > 0 uses N worker
+# processes, each with its own copy of the spaCy model. Requests arriving within the
+# window are batched into one nlp.pipe call of at most NLP_BATCH_MAX texts.
+NLP_POOL_SIZE = int(os.getenv("NLP_POOL_SIZE", "0"))
+NLP_BATCH_MAX = int(os.getenv("NLP_BATCH_MAX", "32"))
+NLP_BATCH_WINDOW_MS = float(os.getenv("NLP_BATCH_WINDOW_MS", "2"))
+
+# Per-user memory index: "exact" (brute force) or "ivf" (approximate, for very long histories)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+VECTOR_INDEX_MIN_TRAIN = int(os.getenv("VECTOR_INDEX_MIN_TRAIN", "2048"))
+VECTOR_INDEX_MAX_USERS = int(os.getenv("VECTOR_INDEX_MAX_USERS", "256"))
+# A cached index is trusted this many seconds before its document count is checked again.
+# This worker's own saves are added to it immediately; other workers' saves show up once
+# the check sees a different count, which rebuilds the user's whole index.
+VECTOR_INDEX_REFRESH_SECONDS = float(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "10"))
+
+# /chat/batch: max vents per request and max vents with Gemini calls in flight
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_GEMINI_CONCURRENCY = int(os.getenv("BATCH_GEMINI_CONCURRENCY", "8"))
+
+# Follow-up notifications: first one after a thread has been quiet this long, a second
+# one this long after the first; threads idle longer than the max age are skipped
+FOLLOWUP_QUIET_SECONDS = float(os.getenv("FOLLOWUP_QUIET_SECONDS", "15"))
+FOLLOWUP_REPEAT_SECONDS = float(os.getenv("FOLLOWUP_REPEAT_SECONDS", "15"))
+FOLLOWUP_MAX_AGE_SECONDS = float(os.getenv("FOLLOWUP_MAX_AGE_SECONDS", "300"))
+FOLLOWUP_BATCH_SIZE = int(os.getenv("FOLLOWUP_BATCH_SIZE", "500"))
+FOLLOWUP_MAX_BATCHES = int(os.getenv("FOLLOWUP_MAX_BATCHES", "20"))  # per scheduler tick
+
+# Check-up messages are generated in the background once a thread has been quiet for
+# FOLLOWUP_QUIET_SECONDS and stored on it for /checkup; up to CHECKUP_BATCH_SIZE threads
+# per scheduler tick, with at most CHECKUP_CONCURRENCY Gemini calls in flight
+CHECKUP_PREGENERATE_ENABLED = os.getenv("CHECKUP_PREGENERATE_ENABLED", "1") == "1"
+CHECKUP_BATCH_SIZE = int(os.getenv("CHECKUP_BATCH_SIZE", "100"))
+CHECKUP_CONCURRENCY = int(os.getenv("CHECKUP_CONCURRENCY", "8"))
+CHECKUP_RETRY_SECONDS = float(os.getenv("CHECKUP_RETRY_SECONDS", "60"))  # after a failed generation
+
+# Only the worker holding the scheduler lease runs scheduled jobs. It renews the lease
+# every SCHEDULER_LEASE_RENEW_SECONDS; a standby takes over once it is TTL seconds stale.
+SCHEDULER_LEASE_TTL_SECONDS = float(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", "30"))
+SCHEDULER_LEASE_RENEW_SECONDS = float(os.getenv("SCHEDULER_LEASE_RENEW_SECONDS", "10"))
+
+# Documents fetched per round trip when iterating conversation cursors
+MONGO_CURSOR_BATCH_SIZE = int(os.getenv("MONGO_CURSOR_BATCH_SIZE", "1000"))
+
+# Write-behind conversation saves: queue inserts and flush them in batches off the request path.
+# The thread, topic and rollup updates for a conversation run once its batch is written, so
+# /history and follow-ups trail /chat by up to WRITE_BEHIND_FLUSH_INTERVAL.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))  # seconds
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "2"))  # seconds before writing inline
+WRITE_BEHIND_RETRY_INTERVAL = float(os.getenv("WRITE_BEHIND_RETRY_INTERVAL", "5"))  # seconds between retries of failed batches
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "12"))  # retries before a conversation is dead-lettered
+
+# Memory context for reflections: the MEMORY_TOP_K most relevant past entries (similarity,
+# plus a small bonus for recent ones) within a hard MEMORY_MAX_CHARS budget (~4 chars per
+# token). Each thread also keeps a rolling summary, re-compacted every THREAD_SUMMARY_EVERY turns.
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "3"))
+MEMORY_MAX_CHARS = int(os.getenv("MEMORY_MAX_CHARS", "1200"))
+MEMORY_RECENCY_WEIGHT = float(os.getenv("MEMORY_RECENCY_WEIGHT", "0.05"))
+THREAD_SUMMARY_EVERY = int(os.getenv("THREAD_SUMMARY_EVERY", "5"))
+THREAD_SUMMARY_MAX_CHARS = int(os.getenv("THREAD_SUMMARY_MAX_CHARS", "600"))
+
+# User the chat endpoints act as until real auth exists; also the /history default
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "shivani")
+
+# /readyz: seconds to wait for the MongoDB ping before reporting not ready
+READINESS_DB_TIMEOUT = float(os.getenv("READINESS_DB_TIMEOUT", "2"))
+
+# Add a Server-Timing header with the per-stage breakdown to every response (debugging aid)
+DEBUG_TIMING_HEADER = os.getenv("DEBUG_TIMING_HEADER", "0") == "1"
 
 
 MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
+# connect=False: nothing is opened until the first operation (the startup ping)
+client = MongoClient(MONGO_URI, connect=False)
 
 db = client["reflectinDB"]
-conversations = db["conversations"]  # one collection for now
+conversations = db["conversations"]
+conversations_dead_letter = db["conversations_dead_letter"]  # write-behind inserts that kept failing
+threads = db["threads"]  # per-thread follow-up state
+topic_stats = db["topic_stats"]  # per-user topic document frequencies
+leases = db["leases"]  # leader leases (one worker runs the scheduled jobs)
+rollups = db["rollups"]  # per-user sentiment buckets, topic counts and per-thread trajectories
+checkpoints = db["checkpoints"]  # progress of resumable maintenance commands
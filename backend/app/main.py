@@ -1,10 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import router
-from app.services.scheduler import start_scheduler
+from app.services import metrics
+from app.startup import lifespan
+from app.config import DEBUG_TIMING_HEADER
 
 
-app = FastAPI(title="ReflectIn Backend")
+# Models, indexes, the scheduler and the write-behind queue are set up in the lifespan.
+app = FastAPI(title="ReflectIn Backend", lifespan=lifespan)
 
 # Configure CORS to allow requests from any origin (adjust for production)
 app.add_middleware(
@@ -15,12 +18,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request stage breakdown as a Server-Timing header (set DEBUG_TIMING_HEADER=1)
+if DEBUG_TIMING_HEADER:
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        timings = metrics.start_request_timing()
+        response = await call_next(request)
+        if timings:
+            response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return response
+
 # Include API routes
 app.include_router(router)
 
-# Start the scheduler for follow-ups
-start_scheduler()
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
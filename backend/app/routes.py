@@ -1,8 +1,16 @@
 # routes.py
+import json
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-from app.services.gemini_service import process_vent, generate_checkup_message
+from typing import List, Optional
+from app.config import BATCH_MAX_ITEMS, DEFAULT_USER_ID
+from app.services.gemini_client import response_cache
+from app.services import metrics, rollups, conversation_history
+from app import startup
+
+# gemini_service pulls in spaCy and TextBlob, so the chat handlers import it on
+# call; the lifespan imports it while warming up, so requests never pay for it.
 
 router = APIRouter()
 
@@ -23,10 +31,27 @@ class ChatResponse(BaseModel):
     sentiment: dict
     context: dict
 
+class BatchChatRequest(BaseModel):
+    items: List[ChatRequest]
+
+class BatchChatItem(BaseModel):
+    status: str
+    error: Optional[str] = None
+    user_message: str = ""
+    summary: str = ""
+    bot_reply: str = ""
+    thread_id: str = ""
+    sentiment: dict = {}
+    context: dict = {}
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItem]
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat_with_bot(req: ChatRequest):
+    from app.services.gemini_service import process_vent
     # Pass quiz answers through to your service
-    result = process_vent(
+    result = await process_vent(
         vent_text=req.user_message,
         persona=req.persona,
         band1=req.band1,
@@ -45,13 +70,127 @@ async def chat_with_bot(req: ChatRequest):
         context   = result.get("context", {})
     )
 
+@router.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_with_bot_batch(req: BatchChatRequest):
+    """Process many vents at once (journal imports); one result per item, in order."""
+    from app.services.gemini_service import process_vents
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    results = await process_vents([item.model_dump() for item in req.items])
+    return BatchChatResponse(results=[BatchChatItem(**result) for result in results])
+
+@router.post("/chat/stream")
+async def chat_with_bot_stream(req: ChatRequest):
+    """
+    Same as /chat, but as Server-Sent Events: a `meta` event first, then `token`
+    events as the reflection streams in, and a final `done` (or `error`) event
+    carrying the full ChatResponse body.
+    """
+    from app.services.gemini_service import stream_vent
+    events = stream_vent(
+        vent_text=req.user_message,
+        persona=req.persona,
+        band1=req.band1,
+        band2=req.band2,
+        band3=req.band3,
+        band4=req.band4,
+        band5=req.band5
+    )
+
+    async def sse():
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream, which would defeat time-to-first-token.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/checkup")
 async def checkup(thread_id: str = Query(..., description="The thread ID for which to generate a check‑in message")):
+    from app.services.gemini_service import generate_checkup_message
     try:
         # Now uses the provided thread_id
-        checkup_message = generate_checkup_message(thread_id)
+        checkup_message = await generate_checkup_message(thread_id)
         if not checkup_message:
             raise HTTPException(status_code=404, detail="Checkup message not found")
         return {"checkup_message": checkup_message}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/history")
+def history(
+    user_id: str = Query(DEFAULT_USER_ID),
+    granularity: str = Query("day", pattern="^(day|week)$"),
+    limit: int = Query(30, ge=1, le=366),
+):
+    # Sentiment buckets, topic counts and thread trajectories, read from the rollups
+    return rollups.get_history(user_id, granularity, limit)
+
+@router.get("/conversations")
+def list_conversations(
+    user_id: str = Query(DEFAULT_USER_ID),
+    view: str = Query("list", pattern="^(list|full)$"),
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
+    # A page of the user's conversations, newest first
+    return conversation_page("user_id", user_id, view, limit, cursor)
+
+@router.get("/conversations/export")
+def export_conversations(user_id: str = Query(DEFAULT_USER_ID), view: str = Query("full", pattern="^(list|full)$")):
+    # Every conversation as NDJSON, oldest first, streamed from the cursor
+    return StreamingResponse(
+        conversation_history.export_ndjson(user_id, view),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="conversations-{user_id}.ndjson"'},
+    )
+
+@router.get("/threads/{thread_id}/conversations")
+def list_thread_conversations(
+    thread_id: str,
+    view: str = Query("list", pattern="^(list|full)$"),
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
+    # A page of the thread's conversations, newest first
+    return conversation_page("thread_id", thread_id, view, limit, cursor)
+
+def conversation_page(scope: str, value: str, view: str, limit: int, cursor: Optional[str]):
+    try:
+        return conversation_history.get_page(scope, value, view, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/cache/stats")
+async def cache_stats():
+    # Hit/miss counters for the Gemini response cache
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Stage latency histograms, scheduler tick durations and cache/queue counters
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    # Readiness: startup finished, models loaded and MongoDB reachable right now
+    checks = {
+        "started": startup.state["started"],
+        "models": startup.state["models_loaded"],
+        "database": await startup.database_reachable(),
+    }
+    ready = all(checks.values())
+    body = {"ready": ready, "checks": checks, "startup_ms": startup.state["steps"]}
+    if startup.state["errors"]:
+        body["errors"] = startup.state["errors"]
+    return JSONResponse(body, status_code=200 if ready else 503)
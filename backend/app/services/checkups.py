@@ -0,0 +1,119 @@
+# checkups.py
+"""
+Check-up messages for threads that have gone quiet.
+
+/checkup used to ask Gemini for a message every time a notification was
+opened. The message is now generated ahead of time and stored on the thread:
+
+  - Each vent sets the thread's checkup_due_at to FOLLOWUP_QUIET_SECONDS
+    later and removes any stored message, since it no longer reflects the
+    latest conversation.
+  - A scheduler job picks up to CHECKUP_BATCH_SIZE due threads from the
+    sparse checkup_due_at index. It reads their latest summaries in one
+    aggregation and generates their messages with at most
+    CHECKUP_CONCURRENCY Gemini calls in flight, at BACKGROUND priority.
+    The results are written with one bulk_write.
+  - Each write only matches if the thread's last_activity is still the one
+    that was read, so a vent arriving during generation wins. A failed
+    generation is retried CHECKUP_RETRY_SECONDS later.
+
+/checkup reads the stored message and only generates one on demand (at
+CHECKUP priority) when none is stored yet.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+from app.config import (
+    CHECKUP_BATCH_SIZE,
+    CHECKUP_CONCURRENCY,
+    CHECKUP_RETRY_SECONDS,
+    FOLLOWUP_MAX_AGE_SECONDS,
+)
+from app.services.gemini_client import get_client, build_payload
+from app.services.gemini_scheduler import BACKGROUND
+from app.utils import db
+
+FALLBACK_CHECKUP = "Hey, just checking in—how are you feeling now? Has the stress eased a bit?"
+
+
+def build_checkup_payload(summary_text: Optional[str]) -> dict:
+    summary_text = (summary_text or "").strip()
+    if summary_text:
+        prompt_text = (
+            f"Based on our previous conversation summarized as: '{summary_text}', "
+            f"generate one clear, creative, and supportive check-up message asking: "
+            f"'How are you feeling now? Has your situation improved?' "
+            f"Keep it friendly and uplifting. REMEMBER JUST ONE RESPONSE. that should be the only thing in the output. Also keep in mind to definitely bring up the main topic of conversation in the follow up message."
+        )
+    else:
+        prompt_text = (
+            "Generate one clear, creative, and supportive check-up message: 'How are you feeling now?'. REMEMBER JUST ONE RESPONSE. that should be the only thing in the output."
+        )
+    return build_payload(
+        prompt_text,
+        maxOutputTokens=50,  # Limit to one concise message.
+        temperature=0.7,
+        top_p=0.9,
+        top_k=40
+    )
+
+
+async def request_checkup(summary_text: Optional[str], priority: int) -> Optional[str]:
+    """One check-up message from Gemini, or None if it returned no text."""
+    text = await get_client().generate_text(build_checkup_payload(summary_text), priority=priority)
+    return text.strip() if text and text.strip() else None
+
+
+async def generate_checkups(thread_ids: List[str], summaries: dict) -> List[Optional[str]]:
+    """Messages for many threads, CHECKUP_CONCURRENCY at a time; None where generation failed."""
+    limit = asyncio.Semaphore(CHECKUP_CONCURRENCY)
+
+    async def one(thread_id):
+        async with limit:
+            try:
+                return await request_checkup(summaries.get(thread_id), BACKGROUND)
+            except Exception as e:
+                print("Error pre-generating check-up message:", e)
+                return None
+
+    return await asyncio.gather(*(one(thread_id) for thread_id in thread_ids))
+
+
+async def pregenerate_checkups(now: datetime = None) -> int:
+    """Generate and store messages for one batch of due threads; returns how many were stored."""
+    now = now or datetime.utcnow()
+    due = await asyncio.to_thread(db.checkups_due, now, CHECKUP_BATCH_SIZE)
+    if not due:
+        return 0
+
+    operations = []
+    fresh = []
+    for thread in due:
+        last_activity = thread.get("last_activity")
+        if not last_activity or (now - last_activity).total_seconds() > FOLLOWUP_MAX_AGE_SECONDS:
+            # Nobody will be notified about this thread any more.
+            operations.append(UpdateOne({"_id": thread["_id"], "last_activity": last_activity},
+                                        {"$unset": {"checkup_due_at": ""}}))
+        else:
+            fresh.append(thread)
+
+    thread_ids = [thread["_id"] for thread in fresh]
+    summaries = await asyncio.to_thread(db.latest_thread_summaries, thread_ids) if thread_ids else {}
+    messages = await generate_checkups(thread_ids, summaries)
+
+    stored = 0
+    for thread, message in zip(fresh, messages):
+        match = {"_id": thread["_id"], "last_activity": thread["last_activity"]}
+        if message is None:
+            operations.append(UpdateOne(match, {"$set": {"checkup_due_at": now + timedelta(seconds=CHECKUP_RETRY_SECONDS)}}))
+            continue
+        operations.append(UpdateOne(match, {
+            "$set": {"checkup_message": message, "checkup_generated_at": now},
+            "$unset": {"checkup_due_at": ""},
+        }))
+        stored += 1
+    await asyncio.to_thread(db.bulk_update_threads, operations)
+    return stored
@@ -0,0 +1,148 @@
+# context_engine.py
+"""
+Context extraction: entities plus a ranked list of topics per vent.
+
+The filler lexicon is compiled once per process: single words into a set of
+lowercase lemmas, multi-word phrases ("you know", "at the end of the day")
+into a spaCy PhraseMatcher, so tokens inside a filler phrase are dropped too.
+
+Topics are ranked by tf-idf against the user's own history. Per-user document
+frequencies live in the topic_stats collection and are maintained with $inc
+each time a conversation is saved (record_topics), so ranking needs a single
+find_one projected onto the current vent's terms. The first topic is the
+vent's `topic`, and ties keep the order words appear in, so it is stable.
+"""
+import math
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from spacy.matcher import PhraseMatcher
+from spacy.tokens import Doc
+
+from app.services import nlp_models
+from app.utils import db
+
+FILLER_WORDS = [
+    "like", "uh", "um", "you know", "so", "actually", "basically", "literally", "just",
+    "well", "okay", "right", "yeah", "y'know", "I mean", "sort of", "kind of", "sorta", "kinda",
+    "anyway", "really", "honestly", "truthfully", "in fact", "you see", "mind you",
+    "at the end of the day", "to be honest", "to be fair", "you get me", "whatever", "stuff",
+    "things", "thing", "obviously", "apparently", "clearly", "seriously",
+    "probably", "maybe", "perhaps", "like I said", "I guess", "I suppose", "I think", "I believe",
+    "you know what I mean", "you know what I'm saying", "as I was saying", "for sure", "I reckon",
+    "to be clear", "to be real", "let me think", "hold on", "wait a minute", "give me a sec", "I feel like",
+    "it seems like", "it looks like", "it sounds like", "it feels like", "if that makes sense",
+    "in my opinion", "from my perspective", "from my point of view",
+    "from what I can tell", "from what I understand", "as far as I know",
+    "kind of like", "sort of like", "more or less", "give or take", "more like", "less like",
+    "to some extent", "to a certain extent", "to a degree", "at least",
+    "at most", "in some way", "in a way", "in some sense", "in a sense",
+    "somehow", "somewhat", "in other words", "in a nutshell", "generally speaking",
+    "for the most part", "by and large", "at this point", "to this day", "to this moment",
+    "to this extent", "to this degree", "for instance", "for example", "like for instance",
+    "you could say", "in a manner of speaking", "in a way of speaking", "for what it's worth",
+    "on the whole", "in a way of thinking", "so to speak", "as it were",
+]
+
+
+class ContextEngine:
+    def __init__(self, nlp, fillers: Sequence[str] = FILLER_WORDS):
+        self.single_fillers = frozenset(f.lower() for f in fillers if " " not in f)
+        self.matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+        phrases = [f for f in fillers if " " in f]
+        self.matcher.add("FILLER", [nlp.make_doc(phrase) for phrase in phrases])
+
+    def candidate_terms(self, doc: Doc) -> List[str]:
+        """Topic lemmas in order of appearance (with repeats), fillers and stop words removed."""
+        in_filler = set()
+        for _, start, end in self.matcher(doc):
+            in_filler.update(range(start, end))
+        terms = []
+        for token in doc:
+            if token.i in in_filler or not token.is_alpha or token.is_stop:
+                continue
+            lemma = token.lemma_.lower()
+            if lemma and lemma not in self.single_fillers and token.lower_ not in self.single_fillers:
+                terms.append(lemma)
+        return terms
+
+    @staticmethod
+    def rank(terms: List[str], total_docs: int, df: Dict[str, int]) -> List[str]:
+        """Unique terms ordered by tf-idf against the user's history; ties keep first appearance."""
+        counts = Counter(terms)
+        first_seen = {}
+        for i, term in enumerate(terms):
+            first_seen.setdefault(term, i)
+        weights = {
+            term: count * (math.log((1 + total_docs) / (1 + df.get(term, 0))) + 1)
+            for term, count in counts.items()
+        }
+        return sorted(weights, key=lambda term: (-weights[term], first_seen[term]))
+
+    def analyze(self, doc: Doc, total_docs: int = 0, df: Optional[Dict[str, int]] = None) -> dict:
+        return {
+            "entities": [ent.text for ent in doc.ents],
+            "topics": self.rank(self.candidate_terms(doc), total_docs, df or {}),
+        }
+
+
+_engine: Optional[ContextEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> ContextEngine:
+    """The process-wide engine, compiled against the shared pipeline on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ContextEngine(nlp_models.get_nlp())
+    return _engine
+
+
+def analyze_text(text: str, user_id: Optional[str] = None) -> dict:
+    return analyze_texts([text], user_id)[0]
+
+
+def analyze_texts(texts: List[str], user_id: Optional[str] = None, batch_size: int = 256) -> List[dict]:
+    """
+    Context for many texts with one nlp.pipe pass and, when user_id is given,
+    one document-frequency lookup covering every candidate term.
+    """
+    return analyze_docs(nlp_models.pipe(texts, "context", batch_size=batch_size), user_id)
+
+
+def analyze_docs(docs: Iterable[Doc], user_id: Optional[str] = None) -> List[dict]:
+    """analyze_texts for docs already run through the "context" pipeline."""
+    engine = get_engine()
+    terms_per_doc = []
+    entities_per_doc = []
+    for doc in docs:
+        terms_per_doc.append(engine.candidate_terms(doc))
+        entities_per_doc.append([ent.text for ent in doc.ents])
+    return rank_contexts(terms_per_doc, entities_per_doc, user_id)
+
+
+def rank_contexts(terms_per_doc: List[List[str]], entities_per_doc: List[List[str]],
+                  user_id: Optional[str] = None) -> List[dict]:
+    """Contexts from already extracted candidate terms and entities (e.g. from an NLP worker)."""
+    total_docs, df = 0, {}
+    if user_id is not None:
+        vocabulary = {term for terms in terms_per_doc for term in terms}
+        total_docs, df = db.get_topic_frequencies(user_id, vocabulary)
+
+    return [
+        {"entities": entities, "topics": ContextEngine.rank(terms, total_docs, df)}
+        for entities, terms in zip(entities_per_doc, terms_per_doc)
+    ]
+
+
+def record_topics(user_id: str, topic_lists: Iterable[List[str]]) -> None:
+    """Count saved documents toward the user's topic document frequencies."""
+    db.increment_topic_frequencies(user_id, [set(topics) for topics in topic_lists])
+
+
+def replace_topics(user_id: str, changes: Iterable[Tuple[List[str], List[str]]]) -> None:
+    """Move re-analyzed documents' counts from their (old, new) topic lists' old topics to the new ones."""
+    db.shift_topic_frequencies(user_id, [(set(old), set(new)) for old, new in changes])
@@ -0,0 +1,75 @@
+# conversation_history.py
+"""
+Read API for past conversations.
+
+Pages use keyset pagination on (timestamp, _id), newest first. The cursor
+is an opaque token holding the last item's key, and the next page is a
+range query on the (user_id|thread_id, timestamp, _id) index. Every page
+costs the same however deep into the history it is, and a conversation
+saved between requests never shifts or repeats items.
+
+Views pick the projection: "list" ships only what a list row shows, "full"
+everything except the embedding.
+
+The export streams a user's whole history as NDJSON, oldest first, one
+document per line, as the Mongo cursor yields it. Memory use stays flat
+however long the history is.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.utils import db
+
+VIEWS = {
+    "list": db.CONVERSATION_LIST_FIELDS,
+    "full": db.CONVERSATION_FULL_FIELDS,
+}
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["timestamp"].isoformat(), str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, ObjectId]:
+    """The (timestamp, _id) key in a cursor; raises ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        timestamp, _id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), ObjectId(_id)
+    except (ValueError, TypeError, InvalidId) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def serialize(doc: dict) -> dict:
+    """A conversation as JSON-ready values: `id` instead of the ObjectId, ISO timestamps."""
+    item = {"id": str(doc["_id"])}
+    for key, value in doc.items():
+        if key == "_id":
+            continue
+        item[key] = value.isoformat() if isinstance(value, datetime) else value
+    return item
+
+
+def get_page(scope: str, value: str, view: str = "list", limit: int = 20,
+             cursor: Optional[str] = None) -> dict:
+    """One page of a user's or thread's conversations and the cursor for the next (None at the end)."""
+    before = decode_cursor(cursor) if cursor else None
+    # One extra row tells whether another page exists without a count query.
+    docs = db.conversation_page(scope, value, VIEWS[view], limit + 1, before)
+    page = docs[:limit]
+    return {
+        "items": [serialize(doc) for doc in page],
+        "next_cursor": encode_cursor(page[-1]) if len(docs) > limit else None,
+    }
+
+
+def export_ndjson(user_id: str, view: str = "full") -> Iterator[bytes]:
+    """A user's conversations, oldest first, one JSON document per line."""
+    for doc in db.iter_user_conversations(user_id, VIEWS[view]):
+        yield (json.dumps(serialize(doc), ensure_ascii=False, default=str) + "\n").encode("utf-8")
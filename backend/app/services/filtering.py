@@ -1,42 +1,236 @@
 # filtering.py
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import spacy
-from app.config import conversations
-from typing import Tuple, Optional
+from app.config import (
+    VECTOR_INDEX, VECTOR_INDEX_NPROBE, VECTOR_INDEX_MIN_TRAIN, VECTOR_INDEX_MAX_USERS, VECTOR_INDEX_REFRESH_SECONDS
+)
+from app.services.vector_index import make_index
+from app.services.thread_centroids import ThreadCentroids, repair_update, unit
+from app.services import nlp_models
+from app.services.memory_builder import rank_matches, build_memory_context, thread_summary
+from app.utils import db
+from typing import Dict, List, Tuple, Optional
 
-# Load a model with good vectors; ensure you have installed en_core_web_md
+# The model needs good vectors; ensure you have installed en_core_web_md
 # pip install https://github.com/explosion/spacy-models/releases/download/en_core_web_md-3.5.0/en_core_web_md-3.5.0.tar.gz
-nlp_md = spacy.load("en_core_web_md")  
+# It is loaded once and shared through nlp_models; embeddings only run the tokenizer.
 
 def get_embedding(text: str) -> np.ndarray:
     """Compute an embedding vector for the text using Spacy."""
-    doc = nlp_md(text)
+    doc = nlp_models.process(text, "vectors")
     return doc.vector
 
+def get_embeddings(texts: List[str], batch_size: int = 256) -> np.ndarray:
+    """Embed many texts with one nlp.pipe pass; row i is the embedding of texts[i]."""
+    if not texts:
+        return np.zeros((0, nlp_models.vectors_length()), dtype=np.float32)
+    docs = nlp_models.pipe(texts, "vectors", batch_size=batch_size)
+    return np.asarray([doc.vector for doc in docs], dtype=np.float32)
+
+def entry_text(entry: dict) -> str:
+    """The text an entry is embedded by: its summary, falling back to the user message."""
+    return entry.get("summary", "") or entry.get("user_message", "")
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row, leaving all-zero rows (e.g. out-of-vocabulary text) as zeros."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def load_user_vectors(user_id: str) -> Tuple[List[dict], np.ndarray]:
+    """
+    Load every embeddable entry for the user together with one row-normalized
+    float32 matrix of their stored embeddings (row i belongs to entries[i]).
+
+    Entries written before embeddings were persisted are embedded once here and
+    the vector is written back, so they never need re-embedding again.
+    """
+    entries = []
+    vectors = []
+    missing = []
+    for entry in db.iter_user_conversations(user_id, db.VECTOR_FIELDS):
+        vector = entry.get("embedding")
+        if vector is None:
+            if not entry_text(entry):
+                continue
+            missing.append(len(entries))
+        entries.append(entry)
+        vectors.append(vector)
+
+    if missing:
+        # Embed all legacy entries in one batch.
+        embedded = get_embeddings([entry_text(entries[i]) for i in missing])
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+        db.set_embeddings((entries[i]["_id"], vector.tolist()) for i, vector in zip(missing, embedded))
+
+    if not vectors:
+        return entries, np.zeros((0, nlp_models.vectors_length()), dtype=np.float32)
+    return entries, normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+def score_entries(matrix: np.ndarray, current_embedding: np.ndarray) -> np.ndarray:
+    """Cosine similarity of current_embedding against every row of a normalized matrix."""
+    query = normalize_rows(np.asarray(current_embedding, dtype=np.float32))
+    return matrix @ query
+
+
+class UserMemory:
+    """
+    A user's embeddable entries, the vector index over them (index row i <->
+    entries[i]), and the centroid of each of their threads.
+    """
+
+    def __init__(self):
+        options = {}
+        if VECTOR_INDEX == "ivf":
+            options = {"nprobe": VECTOR_INDEX_NPROBE, "min_train_size": VECTOR_INDEX_MIN_TRAIN}
+        self.index = make_index(VECTOR_INDEX, nlp_models.vectors_length(), **options)
+        self.entries: List[dict] = []
+        self.thread_rows: Dict[str, List[int]] = {}
+        self.centroids = ThreadCentroids(nlp_models.vectors_length())
+        self.doc_count = 0
+        self.checked_at = 0.0  # time.monotonic() of the last document count check
+
+    def add(self, entries: List[dict], vectors: np.ndarray) -> None:
+        # The vectors live in the index; don't keep a second copy on the entry dicts.
+        start = len(self.entries)
+        self.entries.extend({k: v for k, v in entry.items() if k != "embedding"} for entry in entries)
+        # Entries with an all-zero embedding can't match anything and don't count towards centroids.
+        nonzero = np.atleast_2d(vectors).any(axis=1) if len(entries) else []
+        for position, (entry, has_vector) in enumerate(zip(entries, nonzero), start):
+            if entry.get("thread_id") and has_vector:
+                self.thread_rows.setdefault(entry["thread_id"], []).append(position)
+        if len(entries):
+            self.index.add(vectors)
+
+    def search(self, current_embedding: np.ndarray, threshold: float) -> List[dict]:
+        """Entries scoring >= threshold, in insertion (Mongo) order."""
+        positions, _ = self.index.search(current_embedding, threshold)
+        return [self.entries[i] for i in positions]
+
+    def search_ranked(self, current_embedding: np.ndarray, threshold: float) -> Tuple[List[dict], List[dict]]:
+        """
+        Entries scoring >= threshold, both in insertion order and as the top-k
+        for the memory context (by similarity and recency, best first).
+        """
+        positions, scores = self.index.search(current_embedding, threshold)
+        top = rank_matches(positions, scores, len(self.entries))
+        return [self.entries[i] for i in positions], [self.entries[i] for i in top]
+
+    def search_thread(self, thread_id: str, current_embedding: np.ndarray, threshold: float) -> List[dict]:
+        """
+        The thread's entries scoring >= threshold, as the top-k for the memory
+        context (by similarity and recency, best first). Only the thread's rows are scored.
+        """
+        positions = np.asarray(self.thread_rows.get(thread_id, []), dtype=np.int64)
+        if len(positions) == 0:
+            return []
+        scores = score_entries(self.index.vectors[positions], current_embedding)
+        keep = scores >= threshold
+        return [self.entries[i] for i in rank_matches(positions[keep], scores[keep], len(self.entries))]
+
+
+def load_thread_centroids(user_id: str, memory: UserMemory) -> None:
+    """
+    Fill memory.centroids from the centroids stored on the user's threads.
+    Only a thread whose stored count doesn't match its entries (a thread from
+    before centroids were kept, or a lost concurrent update) is recomputed from
+    its entries, and the stored centroid is rewritten.
+    """
+    stored = db.thread_centroids(user_id, list(memory.thread_rows))
+    vectors = memory.index.vectors
+    repairs = []
+    for thread_id in sorted(memory.thread_rows):
+        rows = memory.thread_rows[thread_id]
+        centroid, count = stored.get(thread_id, (None, 0))
+        if count == len(rows) and centroid is not None and len(centroid) == memory.centroids.dim:
+            memory.centroids.update(thread_id, np.asarray(centroid, dtype=np.float32), count)
+            continue
+        mean = vectors[rows].mean(axis=0)
+        memory.centroids.update(thread_id, mean, len(rows))
+        repairs.append(repair_update(user_id, thread_id, mean, len(rows)))
+    db.bulk_update_threads(repairs)
+
+# Per-process LRU of loaded user indexes, updated incrementally by remember_entry().
+_user_memories: "OrderedDict[str, UserMemory]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+def get_user_memory(user_id: str) -> UserMemory:
+    """
+    Return the cached index for the user, (re)building it from MongoDB when it is
+    missing or when the user's document count shows another process wrote to it.
+
+    The count costs a query, so a cached index is used as is for
+    VECTOR_INDEX_REFRESH_SECONDS after its last check. Saves made by this
+    process are added by remember_entry() right away; saves by other workers
+    are picked up by the next check, which rebuilds the whole index.
+    """
+    with _memory_lock:
+        memory = _user_memories.get(user_id)
+        if memory is not None and time.monotonic() - memory.checked_at < VECTOR_INDEX_REFRESH_SECONDS:
+            _user_memories.move_to_end(user_id)
+            return memory
+
+    doc_count = db.count_user_conversations(user_id)
+    with _memory_lock:
+        memory = _user_memories.get(user_id)
+        if memory is not None and memory.doc_count == doc_count:
+            memory.checked_at = time.monotonic()
+            _user_memories.move_to_end(user_id)
+            return memory
+
+    entries, matrix = load_user_vectors(user_id)
+    memory = UserMemory()
+    memory.add(entries, matrix)
+    load_thread_centroids(user_id, memory)
+    memory.doc_count = doc_count
+    memory.checked_at = time.monotonic()
+
+    with _memory_lock:
+        _user_memories[user_id] = memory
+        _user_memories.move_to_end(user_id)
+        while len(_user_memories) > VECTOR_INDEX_MAX_USERS:
+            _user_memories.popitem(last=False)
+    return memory
+
+def forget_user_memory(user_id: Optional[str] = None) -> None:
+    """Drop the cached index for a user (or all users) so the next lookup reloads it."""
+    with _memory_lock:
+        if user_id is None:
+            _user_memories.clear()
+        else:
+            _user_memories.pop(user_id, None)
+
+def remember_entry(user_id: str, entry: dict) -> None:
+    """Add a just-saved entry to the user's cached index, if that index is loaded."""
+    with _memory_lock:
+        memory = _user_memories.get(user_id)
+        if memory is None:
+            return
+        memory.doc_count += 1
+        if entry_text(entry) and entry.get("embedding") is not None:
+            slim = {k: entry.get(k) for k in db.VECTOR_FIELDS if k in entry}
+            slim["_id"] = entry.get("_id")
+            memory.add([slim], np.asarray(entry["embedding"], dtype=np.float32))
+            vector = unit(entry["embedding"])
+            if entry.get("thread_id") and vector is not None:
+                memory.centroids.update(entry["thread_id"], vector)
+
+def format_memory_line(entry: dict) -> str:
+    past_summary = entry.get("summary", "").strip()
+    past_reply = entry.get("bot_reply", "").strip()
+    return f"Previously, you mentioned: '{past_summary}' and I replied: '{past_reply}'."
+
 def query_similar_entries(user_id: str, current_text: str, threshold: float = 0.75) -> str:
     """
     Query MongoDB for past entries for the given user whose summary (or user_message) 
     embedding is similar to the embedding of current_text. Returns an aggregated memory string.
     """
     current_embedding = get_embedding(current_text)
-    
-    # Retrieve all past entries for the user
-    entries = list(conversations.find({"user_id": user_id}))
-    
-    memory_lines = []
-    for entry in entries:
-        # Use the 'summary' field if available; otherwise fall back to user_message
-        past_text = entry.get("summary", "") or entry.get("user_message", "")
-        if past_text:
-            past_embedding = get_embedding(past_text)
-            # Compute cosine similarity between current and past embeddings
-            sim = cosine_similarity([current_embedding], [past_embedding])[0][0]
-            if sim >= threshold:
-                past_summary = entry.get("summary", "").strip()
-                past_reply = entry.get("bot_reply", "").strip()
-                memory_lines.append(f"Previously, you mentioned: '{past_summary}' and I replied: '{past_reply}'.")
-    return "\n".join(memory_lines)
+    _, top = get_user_memory(user_id).search_ranked(current_embedding, threshold)
+    return build_memory_context([format_memory_line(entry) for entry in top])
 
 def get_prompt_for_reflection_with_memory(score: int, current_vent: str, previous_summary: str) -> str:
     """
@@ -81,36 +275,38 @@ def get_prompt_for_reflection_with_memory(score: int, current_vent: str, previou
         )
 
 
-def query_similar_entries_with_thread(user_id: str, current_text: str, threshold: float = 0.9) -> Tuple[Optional[str], str]:
+# Applied to thread centroids when resolving a thread (see thread_centroids), and to the
+# chosen thread's entries when picking memory lines.
+THREAD_SIMILARITY_THRESHOLD = 0.9
+
+def query_similar_entries_with_thread(user_id: str, current_text: str, threshold: float = THREAD_SIMILARITY_THRESHOLD) -> Tuple[Optional[str], str]:
     """
-    Query MongoDB for past entries for the given user whose summary (or user_message) 
-    embedding is similar to the embedding of current_text.
-    
+    Find the user's thread whose centroid embedding is most similar to the
+    embedding of current_text.
+
     Returns:
-      - A thread ID (if found) from one of the similar entries, or None if no similar thread exists.
-      - An aggregated memory string of the similar entries.
+      - The best-scoring thread ID if its centroid scores >= threshold, or None if no similar thread exists.
+      - The memory context: the thread's rolling summary and its most relevant
+        entries scoring >= threshold, within the MEMORY_MAX_CHARS budget.
     """
     current_embedding = get_embedding(current_text)
-    
-    # Retrieve all past entries for the user
-    entries = list(conversations.find({"user_id": user_id}))
-    
-    memory_lines = []
-    thread_id_found = None
-    for entry in entries:
-        past_text = entry.get("summary", "") or entry.get("user_message", "")
-        if past_text:
-            past_embedding = get_embedding(past_text)
-            sim = cosine_similarity([current_embedding], [past_embedding])[0][0]
-            # Debug: Print the similarity score and the ID of the entry being compared.
-            # print(f"DEBUG: Comparing current_text with entry {entry.get('_id')} | Similarity: {sim:.4f}")
-            if sim >= threshold:
-                past_summary = entry.get("summary", "").strip()
-                past_reply = entry.get("bot_reply", "").strip()
-                memory_lines.append(f"Previously, you mentioned: '{past_summary}' and I replied: '{past_reply}'.")
-                # Capture the thread_id from the first matching entry.
-                if entry.get("thread_id") and not thread_id_found:
-                    thread_id_found = entry["thread_id"]
-    
-    memory_context = "\n".join(memory_lines)
-    return thread_id_found, memory_context
+    return resolve_thread(get_user_memory(user_id), current_embedding, threshold)
+
+def match_thread(memory: UserMemory, current_embedding: np.ndarray, threshold: float = THREAD_SIMILARITY_THRESHOLD) -> Tuple[Optional[str], List[str]]:
+    """
+    The best-matching thread and the memory lines from its entries; everything
+    resolve_thread does except reading the thread's rolling summary from MongoDB.
+    """
+    # One score per thread, not per entry; entries are only searched within the chosen thread.
+    thread_id_found, _ = memory.centroids.best(current_embedding, threshold)
+    if thread_id_found is None:
+        return None, []
+    return thread_id_found, [format_memory_line(entry)
+                             for entry in memory.search_thread(thread_id_found, current_embedding, threshold)]
+
+def resolve_thread(memory: UserMemory, current_embedding: np.ndarray, threshold: float = THREAD_SIMILARITY_THRESHOLD) -> Tuple[Optional[str], str]:
+    """query_similar_entries_with_thread for an already loaded memory and embedding."""
+    thread_id_found, memory_lines = match_thread(memory, current_embedding, threshold)
+    if thread_id_found is None:
+        return None, ""
+    return thread_id_found, build_memory_context(memory_lines, thread_summary(thread_id_found))
@@ -0,0 +1,212 @@
+# gemini_client.py
+"""
+Async Gemini client with a persistent, pooled HTTP connection.
+
+httpx.AsyncClient connections belong to the event loop they were opened on,
+so get_client() keeps one pooled client per running loop (normally just the
+uvicorn loop). Point GEMINI_BASE_URL at a local server to run against a stub.
+
+Successful responses go through the shared ResponseCache unless a call opts
+out with cache=False (use that for high-temperature, creative prompts).
+Requests that miss the cache are sent through the client's GeminiScheduler,
+which keeps them within quota in priority order, retries transient errors
+and merges identical requests in flight. Pass priority=CHECKUP or BACKGROUND
+for anything a user isn't waiting on.
+"""
+import asyncio
+import itertools
+import json
+import weakref
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from app.config import (
+    GEMINI_API_KEY,
+    GEMINI_BASE_URL,
+    GEMINI_MODEL,
+    GEMINI_TIMEOUT,
+    GEMINI_CONNECT_TIMEOUT,
+    GEMINI_MAX_CONNECTIONS,
+    GEMINI_CACHE_ENABLED,
+    GEMINI_CACHE_SIZE,
+    GEMINI_CACHE_TTL,
+    GEMINI_CACHE_SHARED,
+    db,
+)
+from app.services.response_cache import ResponseCache, LRUTTLCache, MongoCacheTier, cache_key
+from app.services.gemini_scheduler import GeminiScheduler, Ticket, INTERACTIVE, estimate_tokens
+from app.services.metrics import register_collector
+
+response_cache = ResponseCache(
+    LRUTTLCache(GEMINI_CACHE_SIZE, GEMINI_CACHE_TTL),
+    MongoCacheTier(db["gemini_cache"], GEMINI_CACHE_TTL) if GEMINI_CACHE_SHARED else None,
+) if GEMINI_CACHE_ENABLED else None
+
+
+def _cache_metrics():
+    if response_cache is None:
+        return []
+    stats = response_cache.stats()
+    return [
+        ("reflectin_gemini_cache_hits_total", "counter", "Gemini responses served from the local cache tier.", stats["hits"]),
+        ("reflectin_gemini_cache_shared_hits_total", "counter", "Gemini responses served from the shared cache tier.", stats["shared_hits"]),
+        ("reflectin_gemini_cache_misses_total", "counter", "Gemini cache lookups that went upstream.", stats["misses"]),
+        ("reflectin_gemini_cache_entries", "gauge", "Entries in the local Gemini cache tier.", stats["size"]),
+    ]
+
+register_collector(_cache_metrics)
+
+
+def _scheduler_metrics():
+    schedulers = [client.scheduler for client in list(_clients.values())]
+    total = lambda stat: sum(scheduler.stats[stat] for scheduler in schedulers)
+    return [
+        ("reflectin_gemini_requests_total", "counter", "Gemini requests sent upstream (including retries).", total("requests")),
+        ("reflectin_gemini_retries_total", "counter", "Gemini requests retried after a transient error.", total("retries")),
+        ("reflectin_gemini_throttled_total", "counter", "Gemini responses with status 429.", total("throttled")),
+        ("reflectin_gemini_coalesced_total", "counter", "Gemini calls merged into an identical call in flight.", total("coalesced")),
+        ("reflectin_gemini_queued", "gauge", "Gemini requests waiting for quota.", sum(s.queued() for s in schedulers)),
+    ]
+
+register_collector(_scheduler_metrics)
+
+
+def build_payload(prompt_text: str, **generation_config) -> dict:
+    """A single-turn generateContent request body."""
+    return {
+        "contents": [
+            {
+                "parts": [{"text": prompt_text}],
+                "role": "user"
+            }
+        ],
+        "generationConfig": generation_config
+    }
+
+
+def extract_text(data: dict) -> Optional[str]:
+    """The first candidate's text, or None if the response has none."""
+    try:
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class GeminiClient:
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, base_url: str = GEMINI_BASE_URL,
+                 model: str = GEMINI_MODEL, timeout: float = GEMINI_TIMEOUT,
+                 connect_timeout: float = GEMINI_CONNECT_TIMEOUT,
+                 max_connections: int = GEMINI_MAX_CONNECTIONS,
+                 cache: Optional[ResponseCache] = None,
+                 scheduler: Optional[GeminiScheduler] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_key = api_key
+        self.model = model
+        self.cache = cache
+        self.scheduler = scheduler or GeminiScheduler()
+        self._http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers={"Content-Type": "application/json"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def generate(self, payload: dict, model: Optional[str] = None, cache: bool = True,
+                       priority: int = INTERACTIVE) -> dict:
+        """
+        POST a generateContent request; raises httpx.HTTPError on transport or
+        HTTP errors once the scheduler has given up retrying.
+        """
+        model = model or self.model
+        use_cache = cache and self.cache is not None
+        key = cache_key(model, payload)
+        if use_cache:
+            cached = await self._cache_call(self.cache.get, key)
+            if cached is not None:
+                return cached
+
+        async def send():
+            response = await self._http.post(
+                f"/models/{model}:generateContent",
+                params={"key": self.api_key},
+                json=payload,
+            )
+            response.raise_for_status()
+            return response.json()
+
+        data = await self.scheduler.call(send, priority, estimate_tokens(payload), key)
+
+        # Only cache responses that actually carry text; errors and empty candidates are retried.
+        if use_cache and extract_text(data) is not None:
+            await self._cache_call(self.cache.set, key, data)
+        return data
+
+    async def generate_text(self, payload: dict, model: Optional[str] = None, cache: bool = True,
+                            priority: int = INTERACTIVE) -> Optional[str]:
+        return extract_text(await self.generate(payload, model, cache, priority))
+
+    async def stream_text(self, payload: dict, model: Optional[str] = None,
+                          priority: int = INTERACTIVE) -> AsyncIterator[str]:
+        """
+        Yield the text of each chunk from streamGenerateContent (server-sent events)
+        as it arrives. Streams are never cached or merged, and are only retried
+        if they fail before the first chunk.
+        """
+        ticket = Ticket(priority, estimate_tokens(payload))
+        for attempt in itertools.count():
+            await self.scheduler.acquire(ticket)
+            streamed = False
+            try:
+                async with self._http.stream(
+                    "POST",
+                    f"/models/{model or self.model}:streamGenerateContent",
+                    params={"key": self.api_key, "alt": "sse"},
+                    json=payload,
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        text = extract_text(json.loads(line[len("data:"):]))
+                        if text:
+                            streamed = True
+                            yield text
+                return
+            except httpx.HTTPError as e:
+                delay = None if streamed else self.scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            self.scheduler.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def _cache_call(self, fn, *args):
+        # The shared tier does blocking pymongo I/O; keep it off the event loop.
+        if self.cache.shared is not None:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, GeminiClient]" = weakref.WeakKeyDictionary()
+
+
+def get_client() -> GeminiClient:
+    """The pooled client for the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = GeminiClient(cache=response_cache)
+        _clients[loop] = client
+    return client
+
+
+async def close_client() -> None:
+    """Close the running loop's client (call on application shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,273 @@
+# gemini_scheduler.py
+"""
+Rate control for Gemini requests.
+
+Every upstream call made by GeminiClient goes through a GeminiScheduler:
+
+  - Two token buckets track the quota, one for requests per minute
+    (GEMINI_RPM) and one for estimated tokens per minute (GEMINI_TPM: the
+    prompt's characters / 4 plus maxOutputTokens). Each bucket holds at most
+    GEMINI_BURST_SECONDS of quota. The limits apply per process, so with
+    several workers divide the project quota between them.
+  - Callers wait in one priority queue: INTERACTIVE (/chat) first, then
+    CHECKUP (/checkup), then BACKGROUND (batch imports, summary compaction).
+    A waiting request is only sent once the buckets allow it, and nothing of
+    lower priority is sent before it.
+  - 429 and 5xx responses and transport errors are retried up to
+    GEMINI_MAX_RETRIES times. The delay is the server's Retry-After (or the
+    retryDelay in the error body) when it gives one, else exponential backoff
+    with full jitter, capped at GEMINI_RETRY_MAX_DELAY. A 429 also pauses the
+    whole queue for that delay, because every other request would hit the
+    same quota.
+  - Identical requests in flight at the same time (same key, e.g. the same
+    summary prompt) are merged. The callers share one upstream call, which
+    runs at the best priority among them.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from app.config import (
+    GEMINI_RPM,
+    GEMINI_TPM,
+    GEMINI_BURST_SECONDS,
+    GEMINI_MAX_RETRIES,
+    GEMINI_RETRY_BASE_DELAY,
+    GEMINI_RETRY_MAX_DELAY,
+)
+from app.services.metrics import record
+
+INTERACTIVE = 0
+CHECKUP = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", CHECKUP: "checkup", BACKGROUND: "background"}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def estimate_tokens(payload: dict) -> int:
+    """Rough token cost of a generateContent request: ~4 characters per prompt token, plus the output cap."""
+    chars = sum(
+        len(part.get("text", ""))
+        for content in payload.get("contents", [])
+        for part in content.get("parts", [])
+    )
+    return chars // 4 + 1 + int(payload.get("generationConfig", {}).get("maxOutputTokens", 0))
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After or the error's RetryInfo, if any."""
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(value)
+                return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    try:
+        details = response.json()["error"]["details"]
+    except Exception:
+        return None
+    for detail in details:
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return max(float(delay[:-1]), 0.0)
+            except ValueError:
+                pass
+    return None
+
+
+class TokenBucket:
+    """Refills at `per_minute / 60` per second up to `capacity`."""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until `cost` tokens are available (a cost above capacity waits for a full bucket)."""
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0)
+
+    def take(self, cost: float) -> None:
+        self.tokens -= min(cost, self.capacity)
+
+
+class Ticket:
+    """One upstream call waiting for (or holding) its turn."""
+
+    def __init__(self, priority: int, cost: int):
+        self.priority = priority
+        self.cost = cost
+        self.future: Optional[asyncio.Future] = None
+
+
+class _Shared:
+    """An in-flight call and how many callers are still waiting for it."""
+
+    def __init__(self, task: asyncio.Task, ticket: Ticket):
+        self.task = task
+        self.ticket = ticket
+        self.waiters = 0
+
+
+class GeminiScheduler:
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM,
+                 burst_seconds: float = GEMINI_BURST_SECONDS, max_retries: int = GEMINI_MAX_RETRIES,
+                 base_delay: float = GEMINI_RETRY_BASE_DELAY, max_delay: float = GEMINI_RETRY_MAX_DELAY):
+        # A limit of 0 disables that bucket.
+        self.buckets = [
+            (TokenBucket(limit, burst_seconds), per_request)
+            for limit, per_request in ((rpm, True), (tpm, False))
+            if limit > 0
+        ]
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._waiting = []  # heap of (priority, seq, ticket, future)
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self._inflight: Dict[str, _Shared] = {}
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "coalesced": 0}
+
+    # --- queue -------------------------------------------------------------------
+
+    def queued(self) -> int:
+        return sum(1 for *_, future in self._waiting if not future.done())
+
+    async def acquire(self, ticket: Ticket) -> None:
+        """Wait until the ticket may be sent; takes its share of both buckets."""
+        loop = asyncio.get_running_loop()
+        ticket.future = loop.create_future()
+        heapq.heappush(self._waiting, (ticket.priority, next(self._seq), ticket, ticket.future))
+        started = time.perf_counter()
+        self._pump()
+        try:
+            await ticket.future
+        finally:
+            record(f"gemini_queue_{PRIORITY_NAMES.get(ticket.priority, ticket.priority)}",
+                   time.perf_counter() - started)
+        self.stats["requests"] += 1
+
+    def promote(self, ticket: Ticket, priority: int) -> None:
+        """Move a still-waiting ticket up to `priority` (its old queue entry is skipped later)."""
+        if priority >= ticket.priority:
+            return
+        ticket.priority = priority
+        if ticket.future is not None and not ticket.future.done():
+            heapq.heappush(self._waiting, (priority, next(self._seq), ticket, ticket.future))
+            self._pump()
+
+    def pause(self, seconds: float) -> None:
+        """Send nothing for `seconds` (the server reported the quota exhausted)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._pump()
+
+    def _pump(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiting:
+            _, _, ticket, future = self._waiting[0]
+            if future.done():  # cancelled, or granted through another entry
+                heapq.heappop(self._waiting)
+                continue
+            now = time.monotonic()
+            wait = max([self._paused_until - now] + [
+                bucket.wait_time(1 if per_request else ticket.cost, now)
+                for bucket, per_request in self.buckets
+            ])
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+            for bucket, per_request in self.buckets:
+                bucket.take(1 if per_request else ticket.cost)
+            heapq.heappop(self._waiting)
+            future.set_result(None)
+
+    # --- retries -------------------------------------------------------------------
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """How long to wait before retrying after `error`, or None if it shouldn't be retried."""
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            if status not in RETRYABLE_STATUS:
+                return None
+            delay = retry_after(error.response)
+            if delay is not None and delay > self.max_delay:
+                return None  # the server wants longer than a caller should wait
+            if delay is None:
+                delay = self.backoff(attempt)
+            if status == 429:
+                self.stats["throttled"] += 1
+                self.pause(delay)
+            return delay
+        if isinstance(error, httpx.TransportError):
+            return self.backoff(attempt)
+        return None
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _send(self, send: Callable[[], Awaitable], ticket: Ticket):
+        for attempt in itertools.count():
+            await self.acquire(ticket)
+            try:
+                return await send()
+            except httpx.HTTPError as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    # --- entry point ---------------------------------------------------------------
+
+    async def call(self, send: Callable[[], Awaitable], priority: int = INTERACTIVE,
+                   cost: int = 1, key: Optional[str] = None):
+        """
+        Run `send()` (one upstream request) when the quota allows, retrying
+        transient failures. Concurrent calls with the same key share one send().
+        """
+        if key is None:
+            return await self._send(send, Ticket(priority, cost))
+
+        shared = self._inflight.get(key)
+        if shared is None:
+            ticket = Ticket(priority, cost)
+            shared = _Shared(asyncio.ensure_future(self._send(send, ticket)), ticket)
+            self._inflight[key] = shared
+            shared.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+            self.promote(shared.ticket, priority)
+
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                # Every caller gave up (e.g. a client disconnected): don't spend quota on it.
+                shared.task.cancel()
@@ -1,16 +1,27 @@
-import requests
+import asyncio
+import httpx
+import numpy as np
 from textblob import TextBlob
-import spacy
-from app.config import GEMINI_API_KEY
+from app.config import GEMINI_API_KEY, BATCH_GEMINI_CONCURRENCY, DEFAULT_USER_ID, SENTIMENT_ENGINE
 from app.prompts import get_prompt_for_reflection
-from app.config import conversations
-from .filtering import query_similar_entries, get_prompt_for_reflection_with_memory, query_similar_entries_with_thread
+from app.utils import db
+from .filtering import (
+    get_prompt_for_reflection_with_memory, get_embedding, remember_entry, get_user_memory, match_thread,
+    normalize_rows, score_entries, THREAD_SIMILARITY_THRESHOLD
+)
+from app.services import context_engine, rollups, memory_builder, nlp_models, sentiment_engine, nlp_executor, checkups
+from app.services.metrics import span, timed
+from app.services.gemini_client import get_client, build_payload
+from app.services.gemini_scheduler import CHECKUP, BACKGROUND
+from app.services.summarizer import get_summarizer
+from app.services.scheduler import thread_activity_updates
 from datetime import datetime
 from uuid import uuid4
+from typing import List, Optional
 
 
-def save_conversation(user_id, thread_id, topic, user_message, summary, bot_reply, sentiment, context):
-    entry = {
+def build_conversation(user_id, thread_id, topic, user_message, summary, bot_reply, sentiment, context, embedding):
+    return {
         "user_id": user_id,
         "thread_id": thread_id,
         "topic": topic,
@@ -19,277 +30,439 @@ def save_conversation(user_id, thread_id, topic, user_message, summary, bot_repl
         "bot_reply": bot_reply,
         "sentiment": sentiment,
         "context": context,
+        "embedding": embedding.tolist(),
         "timestamp": datetime.utcnow()
     }
-    conversations.insert_one(entry)
 
+def store_conversations(entries: List[dict]) -> None:
+    """
+    Insert built conversations, then record_stored() them. With write-behind
+    the inserts are queued and the queue runs record_stored() once they are
+    written (see startup). These are blocking pymongo calls; async callers run
+    this in a thread (see save_conversations).
+    """
+    with span("mongo_insert"):
+        queued = db.insert_conversations(entries)
+    if not queued:
+        record_stored(entries)
 
-# Load SpaCy model for context analysis
-nlp = spacy.load("en_core_web_md")
+def record_stored(entries: List[dict]) -> None:
+    """Writes derived from stored conversations: one threads update per thread, topic stats and rollups."""
+    with span("thread_update"):
+        db.bulk_update_threads(thread_activity_updates(entries))
+    by_user = {}
+    for entry in entries:
+        by_user.setdefault(entry["user_id"], []).append(entry["context"].get("topics", []))
+    for user_id, topic_lists in by_user.items():
+        context_engine.record_topics(user_id, topic_lists)
+    with span("rollups"):
+        rollups.record_conversations(entries)
 
-def analyze_sentiment(text):
-    analysis = TextBlob(text)
-    polarity = analysis.sentiment.polarity
-    sentiment_score = int(((polarity + 1) / 2) * 9) + 1
+def remember_conversations(entries: List[dict]) -> None:
+    """Update this worker's caches for stored conversations (call on the event loop)."""
+    for entry in entries:
+        remember_entry(entry["user_id"], entry)
+    memory_builder.schedule_refresh(entry["thread_id"] for entry in entries)
 
-    if sentiment_score > 6:
-        sentiment_label = "Positive"
-    elif sentiment_score < 4:
-        sentiment_label = "Negative"
-    else:
-        sentiment_label = "Neutral"
+def save_conversation(user_id, thread_id, topic, user_message, summary, bot_reply, sentiment, context,
+                      embedding=None):
+    # Embed once at write time so similarity search never re-runs spaCy on history.
+    if embedding is None:
+        with span("embedding"):
+            embedding = get_embedding(summary or user_message)
+    entry = build_conversation(user_id, thread_id, topic, user_message, summary, bot_reply, sentiment, context, embedding)
+    store_conversations([entry])
+    remember_conversations([entry])
 
-    return {
-        "polarity": polarity,
-        "sentiment_score": sentiment_score,
-        "sentiment_label": sentiment_label
-    }
+async def save_conversations(entries: List[dict]) -> None:
+    """Save built conversations without blocking the event loop: the writes run in a thread."""
+    if not entries:
+        return
+    await asyncio.to_thread(store_conversations, entries)
+    remember_conversations(entries)
 
-def analyze_context(text):
 
-    # doc = nlp(text)
-    # entities = [ent.text for ent in doc.ents]
-    # topics = set([token.lemma_ for token in doc if token.is_alpha and not token.is_stop])
+def analyze_sentiment(text):
+    return analyze_sentiments([text])[0]
+
+def analyze_sentiments(texts, docs=None):
+    """
+    Sentiment for many texts, in order. Pass the texts' spaCy docs (from any
+    pipeline) to score their tokens instead of tokenizing the texts again.
+    """
+    if SENTIMENT_ENGINE == "textblob":
+        return [sentiment_engine.bucket_polarity(TextBlob(text).sentiment.polarity) for text in texts]
+    if docs is None:
+        docs = nlp_models.pipe(texts, "vectors")
+    return sentiment_engine.analyze_docs(docs)
 
+def analyze_context(text, user_id=None):
     """
     Perform context analysis using SpaCy to extract entities and topics,
-    filtering out filler words.
+    filtering out filler words. With a user_id, topics are ranked by how
+    distinctive they are for that user's history.
     """
-    doc = nlp(text)
-    entities = [ent.text for ent in doc.ents]
-    
-    # Define a set of common filler words you want to ignore
-    filler_words = {
-    "like", "uh", "um", "you know", "so", "actually", "basically", "literally", "just",
-    "well", "okay", "right", "yeah", "y'know", "I mean", "sort of", "kind of", "sorta", "kinda",
-    "anyway", "really", "actually", "honestly", "truthfully", "in fact", "you see", "mind you",
-    "at the end of the day", "to be honest", "to be fair", "you get me", "whatever", "stuff",
-    "things", "thing", "obviously", "apparently", "clearly", "seriously", "basically", "literally",
-    "probably", "maybe", "perhaps", "like I said", "I guess", "I suppose", "I think", "I believe",
-    "you know what I mean", "you know what I'm saying", "as I was saying", "for sure", "I reckon",
-    "to be clear", "to be real", "let me think", "hold on", "wait a minute", "give me a sec", "I feel like",
-    "it seems like", "it looks like", "it sounds like", "it feels like", "to be honest", "if that makes sense",
-    "at the end of the day", "in my opinion", "from my perspective", "from my point of view",
-    "from what I can tell", "from what I understand", "you know what I mean", "as far as I know",
-    "kind of like", "sort of like", "more or less", "give or take", "more like", "less like",
-    "if that makes sense", "to some extent", "to a certain extent", "to a degree", "at least",
-    "at most", "in some way", "in a way", "in some sense", "in a sense", "kind of", "sort of",
-    "somehow", "somewhat", "in other words", "in a nutshell", "basically", "generally speaking",
-    "for the most part", "by and large", "at this point", "to this day", "to this moment",
-    "to this extent", "to this degree", "for instance", "for example", "like for instance",
-    "you could say", "in a manner of speaking", "in a way of speaking", "for what it's worth",
-    "on the whole", "in a way of thinking", "so to speak", "as it were"
-    }
+    return context_engine.analyze_text(text, user_id)
+
+def analyze_contexts(texts, user_id=None, batch_size=256):
+    """Batched analyze_context: one nlp.pipe pass over all texts, results in input order."""
+    return context_engine.analyze_texts(texts, user_id, batch_size)
 
-    
-    topics = set(
-        token.lemma_.lower()
-        for token in doc 
-        if token.is_alpha 
-           and not token.is_stop 
-           and token.lemma_.lower() not in filler_words
+
+def build_reflection_prompt(score: int, vent_text: str, memory_context: str,
+                            persona: Optional[str] = None,
+                            band1: Optional[str] = None,
+                            band2: Optional[str] = None,
+                            band3: Optional[str] = None,
+                            band4: Optional[str] = None,
+                            band5: Optional[str] = None) -> str:
+    # Decide which prompt to use:
+    if memory_context:
+        # If memory exists, reflect on the current vent in light of the aggregated past entries
+        return get_prompt_for_reflection_with_memory(score, vent_text, memory_context)
+    return get_prompt_for_reflection(
+        score,
+        vent_text,
+        persona or "supportive guide",
+        band1 or "",
+        band2 or "",
+        band3 or "",
+        band4 or "",
+        band5 or ""
     )
-    
 
-    return {
-        "entities": entities,
-        "topics": list(topics)
-    }
+def build_reflection_payload(reflective_prompt_text: str) -> dict:
+    return build_payload(reflective_prompt_text, maxOutputTokens=100, temperature=0.7)
+
 
+MISSING_KEY_RESULT = {
+    "summary": "Error: API key not set",
+    "bot_reply": "Please configure your GEMINI_API_KEY.",
+    "sentiment": {"polarity": 0, "sentiment_score": 5, "sentiment_label": "Neutral"},
+    "context": {"entities": [], "topics": []}
+}
 
-def process_vent(vent_text: str, persona: Optional[str] = None,
+async def prepare_vent(vent_text: str, persona: Optional[str] = None,
                  band1: Optional[str] = None,
                  band2: Optional[str] = None,
                  band3: Optional[str] = None,
                  band4: Optional[str] = None,
-                 band5: Optional[str] = None):
-    if not GEMINI_API_KEY:
-        return {
-            "summary": "Error: API key not set",
-            "bot_reply": "Please configure your GEMINI_API_KEY.",
-            "sentiment": {"polarity": 0, "sentiment_score": 5, "sentiment_label": "Neutral"},
-            "context": {"entities": [], "topics": []}
-        }
+                 band5: Optional[str] = None,
+                 analysis: Optional[dict] = None) -> dict:
+    """
+    Everything about a vent that is known before calling Gemini: sentiment,
+    context, topic, the resolved thread and the reflection prompt.
+    `analysis` is the vent's nlp_executor.analyze() result, if already computed.
+    """
+    user_id = DEFAULT_USER_ID  # (Replace with dynamic user info as needed)
 
-    sentiment_result = analyze_sentiment(vent_text)
-    context_result = analyze_context(vent_text)
-    
-    user_id = "shivani"  # (Replace with dynamic user info as needed)
+    # One spaCy pass feeds sentiment, context and the embedding. The async paths
+    # run it through nlp_executor first and pass the result in.
+    if analysis is None:
+        with span("nlp"):
+            analysis = nlp_executor.analyze_batch([vent_text])[0]
+    sentiment_result = sentiment_engine.bucket_polarity(analysis["polarity"])
+    # Ranking topics (against the user's topic stats) and loading (or re-checking)
+    # the history index both query MongoDB, so they run in worker threads, side by side.
+    contexts, memory = await asyncio.gather(
+        timed("context", asyncio.to_thread(context_engine.rank_contexts,
+                                           [analysis["terms"]], [analysis["entities"]], user_id)),
+        timed("history_load", asyncio.to_thread(get_user_memory, user_id)),
+    )
+    context_result = contexts[0]
 
     # First, query for similar past entries using the current vent text.
-    existing_thread_id, memory_context = query_similar_entries_with_thread(user_id, vent_text)
-    
+    with span("similarity"):
+        existing_thread_id, memory_lines = match_thread(memory, analysis["embedding"])
+    memory_context = ""
+    if existing_thread_id:
+        summaries = await timed("thread_summary", memory_builder.load_thread_summaries([existing_thread_id]))
+        memory_context = memory_builder.build_memory_context(memory_lines, summaries.get(existing_thread_id))
+
+    return build_vent(user_id, vent_text, sentiment_result, context_result, existing_thread_id, memory_context,
+                      persona, band1, band2, band3, band4, band5)
+
+def build_vent(user_id, vent_text, sentiment_result, context_result, existing_thread_id, memory_context,
+               persona=None, band1=None, band2=None, band3=None, band4=None, band5=None) -> dict:
     thread_id = existing_thread_id if existing_thread_id else str(uuid4())
-    
-    
-    summary_prompt = {
-        "contents": [
-            {
-                "parts": [{"text": f"Summarize this vent in 1-2 sentences without giving advice:\n\n{vent_text}"}],
-                "role": "user"
-            }
-        ],
-        "generationConfig": {
-            "maxOutputTokens": 100,
-            "temperature": 0.3
-        }
+
+    # Determine topic from context (topics are ranked, most distinctive first)
+    topic = context_result["topics"][0] if context_result["topics"] else "general"
+
+    reflective_prompt_text = build_reflection_prompt(
+        sentiment_result["sentiment_score"], vent_text, memory_context,
+        persona, band1, band2, band3, band4, band5
+    )
+
+    return {
+        "user_id": user_id,
+        "user_message": vent_text,
+        "thread_id": thread_id,
+        "topic": topic,
+        "sentiment": sentiment_result,
+        "context": context_result,
+        "reflective_prompt_text": reflective_prompt_text
     }
-    
-    # Decide which prompt to use:
-    if memory_context:
-        # If memory exists, use the previously aggregated summary (or any chosen previous summary) as memory
-        reflective_prompt_text = get_prompt_for_reflection(
-            sentiment_result["sentiment_score"],
-            vent_text,
-            summary_prompt,
-            persona or "supportive guide",
-            band1 or "",
-            band2 or "",
-            band3 or "",
-            band4 or "",
-            band5 or ""
-        )
-    else:
-        reflective_prompt_text = get_prompt_for_reflection(
-            sentiment_result["sentiment_score"],
-            vent_text,
-            persona or "supportive guide",
-            band1 or "",
-            band2 or "",
-            band3 or "",
-            band4 or "",
-            band5 or ""
-        )
 
-    reflection_prompt = {
-        "contents": [
-            {
-                "parts": [{"text": reflective_prompt_text}],
-                "role": "user"
-            }
-        ],
-        "generationConfig": {
-            "maxOutputTokens": 100,
-            "temperature": 0.7
-        }
+NO_SUMMARY = "No summary available."
+
+async def finish_vent(vent: dict, summary_text: Optional[str], reflection_text: Optional[str],
+                      embedding: np.ndarray) -> dict:
+    """
+    Fill in defaults for missing Gemini text, save the conversation and build the result.
+    `embedding` is the summary's embedding.
+    """
+    summary_text = summary_text or NO_SUMMARY
+    reflection_text = reflection_text or "How are you feeling now?"
+
+    # Save the conversation to MongoDB
+    entry = build_conversation(vent["user_id"], vent["thread_id"], vent["topic"], vent["user_message"],
+                               summary_text, reflection_text, vent["sentiment"], vent["context"], embedding)
+    await save_conversations([entry])
+
+    return {
+        "user_message": vent["user_message"],
+        "topic": vent["topic"],
+        "summary": summary_text,
+        "bot_reply": reflection_text,
+        "thread_id": vent["thread_id"],  # Optionally return thread_id for debugging or UI
+        "sentiment": vent["sentiment"],
+        "context": vent["context"]
+    }
+
+def failed_vent(vent: dict) -> dict:
+    return {
+        "user_message": vent["user_message"],
+        "topic": vent["topic"],
+        "summary": "Summary unavailable due to an error.",
+        "bot_reply": "Could you tell me more about what happened?",
+        "thread_id": vent["thread_id"],
+        "sentiment": vent["sentiment"],
+        "context": vent["context"]
     }
 
-    headers = {"Content-Type": "application/json"}
 
+async def gather_or_cancel(*awaitables):
+    """
+    asyncio.gather, except that the first failure cancels the calls still
+    running: a failed vent isn't saved, so finishing them would only use quota.
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
     try:
-        summary_response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}",
-            json=summary_prompt,
-            headers=headers
-        )
-        reflection_response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}",
-            json=reflection_prompt,
-            headers=headers
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def process_vent(vent_text: str, persona: Optional[str] = None,
+                       band1: Optional[str] = None,
+                       band2: Optional[str] = None,
+                       band3: Optional[str] = None,
+                       band4: Optional[str] = None,
+                       band5: Optional[str] = None):
+    if not GEMINI_API_KEY:
+        return dict(MISSING_KEY_RESULT)
+
+    analysis = await timed("nlp", nlp_executor.analyze(vent_text))
+    vent = await prepare_vent(vent_text, persona, band1, band2, band3, band4, band5, analysis)
+
+    client = get_client()
+    try:
+        # The summary and the reflection don't depend on each other, so run them concurrently.
+        (summary_text, embedding), reflection_text = await gather_or_cancel(
+            timed("summary", get_summarizer().summarize(vent_text, analysis)),
+            # Reflections are creative (temperature 0.7) and unique per vent; don't cache them.
+            timed("gemini_reflection",
+                  client.generate_text(build_reflection_payload(vent["reflective_prompt_text"]), cache=False)),
         )
+    except httpx.HTTPError:
+        return failed_vent(vent)
 
-        summary_response.raise_for_status()
-        reflection_response.raise_for_status()
+    if embedding is None:
+        embedding = await timed("embedding", nlp_executor.embed(summary_text or NO_SUMMARY))
+    return await finish_vent(vent, summary_text, reflection_text, embedding)
 
-        summary_data = summary_response.json()
-        try:
-            summary_text = summary_data["candidates"][0]["content"]["parts"][0]["text"]
-        except (KeyError, IndexError, TypeError):
-            summary_text = "No summary available."
-            
-        reflection_data = reflection_response.json()
+
+async def stream_vent(vent_text: str, persona: Optional[str] = None,
+                      band1: Optional[str] = None,
+                      band2: Optional[str] = None,
+                      band3: Optional[str] = None,
+                      band4: Optional[str] = None,
+                      band5: Optional[str] = None):
+    """
+    Streaming counterpart of process_vent. Yields (event, data) pairs:
+
+      meta  - thread, topic, sentiment and context, before any Gemini call returns
+      token - each chunk of the reflection as Gemini streams it
+      done  - the complete result (same shape as process_vent), once the summary
+              has arrived and the conversation has been saved
+      error - the process_vent fallback result if Gemini failed; nothing is saved
+    """
+    if not GEMINI_API_KEY:
+        yield "done", dict(MISSING_KEY_RESULT)
+        return
+
+    analysis = await timed("nlp", nlp_executor.analyze(vent_text))
+    vent = await prepare_vent(vent_text, persona, band1, band2, band3, band4, band5, analysis)
+    yield "meta", {
+        "thread_id": vent["thread_id"],
+        "topic": vent["topic"],
+        "sentiment": vent["sentiment"],
+        "context": vent["context"]
+    }
+
+    client = get_client()
+    # The summary is only needed for saving, so it runs while the reflection streams.
+    summary_task = asyncio.ensure_future(timed("summary", get_summarizer().summarize(vent_text, analysis)))
+    chunks = []
+    try:
+        async for chunk in client.stream_text(build_reflection_payload(vent["reflective_prompt_text"])):
+            chunks.append(chunk)
+            yield "token", {"text": chunk}
         try:
-            reflection_text = reflection_data["candidates"][0]["content"]["parts"][0]["text"]
-        except (KeyError, IndexError, TypeError):
-            reflection_text = "How are you feeling now?"
-        
-        # Determine topic from context
-        topic = context_result["topics"][0] if context_result["topics"] else "general"
-
-        # Save the conversation to MongoDB
-        save_conversation(
-            user_id=user_id,
-            thread_id=thread_id,
-            topic=topic,
-            user_message=vent_text,
-            summary=summary_text,
-            bot_reply=reflection_text,
-            sentiment=sentiment_result,
-            context=context_result
-        )
+            summary_text, embedding = await summary_task
+        except httpx.HTTPError:
+            # The user already has the reflection; save it with the default summary.
+            summary_text, embedding = None, None
+    except httpx.HTTPError:
+        yield "error", failed_vent(vent)
+        return
+    finally:
+        # Client disconnected or the stream failed: don't leave the summary call running.
+        if not summary_task.done():
+            summary_task.cancel()
 
-        return {
-            "user_message": vent_text,
-            "topic": topic,
-            "summary": summary_text,
-            "bot_reply": reflection_text,
-            "thread_id": thread_id,  # Optionally return thread_id for debugging or UI
-            "sentiment": sentiment_result,
-            "context": context_result
-        }
+    if embedding is None:
+        embedding = await timed("embedding", nlp_executor.embed(summary_text or NO_SUMMARY))
+    yield "done", await finish_vent(vent, summary_text, "".join(chunks), embedding)
 
-    except requests.exceptions.RequestException as e:
-        return {
-            "user_message": vent_text,
-            "topic": topic,
-            "summary": "Summary unavailable due to an error.",
-            "bot_reply": "Could you tell me more about what happened?",
-            "thread_id": thread_id,
-            "sentiment": sentiment_result,
-            "context": context_result
-        }
-    
-def generate_checkup_message(thread_id: str) -> str:
-    # Retrieve the most recent conversation for the thread.
-    conversation = conversations.find_one({"thread_id": thread_id}, sort=[("timestamp", -1)])
-    
-    if conversation:
-        summary_text = conversation.get("summary", "").strip()
-        if summary_text:
-            prompt_text = (
-                f"Based on our previous conversation summarized as: '{summary_text}', "
-                f"generate one clear, creative, and supportive check-up message asking: "
-                f"'How are you feeling now? Has your situation improved?' "
-                f"Keep it friendly and uplifting. REMEMBER JUST ONE RESPONSE. that should be the only thing in the output. Also keep in mind to definitely bring up the main topic of conversation in the follow up message."
-            )
-        else:
-            prompt_text = (
-                "Generate one clear, creative, and supportive check-up message: 'How are you feeling now?'. REMEMBER JUST ONE RESPONSE. that should be the only thing in the output."
+async def process_vents(items: List[dict]) -> List[dict]:
+    """
+    Process many vents (e.g. a journal import) as one pipeline. Each item has the
+    same fields as a /chat request. spaCy runs once over all texts (spread across
+    the nlp_executor workers), threads are resolved against the user's history index loaded once, Gemini
+    calls fan out with at most BATCH_GEMINI_CONCURRENCY vents in flight (queued
+    behind interactive /chat and /checkup traffic), and
+    every successful vent is written with a single insert_many.
+
+    Returns one result per item, in order, each with its own "status"
+    ("ok" or "error") and, for failures, an "error" message. Failed items are
+    not saved, same as process_vent.
+    """
+    if not GEMINI_API_KEY:
+        return [dict(MISSING_KEY_RESULT, status="error", error="GEMINI_API_KEY not set") for _ in items]
+    if not items:
+        return []
+
+    user_id = DEFAULT_USER_ID  # (Replace with dynamic user info as needed)
+    texts = [item["user_message"] for item in items]
+    analyses = await timed("batch_nlp", nlp_executor.analyze_many(texts))
+    sentiments = [sentiment_engine.bucket_polarity(analysis["polarity"]) for analysis in analyses]
+    # Both query MongoDB: run them in worker threads, side by side.
+    contexts, memory = await asyncio.gather(
+        timed("batch_context", asyncio.to_thread(context_engine.rank_contexts,
+                                                 [analysis["terms"] for analysis in analyses],
+                                                 [analysis["entities"] for analysis in analyses], user_id)),
+        timed("batch_history_load", asyncio.to_thread(get_user_memory, user_id)),
+    )
+    embeddings = np.asarray([analysis["embedding"] for analysis in analyses], dtype=np.float32)
+    # Earlier vents of this batch aren't saved yet, so also match against them
+    # to keep a journal's recurring topic on one thread.
+    batch_vectors = normalize_rows(embeddings)
+    matches = [match_thread(memory, embedding) for embedding in embeddings]
+    summaries = await timed("batch_thread_summary",
+                            memory_builder.load_thread_summaries(thread_id for thread_id, _ in matches))
+    vents = []
+    for i, item in enumerate(items):
+        thread_id, memory_lines = matches[i]
+        memory_context = ""
+        if thread_id is not None:
+            memory_context = memory_builder.build_memory_context(memory_lines, summaries.get(thread_id))
+        elif i > 0:
+            sims = score_entries(batch_vectors[:i], embeddings[i])
+            best = int(np.argmax(sims))
+            if sims[best] >= THREAD_SIMILARITY_THRESHOLD:
+                thread_id = vents[best]["thread_id"]
+        vents.append(build_vent(
+            user_id, texts[i], sentiments[i], contexts[i], thread_id, memory_context,
+            item.get("persona"), item.get("band1"), item.get("band2"),
+            item.get("band3"), item.get("band4"), item.get("band5")
+        ))
+
+    client = get_client()
+    summarizer = get_summarizer()
+    limit = asyncio.Semaphore(BATCH_GEMINI_CONCURRENCY)
+
+    async def generate(vent, analysis):
+        async with limit:
+            return await gather_or_cancel(
+                summarizer.summarize(vent["user_message"], analysis, BACKGROUND),
+                client.generate_text(build_reflection_payload(vent["reflective_prompt_text"]), cache=False,
+                                     priority=BACKGROUND),
             )
-    else:
-        prompt_text = (
-            "Generate one clear, creative, and supportive check-up message: 'How are you feeling now?'. REMEMBER JUST ONE RESPONSE. that should be the only thing in the output."
-        )
 
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "contents": [
-            {
-                "parts": [{"text": prompt_text}],
-                "role": "user"
-            }
-        ],
-        "generationConfig": {
-            "maxOutputTokens": 50,  # Limit to one concise message.
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "top_k": 40
+    outcomes = await timed("batch_gemini", asyncio.gather(*(generate(vent, analysis) for vent, analysis in zip(vents, analyses)),
+                                                    return_exceptions=True))
+
+    results = [None] * len(vents)
+    saved = []
+    summary_embeddings = {}
+    for i, (vent, outcome) in enumerate(zip(vents, outcomes)):
+        if isinstance(outcome, BaseException):
+            results[i] = dict(failed_vent(vent), status="error", error=str(outcome) or type(outcome).__name__)
+            continue
+        (summary_text, summary_embedding), reflection_text = outcome
+        if summary_embedding is not None:
+            summary_embeddings[i] = summary_embedding
+        results[i] = {
+            "user_message": vent["user_message"],
+            "topic": vent["topic"],
+            "summary": summary_text or NO_SUMMARY,
+            "bot_reply": reflection_text or "How are you feeling now?",
+            "thread_id": vent["thread_id"],
+            "sentiment": vent["sentiment"],
+            "context": vent["context"],
+            "status": "ok"
         }
-    }
-    
+        saved.append(i)
+
+    to_embed = [i for i in saved if i not in summary_embeddings]
+    embedded = await timed("batch_embedding", nlp_executor.embed_many([results[i]["summary"] for i in to_embed]))
+    summary_embeddings.update(zip(to_embed, embedded))
+    entries = [
+        build_conversation(user_id, results[i]["thread_id"], results[i]["topic"], results[i]["user_message"],
+                           results[i]["summary"], results[i]["bot_reply"], results[i]["sentiment"],
+                           results[i]["context"], summary_embeddings[i])
+        for i in saved
+    ]
     try:
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}",
-            json=payload,
-            headers=headers
-        )
-        response.raise_for_status()
-        data = response.json()
-        checkup_message = data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+        await save_conversations(entries)
+    except Exception as e:
+        print("Error saving batch:", e)
+        for i in saved:
+            results[i]["status"] = "error"
+            results[i]["error"] = f"Could not save conversation: {e}"
+    return results
+
+async def generate_checkup_message(thread_id: str) -> str:
+    # Normally the scheduler has already generated and stored the message (see checkups).
+    # Both lookups query MongoDB, so they run in worker threads.
+    stored = await timed("checkup_lookup", asyncio.to_thread(db.get_checkup_message, thread_id))
+    if stored:
+        return stored
+
+    # Not generated yet: ask Gemini now, based on the thread's most recent conversation.
+    conversation = await timed("checkup_summary",
+                               asyncio.to_thread(db.latest_thread_conversation, thread_id, {"summary": 1}))
+    try:
+        checkup_message = await timed("gemini_checkup", checkups.request_checkup(
+            conversation.get("summary") if conversation else None, CHECKUP))
         if checkup_message:
-            return checkup_message.strip()
+            return checkup_message
     except Exception as e:
         print("Error calling Gemini API:", e)
-    
+
     # Fallback message if the API call fails.
-    return "Hey, just checking in—how are you feeling now? Has the stress eased a bit?"
+    return checkups.FALLBACK_CHECKUP
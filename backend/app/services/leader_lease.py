@@ -0,0 +1,64 @@
+# leader_lease.py
+"""
+Leader election through a lease document in MongoDB.
+
+Every worker tries to take the lease named e.g. "scheduler" and renews it with
+a heartbeat. A lease is {_id: name, holder, expires_at}. Taking or renewing it
+is one atomic upsert that only matches when this worker already holds it or
+it has expired. expires_at is set and compared on the MongoDB server's clock
+($$NOW), so skew between the workers' clocks doesn't matter. Whichever
+worker's upsert wins is the leader until it stops renewing. A standby's next heartbeat after expires_at takes over. A TTL index
+on expires_at removes leases their holder never released.
+
+Each worker also tracks its own deadline on the monotonic clock, starting
+from before the renewal was sent. If renewals fail (for example when MongoDB
+is unreachable), the leader steps down locally no later than a standby could
+take over.
+"""
+import os
+import socket
+import threading
+import time
+from uuid import uuid4
+
+from app.utils import db
+
+
+def default_holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+class LeaderLease:
+    def __init__(self, name: str, ttl_seconds: float, holder: str = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.holder = holder or default_holder_id()
+        self._deadline = 0.0
+        self._lock = threading.Lock()
+
+    def heartbeat(self) -> bool:
+        """Take or renew the lease; returns whether this worker now leads."""
+        started = time.monotonic()
+        try:
+            acquired = db.acquire_lease(self.name, self.holder, self.ttl_seconds)
+        except Exception as e:
+            print("Error renewing lease:", e)
+            acquired = False
+        with self._lock:
+            self._deadline = started + self.ttl_seconds if acquired else 0.0
+        return acquired
+
+    def is_leader(self) -> bool:
+        with self._lock:
+            return time.monotonic() < self._deadline
+
+    def release(self) -> None:
+        """Give the lease up (on shutdown) so a standby can take over right away."""
+        with self._lock:
+            held = self._deadline > 0.0
+            self._deadline = 0.0
+        if held:
+            try:
+                db.release_lease(self.name, self.holder)
+            except Exception as e:
+                print("Error releasing lease:", e)
@@ -0,0 +1,163 @@
+# memory_builder.py
+"""
+Builds the "previously..." memory context for reflection prompts.
+
+The context is capped no matter how long a user's history is:
+  - a thread's rolling summary comes first, when the vent continues a thread
+  - then at most MEMORY_TOP_K past entries, ranked by similarity with a small
+    bonus for recent ones
+  - and the whole thing is cut to MEMORY_MAX_CHARS, dropping the lowest-ranked
+    lines first
+
+Rolling summaries live on the thread document (rolling_summary, summary_turns,
+summary_until). After a save, threads that have gained THREAD_SUMMARY_EVERY
+turns since their last summary are re-compacted in the background: the old
+summary plus the newer conversation summaries go to Gemini, which returns one
+short summary for the whole thread.
+"""
+import asyncio
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from app.config import (
+    GEMINI_API_KEY,
+    MEMORY_TOP_K,
+    MEMORY_MAX_CHARS,
+    MEMORY_RECENCY_WEIGHT,
+    THREAD_SUMMARY_EVERY,
+    THREAD_SUMMARY_MAX_CHARS,
+)
+from app.services.gemini_client import get_client, build_payload
+from app.services.gemini_scheduler import BACKGROUND
+from app.utils import db
+
+
+def rank_matches(positions: np.ndarray, scores: np.ndarray, total: int,
+                 top_k: int = MEMORY_TOP_K, recency_weight: float = MEMORY_RECENCY_WEIGHT) -> List[int]:
+    """
+    The top_k positions by similarity plus a recency bonus that grows linearly
+    from 0 (oldest entry) to recency_weight (newest); best first.
+    """
+    if len(positions) == 0 or top_k <= 0:
+        return []
+    recency = np.asarray(positions, dtype=np.float32) / max(total - 1, 1)
+    ranked = np.asarray(scores, dtype=np.float32) + recency_weight * recency
+    order = np.argsort(-ranked, kind="stable")[:top_k]
+    return [int(positions[i]) for i in order]
+
+
+def fit_to_budget(parts: Sequence[str], max_chars: int = MEMORY_MAX_CHARS, separator: str = "\n") -> str:
+    """Join parts in priority order, skipping any that would exceed max_chars."""
+    kept = []
+    used = 0
+    for part in parts:
+        if not part:
+            continue
+        cost = len(part) + (len(separator) if kept else 0)
+        if used + cost > max_chars:
+            if not kept and max_chars > 3:
+                # Even the most important part is too long: keep its beginning.
+                kept.append(part[:max_chars - 3].rstrip() + "...")
+                used = len(kept[0])
+            continue
+        kept.append(part)
+        used += cost
+    return separator.join(kept)
+
+
+def build_memory_context(memory_lines: Sequence[str], thread_summary: Optional[str] = None,
+                         max_chars: int = MEMORY_MAX_CHARS) -> str:
+    parts = []
+    if thread_summary:
+        parts.append(f"Earlier in this thread: {thread_summary}")
+    parts.extend(memory_lines)
+    return fit_to_budget(parts, max_chars)
+
+
+def thread_summary(thread_id: Optional[str]) -> Optional[str]:
+    if not thread_id:
+        return None
+    thread = db.get_thread(thread_id, {"rolling_summary": 1})
+    return (thread or {}).get("rolling_summary")
+
+
+async def load_thread_summaries(thread_ids: Iterable[Optional[str]]) -> dict:
+    """{thread_id: rolling_summary} for the given threads, read off the event loop in one query."""
+    thread_ids = [thread_id for thread_id in dict.fromkeys(thread_ids) if thread_id]
+    if not thread_ids:
+        return {}
+    return await asyncio.to_thread(db.rolling_summaries, thread_ids)
+
+
+# --- background re-compaction ----------------------------------------------------
+
+def build_compaction_prompt(previous: Optional[str], summaries: List[str]) -> str:
+    recent = "\n".join(f"- {summary}" for summary in summaries)
+    return (
+        "You keep a running summary of one ongoing conversation thread with a user.\n\n"
+        f"Summary so far:\n{previous or '(none yet)'}\n\n"
+        f"What the user shared since then:\n{recent}\n\n"
+        f"Write an updated summary of the whole thread in at most {THREAD_SUMMARY_MAX_CHARS} characters. "
+        "Keep the main topics, feelings and any changes over time. Do not give advice."
+    )
+
+
+async def refresh_thread_summary(thread_id: str) -> bool:
+    """Re-compact the thread's rolling summary if enough turns have accumulated."""
+    # Runs on the event loop: every MongoDB call goes through a worker thread.
+    thread = await asyncio.to_thread(db.get_thread, thread_id)
+    if not thread or thread.get("turns", 0) - thread.get("summary_turns", 0) < THREAD_SUMMARY_EVERY:
+        return False
+    since = thread.get("summary_until")
+    conversations = await asyncio.to_thread(db.thread_conversations_since, thread_id, since,
+                                            {"summary": 1, "timestamp": 1})
+    entries = [entry for entry in conversations if entry.get("summary")]
+    if not entries:
+        return False
+
+    prompt = build_compaction_prompt(thread.get("rolling_summary"), [entry["summary"] for entry in entries])
+    text = await get_client().generate_text(build_payload(prompt, maxOutputTokens=200, temperature=0.2),
+                                      priority=BACKGROUND)
+    if not text:
+        return False
+    return await asyncio.to_thread(db.set_thread_summary, thread_id, since, {
+        "rolling_summary": text.strip()[:THREAD_SUMMARY_MAX_CHARS],
+        "summary_turns": thread.get("turns", 0),
+        "summary_until": entries[-1]["timestamp"],
+        "summary_updated_at": datetime.utcnow(),
+    })
+
+
+# Threads being re-compacted by this process, and the tasks doing it (kept so
+# they aren't garbage collected mid-flight).
+_refreshing = set()
+_tasks = set()
+
+async def _refresh(thread_id: str) -> None:
+    try:
+        await refresh_thread_summary(thread_id)
+    except Exception as e:
+        print("Error refreshing thread summary:", e)
+    finally:
+        _refreshing.discard(thread_id)
+
+def schedule_refresh(thread_ids: Iterable[str]) -> None:
+    """
+    Re-compact the given threads' summaries in the background of the running
+    event loop. Does nothing outside an event loop or without a Gemini key.
+    """
+    if not GEMINI_API_KEY:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    for thread_id in dict.fromkeys(thread_ids):
+        if thread_id in _refreshing:
+            continue
+        _refreshing.add(thread_id)
+        task = loop.create_task(_refresh(thread_id))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
@@ -0,0 +1,129 @@
+# metrics.py
+"""
+In-process latency histograms exposed in Prometheus text format.
+
+Wrap a stage in `with span("stage"):` (or `await timed("stage", coro)` for a
+coroutine running alongside others) to record its duration in the
+reflectin_stage_duration_seconds histogram. While a request is being timed
+(see start_request_timing), each span is also appended to that request's
+breakdown so it can be returned in a Server-Timing header.
+
+Other modules can publish counters/gauges by registering a collector that
+returns (name, type, help, value) tuples; they are rendered with the histograms.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds; spans range from sub-millisecond NLP calls to multi-second Gemini calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [bucket counts..., sum, count]
+        self._series: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_value, series in sorted(snapshot.items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+
+stage_duration = Histogram(
+    "reflectin_stage_duration_seconds",
+    "Time spent in each stage of request handling.",
+    "stage",
+)
+scheduler_tick_duration = Histogram(
+    "reflectin_scheduler_tick_duration_seconds",
+    "Duration of scheduled background job runs.",
+    "job",
+)
+
+Collector = Callable[[], Iterable[Tuple[str, str, str, float]]]
+_collectors: List[Collector] = []
+
+
+def register_collector(collector: Collector) -> None:
+    _collectors.append(collector)
+
+
+# Per-request (stage, milliseconds) breakdown; None when the request isn't being timed.
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timing() -> List[Tuple[str, float]]:
+    """Start collecting a breakdown for the current request; returns the list spans append to."""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def record(stage: str, seconds: float) -> None:
+    stage_duration.observe(stage, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds * 1000))
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+async def timed(stage: str, awaitable):
+    """Await `awaitable`, recording how long it took under `stage`."""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Format a breakdown as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings)
+
+
+def render() -> str:
+    lines = stage_duration.render() + scheduler_tick_duration.render()
+    for collector in _collectors:
+        try:
+            samples = list(collector())
+        except Exception as e:
+            print("Error collecting metrics:", e)
+            continue
+        for name, kind, help, value in samples:
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,244 @@
+# nlp_executor.py
+"""
+Runs the CPU-bound NLP for a vent off the event loop.
+
+One spaCy pass (the "context" pipeline) yields everything /chat needs from
+the text: candidate topic terms, entities, sentiment polarity, and the
+embedding (doc.vector only depends on the static word vectors). The embedding
+is the same one the "vectors" pipeline produces. With SUMMARIZER=extractive,
+the same pass also yields the summary and its embedding. That work runs in:
+  - NLP_POOL_SIZE = 0: the event loop's default thread pool, on the shared
+    in-process pipeline. It is off the loop, but it still holds the GIL.
+  - NLP_POOL_SIZE > 0: a pool of that many worker processes. Each worker
+    loads the spaCy model once when it starts, and work spreads across cores.
+
+Requests that arrive within NLP_BATCH_WINDOW_MS of each other are grouped,
+up to NLP_BATCH_MAX texts, into one nlp.pipe call in a single task. Anything
+that needs MongoDB or per-user state stays in the calling process: topic
+ranking against the user's history, and similarity search.
+"""
+import asyncio
+import multiprocessing
+import threading
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import NLP_POOL_SIZE, NLP_BATCH_MAX, NLP_BATCH_WINDOW_MS, SENTIMENT_ENGINE, SUMMARIZER
+
+
+# --- work functions (run in a worker process, or a thread when there is no pool) --
+
+def load_models() -> None:
+    """Load the pipeline and engines the work functions use (idempotent)."""
+    from app.services import nlp_models, context_engine, sentiment_engine
+
+    nlp_models.get_nlp()
+    context_engine.get_engine()
+    if SENTIMENT_ENGINE == "lexicon":
+        sentiment_engine.get_engine()
+
+
+def analyze_batch(texts: List[str]) -> List[dict]:
+    """Terms, entities, polarity and embedding (and the extractive summary, if configured) per text, from one nlp.pipe pass."""
+    from app.services import nlp_models, context_engine, sentiment_engine, summarizer
+
+    engine = context_engine.get_engine()
+    docs = list(nlp_models.pipe(texts, "context", batch_size=max(len(texts), 1)))
+    if SENTIMENT_ENGINE == "textblob":
+        from textblob import TextBlob
+        polarities = [TextBlob(text).sentiment.polarity for text in texts]
+    else:
+        polarities = sentiment_engine.get_engine().polarities(docs)
+    results = []
+    for doc, polarity in zip(docs, polarities):
+        result = {
+            "terms": engine.candidate_terms(doc),
+            "entities": [ent.text for ent in doc.ents],
+            "polarity": float(polarity),
+            "embedding": np.asarray(doc.vector, dtype=np.float32),
+        }
+        if SUMMARIZER == "extractive":
+            result["summary"], result["summary_embedding"] = summarizer.extract(doc)
+        results.append(result)
+    return results
+
+
+def summarize_batch(texts: List[str]) -> List[dict]:
+    """Extractive summary and its embedding for each text (tokenizer pass)."""
+    from app.services import nlp_models, summarizer
+
+    docs = nlp_models.pipe(texts, "vectors", batch_size=max(len(texts), 1))
+    results = []
+    for doc in docs:
+        summary, embedding = summarizer.extract(doc)
+        results.append({"summary": summary, "summary_embedding": embedding})
+    return results
+
+
+def embed_batch(texts: List[str]) -> List[np.ndarray]:
+    """Embeddings only (tokenizer pass), e.g. for summaries at save time."""
+    from app.services import nlp_models
+
+    docs = nlp_models.pipe(texts, "vectors", batch_size=max(len(texts), 1))
+    return [np.asarray(doc.vector, dtype=np.float32) for doc in docs]
+
+
+def _warm(_) -> bool:
+    return True
+
+
+# --- process pool ------------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_executor() -> Optional[Executor]:
+    """The worker process pool, or None (the loop's thread pool) when NLP_POOL_SIZE is 0."""
+    global _pool
+    if NLP_POOL_SIZE <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the parent has Mongo clients and scheduler threads.
+                _pool = ProcessPoolExecutor(
+                    max_workers=NLP_POOL_SIZE,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=load_models,
+                )
+    return _pool
+
+
+def start() -> None:
+    """Start the workers and wait until they have loaded the model (or load it in-process)."""
+    pool = get_executor()
+    if pool is None:
+        load_models()
+    else:
+        list(pool.map(_warm, range(NLP_POOL_SIZE)))
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _run(loop, fn, texts: List[str]) -> asyncio.Future:
+    """Submit fn(texts) to the executor; a pool whose worker died is replaced on the next call."""
+    try:
+        return loop.run_in_executor(get_executor(), fn, texts)
+    except BrokenProcessPool:
+        print("NLP worker pool broken; starting a new one")
+        shutdown()
+        return loop.run_in_executor(get_executor(), fn, texts)
+
+
+# --- micro-batching ------------------------------------------------------------------
+
+class MicroBatcher:
+    """
+    Collects single-text requests on one event loop and runs them through a
+    batch function in groups, either when NLP_BATCH_MAX are waiting or
+    NLP_BATCH_WINDOW_MS after the first of them arrived.
+    """
+
+    def __init__(self, fn, max_batch: int = NLP_BATCH_MAX, window_ms: float = NLP_BATCH_WINDOW_MS):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, text: str):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush, loop)
+        return await future
+
+    def _flush(self, loop) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            done = _run(loop, self.fn, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        done.add_done_callback(lambda result: self._deliver(batch, result))
+
+    @staticmethod
+    def _deliver(batch, result) -> None:
+        error = result.exception()
+        if isinstance(error, BrokenProcessPool):
+            shutdown()
+        for i, (_, future) in enumerate(batch):
+            if future.done():  # caller went away
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result.result()[i])
+
+
+# One batcher per event loop and function (futures belong to their loop).
+_batchers: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _batcher(fn) -> MicroBatcher:
+    loop = asyncio.get_running_loop()
+    per_loop = _batchers.setdefault(loop, {})
+    if fn not in per_loop:
+        per_loop[fn] = MicroBatcher(fn)
+    return per_loop[fn]
+
+
+async def analyze(text: str) -> dict:
+    """analyze_batch for one text, batched with other requests arriving at the same time."""
+    return await _batcher(analyze_batch).submit(text)
+
+
+async def embed(text: str) -> np.ndarray:
+    return await _batcher(embed_batch).submit(text)
+
+
+async def summarize(text: str) -> dict:
+    return await _batcher(summarize_batch).submit(text)
+
+
+async def _map_chunks(fn, texts: List[str]) -> list:
+    """fn over texts split into one chunk per worker, results concatenated in order."""
+    if not texts:
+        return []
+    loop = asyncio.get_running_loop()
+    chunk = -(-len(texts) // max(NLP_POOL_SIZE, 1))
+    parts = await asyncio.gather(*(
+        _run(loop, fn, texts[i:i + chunk])
+        for i in range(0, len(texts), chunk)
+    ))
+    return [item for part in parts for item in part]
+
+
+async def analyze_many(texts: List[str]) -> List[dict]:
+    """analyze_batch for a whole list (e.g. /chat/batch), spread across the workers."""
+    return await _map_chunks(analyze_batch, texts)
+
+
+async def embed_many(texts: List[str]) -> List[np.ndarray]:
+    return await _map_chunks(embed_batch, texts)
@@ -0,0 +1,66 @@
+# nlp_models.py
+"""
+Process-wide registry for spaCy pipelines.
+
+Each model is loaded once per process and shared by every service. Callers ask
+for a *use case* instead of a pipeline; the registry runs only the components
+that use case needs by passing `disable=` per call, so one shared pipeline
+serves every caller without anyone toggling global pipe state.
+"""
+import threading
+from typing import Iterable, Iterator, List
+
+import spacy
+from spacy.language import Language
+from spacy.tokens import Doc
+
+from app.config import SPACY_MODEL
+
+# Components each use case needs. Anything else in the loaded pipeline is skipped.
+#   vectors: doc.vector is the mean of static token vectors, so the tokenizer is enough.
+#   context: entities, lemmas and stop words (the rule lemmatizer needs POS tags).
+USE_CASES = {
+    "vectors": (),
+    "context": ("tok2vec", "tagger", "attribute_ruler", "lemmatizer", "ner"),
+}
+
+_models = {}
+_lock = threading.Lock()
+
+
+def get_nlp(name: str = SPACY_MODEL) -> Language:
+    """Return the shared pipeline for `name`, loading it on first use."""
+    nlp = _models.get(name)
+    if nlp is None:
+        with _lock:
+            nlp = _models.get(name)
+            if nlp is None:
+                nlp = spacy.load(name)
+                _models[name] = nlp
+    return nlp
+
+
+def disabled_for(use_case: str, name: str = SPACY_MODEL) -> List[str]:
+    """Names of the loaded components a use case does not need."""
+    needed = USE_CASES[use_case]
+    return [pipe for pipe in get_nlp(name).pipe_names if pipe not in needed]
+
+
+def process(text: str, use_case: str, name: str = SPACY_MODEL) -> Doc:
+    """Run a single text through the components for `use_case`."""
+    return get_nlp(name)(text, disable=disabled_for(use_case, name))
+
+
+def pipe(texts: Iterable[str], use_case: str, batch_size: int = 256,
+         n_process: int = 1, name: str = SPACY_MODEL) -> Iterator[Doc]:
+    """Batched counterpart of process(), backed by nlp.pipe."""
+    return get_nlp(name).pipe(
+        texts,
+        batch_size=batch_size,
+        n_process=n_process,
+        disable=disabled_for(use_case, name),
+    )
+
+
+def vectors_length(name: str = SPACY_MODEL) -> int:
+    return get_nlp(name).vocab.vectors_length
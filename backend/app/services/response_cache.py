@@ -0,0 +1,143 @@
+# response_cache.py
+"""
+Response cache for Gemini generateContent calls.
+
+Responses are keyed by model, prompt contents and generationConfig. Lookups go
+through an in-process LRU/TTL tier first and, when enabled, a MongoDB tier
+shared by every worker (a TTL index on `expires_at` lets Mongo expire entries).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+
+def cache_key(model: str, payload: dict) -> str:
+    material = json.dumps(
+        {
+            "model": model,
+            "contents": payload.get("contents"),
+            "generationConfig": payload.get("generationConfig"),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class MongoCacheTier:
+    """Shared cache tier stored in a MongoDB collection."""
+
+    def __init__(self, collection, ttl: float = 600):
+        self.collection = collection
+        self.ttl = ttl
+        self._indexed = False
+
+    def _ensure_index(self) -> None:
+        if not self._indexed:
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+    def get(self, key: str) -> Optional[dict]:
+        self._ensure_index()
+        # Mongo's TTL monitor only runs once a minute, so also filter on expiry here.
+        doc = self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+                                       {"response": 1})
+        return doc["response"] if doc else None
+
+    def set(self, key: str, value: dict) -> None:
+        self._ensure_index()
+        self.collection.replace_one(
+            {"_id": key},
+            {"response": value, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)},
+            upsert=True,
+        )
+
+
+class ResponseCache:
+    def __init__(self, local: LRUTTLCache, shared: Optional[MongoCacheTier] = None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                print("Error reading shared response cache:", e)
+                value = None
+            if value is not None:
+                self._count("shared_hits")
+                self.local.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                print("Error writing shared response cache:", e)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            "size": len(self.local),
+        }
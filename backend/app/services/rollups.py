@@ -0,0 +1,137 @@
+# rollups.py
+"""
+Emotional-history rollups, maintained incrementally as conversations are saved.
+
+Documents in the rollups collection (kind field):
+  sentiment - one per user per day ("2026-10-18") and per ISO week ("2026-W42"):
+              count, score_sum/min/max of sentiment_score and polarity_sum
+  topics    - one per user: how many conversations were saved under each topic
+  thread    - one per thread: score count/sum/min/max, first/last timestamps and
+              the most recent THREAD_TRAJECTORY_POINTS (timestamp, score) points
+
+Every save turns into a handful of $inc/$min/$max/$push upserts sent in one
+bulk_write, so reading a user's history costs O(buckets) instead of a scan
+over all their conversations.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from app.utils import db
+
+THREAD_TRAJECTORY_POINTS = 100
+GRANULARITIES = ("day", "week")
+
+
+def bucket_for(timestamp: datetime, granularity: str):
+    """(bucket label, bucket start) for a timestamp."""
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if granularity == "day":
+        return day.strftime("%Y-%m-%d"), day
+    iso = timestamp.isocalendar()
+    return f"{iso[0]}-W{iso[1]:02d}", day - timedelta(days=timestamp.weekday())
+
+
+def _safe_key(key: str) -> bool:
+    # Topics become field names under `topics.`; skip anything Mongo can't store as one.
+    return bool(key) and "." not in key and not key.startswith("$")
+
+
+def rollup_operations(entry: dict) -> List[UpdateOne]:
+    """The rollup updates one saved conversation contributes."""
+    user_id = entry["user_id"]
+    timestamp = entry["timestamp"]
+    sentiment = entry.get("sentiment") or {}
+    score = sentiment.get("sentiment_score")
+    polarity = sentiment.get("polarity", 0.0)
+    operations = []
+
+    if score is not None:
+        for granularity in GRANULARITIES:
+            bucket, start = bucket_for(timestamp, granularity)
+            operations.append(UpdateOne(
+                {"_id": f"sentiment:{user_id}:{granularity}:{bucket}"},
+                {
+                    "$setOnInsert": {"kind": "sentiment", "user_id": user_id, "granularity": granularity,
+                                     "bucket": bucket, "bucket_start": start},
+                    "$inc": {"count": 1, "score_sum": score, "polarity_sum": polarity},
+                    "$min": {"score_min": score},
+                    "$max": {"score_max": score},
+                },
+                upsert=True,
+            ))
+
+    topic = entry.get("topic")
+    if topic and _safe_key(topic):
+        operations.append(UpdateOne(
+            {"_id": f"topics:{user_id}"},
+            {"$setOnInsert": {"kind": "topics", "user_id": user_id},
+             "$inc": {"total": 1, f"topics.{topic}": 1}},
+            upsert=True,
+        ))
+
+    thread_id = entry.get("thread_id")
+    if thread_id and score is not None:
+        operations.append(UpdateOne(
+            {"_id": f"thread:{thread_id}"},
+            {
+                "$setOnInsert": {"kind": "thread", "user_id": user_id, "thread_id": thread_id},
+                "$inc": {"count": 1, "score_sum": score},
+                "$min": {"score_min": score, "first_at": timestamp},
+                "$max": {"score_max": score, "last_at": timestamp},
+                # Sorted on write: saves from different workers (or the write-behind
+                # thread) can land out of order.
+                "$push": {"trajectory": {"$each": [{"t": timestamp, "score": score}],
+                                         "$sort": {"t": 1}, "$slice": -THREAD_TRAJECTORY_POINTS}},
+            },
+            upsert=True,
+        ))
+    return operations
+
+
+def record_conversations(entries: Iterable[dict]) -> None:
+    """Fold saved conversations into their rollups with one bulk_write."""
+    operations = [op for entry in entries for op in rollup_operations(entry)]
+    db.bulk_update_rollups(operations)
+
+
+def get_history(user_id: str, granularity: str = "day", limit: int = 30,
+                topic_limit: int = 10, thread_limit: int = 10) -> dict:
+    """A user's emotional history, read entirely from rollup documents."""
+    buckets = []
+    for doc in db.sentiment_rollups(user_id, granularity, limit):
+        buckets.append({
+            "bucket": doc["bucket"],
+            "start": doc["bucket_start"],
+            "count": doc["count"],
+            "mean_score": doc["score_sum"] / doc["count"],
+            "min_score": doc["score_min"],
+            "max_score": doc["score_max"],
+            "mean_polarity": doc["polarity_sum"] / doc["count"],
+        })
+    buckets.reverse()  # oldest first, for charting
+
+    topic_doc: Optional[dict] = db.topic_rollup(user_id)
+    topic_counts = (topic_doc or {}).get("topics", {})
+    topics = sorted(topic_counts.items(), key=lambda item: -item[1])[:topic_limit]
+
+    threads = []
+    for doc in db.thread_rollups(user_id, thread_limit):
+        threads.append({
+            "thread_id": doc["thread_id"],
+            "count": doc["count"],
+            "mean_score": doc["score_sum"] / doc["count"],
+            "min_score": doc["score_min"],
+            "max_score": doc["score_max"],
+            "first_at": doc["first_at"],
+            "last_at": doc["last_at"],
+            "trajectory": doc.get("trajectory", []),
+        })
+
+    return {
+        "granularity": granularity,
+        "sentiment": buckets,
+        "topics": [{"topic": topic, "count": count} for topic, count in topics],
+        "threads": threads,
+    }
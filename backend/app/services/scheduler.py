@@ -1,55 +1,194 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
-import random
-from app.config import conversations
+import asyncio
+import time
+from collections import Counter
+from typing import Iterable, List
+from pymongo import UpdateOne
+from app.utils import db
+from app.services.metrics import scheduler_tick_duration, register_collector
+from app.services.leader_lease import LeaderLease
+from app.services.thread_centroids import centroid_pipeline, group_means
+from app.config import (
+    FOLLOWUP_QUIET_SECONDS,
+    FOLLOWUP_REPEAT_SECONDS,
+    FOLLOWUP_MAX_AGE_SECONDS,
+    FOLLOWUP_BATCH_SIZE,
+    FOLLOWUP_MAX_BATCHES,
+    SCHEDULER_LEASE_TTL_SECONDS,
+    SCHEDULER_LEASE_RENEW_SECONDS,
+    CHECKUP_PREGENERATE_ENABLED,
+    GEMINI_API_KEY,
+)
+
+# Follow-ups are tracked per thread in the `threads` collection:
+#   {_id: thread_id, user_id, last_activity, notifications_sent,
+#    first_notification_time, next_notify_at, turns,
+#    checkup_due_at, checkup_message, checkup_generated_at}
+# `next_notify_at` is only present while a follow-up is pending, so the sparse
+# index on it holds just the threads that can still become due. `checkup_due_at`
+# works the same way for check-up messages that still need generating.
 
 def generate_generic_notification_message():
     # A generic, friendly notification message
     return "ReflectIn would love to know: How are you feeling now?"
 
-def send_followup_notification():
-    now = datetime.utcnow()
-    # Only consider conversations from the last 5 minutes
-    recent_threshold = now - timedelta(minutes=5)
-    last_convo = conversations.find_one(
-        {"timestamp": {"$gte": recent_threshold}, "bot_reply": {"$exists": True}},
-        sort=[("timestamp", -1)]
-    )
-    
-    if not last_convo:
-        return  # No recent conversation, do nothing
-
-    last_timestamp = last_convo.get("timestamp")
-    if not last_timestamp:
-        return
-    
-    # Check if the conversation has been quiet for more than 15 seconds
-    delta = (now - last_timestamp).total_seconds()
-    if delta <= 15:
-        return  # Conversation is still active, do nothing
+def _followup_reset(user_id: str, now: datetime, turns: int = 1) -> List[dict]:
+    # A new vent makes the thread active again: restart its follow-up schedule.
+    # `turns` counts vents on the thread (the memory builder re-summarizes by it).
+    # A stored check-up message is about the old conversation: drop it and
+    # generate a new one once the thread goes quiet again.
+    # Written as pipeline stages so it can share a statement with the centroid update.
+    quiet_at = now + timedelta(seconds=FOLLOWUP_QUIET_SECONDS)
+    return [
+        {"$set": {
+            "user_id": {"$literal": user_id},
+            "turns": {"$add": [{"$ifNull": ["$turns", 0]}, turns]},
+            "last_activity": now,
+            "notifications_sent": 0,
+            "next_notify_at": quiet_at,
+            "checkup_due_at": quiet_at,
+        }},
+        {"$unset": ["first_notification_time", "checkup_message", "checkup_generated_at"]},
+    ]
+
+def thread_activity_updates(entries: Iterable[dict]) -> List[UpdateOne]:
+    """
+    One update per thread touched by the saved entries: fold them into the
+    thread's centroid and restart its follow-up schedule, in a single statement.
+    """
+    entries = list(entries)
+    users, turns, latest = {}, Counter(), {}
+    for entry in entries:
+        thread_id = entry["thread_id"]
+        users[thread_id] = entry["user_id"]
+        turns[thread_id] += 1
+        latest[thread_id] = max(latest.get(thread_id, entry["timestamp"]), entry["timestamp"])
+    means = group_means((entry["thread_id"], entry.get("embedding")) for entry in entries)
+    operations = []
+    for thread_id, count in turns.items():
+        pipeline = _followup_reset(users[thread_id], latest[thread_id], count)
+        if thread_id in means:
+            mean, k = means[thread_id]
+            pipeline = centroid_pipeline(users[thread_id], mean, k) + pipeline
+        operations.append(UpdateOne({"_id": thread_id}, pipeline, upsert=True))
+    return operations
+
+def _advance(thread: dict, now: datetime):
+    """The update that moves a due thread to its next follow-up state."""
+    # Matching on the next_notify_at we read makes this a no-op if a new vent
+    # rescheduled the thread in the meantime.
+    match = {"_id": thread["_id"], "next_notify_at": thread["next_notify_at"]}
 
-    notifications_sent = last_convo.get("notifications_sent", 0)
+    last_activity = thread.get("last_activity")
+    if not last_activity or (now - last_activity).total_seconds() > FOLLOWUP_MAX_AGE_SECONDS:
+        # Too old to follow up on (e.g. it went due while we were down): drop it.
+        return UpdateOne(match, {"$unset": {"next_notify_at": ""}})
+
+    notifications_sent = thread.get("notifications_sent", 0)
     if notifications_sent == 0:
         # Send the first notification
         notification_text = generate_generic_notification_message()
         # print(notification_text)  # Print only the notification message
-        conversations.update_one(
-            {"_id": last_convo["_id"]},
-            {"$set": {"notifications_sent": 1, "first_notification_time": now}}
-        )
-    elif notifications_sent == 1:
-        first_notification_time = last_convo.get("first_notification_time")
-        if first_notification_time and (now - first_notification_time).total_seconds() > 15:
-            # Send the second notification
-            notification_text = generate_generic_notification_message()
-            # print(notification_text)  # Print only the notification message
-            conversations.update_one(
-                {"_id": last_convo["_id"]},
-                {"$set": {"notifications_sent": 2}}
-            )
+        return UpdateOne(match, {"$set": {
+            "notifications_sent": 1,
+            "first_notification_time": now,
+            "next_notify_at": now + timedelta(seconds=FOLLOWUP_REPEAT_SECONDS),
+        }})
+
+    # Send the second (last) notification
+    notification_text = generate_generic_notification_message()
+    # print(notification_text)  # Print only the notification message
+    return UpdateOne(match, {"$set": {"notifications_sent": 2}, "$unset": {"next_notify_at": ""}})
+
+def send_followup_notification():
+    """
+    Advance every thread whose follow-up is due. Due threads are read from the
+    next_notify_at index in batches of FOLLOWUP_BATCH_SIZE, at most
+    FOLLOWUP_MAX_BATCHES per tick, and each batch is written with one bulk_write.
+    Whatever is left over stays due and is picked up on the next tick.
+    """
+    now = datetime.utcnow()
+    for _ in range(FOLLOWUP_MAX_BATCHES):
+        due = db.due_threads(now, FOLLOWUP_BATCH_SIZE)
+        if not due:
+            return
+        db.bulk_update_threads([_advance(thread, now) for thread in due])
+        if len(due) < FOLLOWUP_BATCH_SIZE:
+            return
+
+# Async jobs run on the application's event loop (captured by start_scheduler),
+# so their Gemini calls share its client and request scheduler with /chat.
+_loop = None
+
+async def _standalone(coro_fn):
+    from app.services.gemini_client import close_client
+    try:
+        return await coro_fn()
+    finally:
+        await close_client()
+
+def run_async(coro_fn):
+    """Run coro_fn() to completion from a scheduler thread."""
+    if _loop is not None and _loop.is_running():
+        return asyncio.run_coroutine_threadsafe(coro_fn(), _loop).result()
+    return asyncio.run(_standalone(coro_fn))
+
+def pregenerate_checkups():
+    """Generate and store check-up messages for threads that have gone quiet."""
+    from app.services.checkups import pregenerate_checkups as pregenerate
+    run_async(pregenerate)
+
+# Every worker runs a scheduler, but only the lease holder's jobs do any work;
+# the others keep heartbeating as standbys.
+lease = LeaderLease("scheduler", SCHEDULER_LEASE_TTL_SECONDS)
+
+def _leader_metrics():
+    return [("reflectin_scheduler_leader", "gauge", "1 if this worker holds the scheduler lease.",
+             int(lease.is_leader()))]
+
+register_collector(_leader_metrics)
+
+def timed_job(job_id, fn):
+    """
+    Wrap a scheduled job so it only runs on the lease holder and each run's
+    duration lands in the scheduler tick histogram.
+    """
+    def run():
+        if not lease.is_leader():
+            return
+        start = time.perf_counter()
+        try:
+            fn()
+        finally:
+            scheduler_tick_duration.observe(job_id, time.perf_counter() - start)
+    return run
+
+_scheduler = None
 
 def start_scheduler():
+    global _scheduler, _loop
+    if _scheduler is not None:
+        return
+    try:
+        _loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _loop = None
     scheduler = BackgroundScheduler()
+    # First heartbeat right away (on the scheduler's thread, not the caller's).
+    scheduler.add_job(lease.heartbeat, 'interval', seconds=SCHEDULER_LEASE_RENEW_SECONDS, id='lease_heartbeat',
+                      next_run_time=datetime.now())
     # For testing: check every 5 seconds if a notification should be sent.
-    scheduler.add_job(send_followup_notification, 'interval', seconds=5, id='notify_check')
+    scheduler.add_job(timed_job('notify_check', send_followup_notification), 'interval', seconds=5, id='notify_check')
+    if CHECKUP_PREGENERATE_ENABLED and GEMINI_API_KEY:
+        scheduler.add_job(timed_job('checkup_pregenerate', pregenerate_checkups), 'interval', seconds=5,
+                          id='checkup_pregenerate')
     scheduler.start()
+    _scheduler = scheduler
+
+def stop_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.shutdown(wait=False)
+        _scheduler = None
+        lease.release()
@@ -0,0 +1,173 @@
+# sentiment_engine.py
+"""
+Lexicon sentiment that scores spaCy docs directly.
+
+It follows TextBlob's default (pattern) analyzer: the same polarity lexicon
+and the same rules. Polarity is the mean over known words. An adverb
+intensifies the word after it ("really good"). A negation flips and halves
+a word's polarity ("not good"). "!" boosts the previous word, and emoticons
+count as words. Scores go through the same 1-10 bucketing as before
+(bucket_polarity), so sentiment_score and sentiment_label match what
+TextBlob produced. The differences come from the two tokenizers, which split
+a few things (hyphenated words, odd punctuation) differently;
+benchmarks/bench_sentiment.py measures the agreement.
+
+The lexicon is loaded once into arrays sorted by spaCy's lowercase string
+hash. A whole batch of docs is looked up with one searchsorted over their
+token hashes. Docs with no adverb, negation, "!" or emoticon need no rules,
+so their polarity is a vectorized mean. Only the remaining docs walk their
+tokens through the rules.
+"""
+import threading
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+from spacy.attrs import LOWER
+from spacy.strings import get_string_id
+from textblob._text import EMOTICONS, PUNCTUATION
+from textblob.en import sentiment as pattern_sentiment
+
+NEGATIONS = ("no", "not", "n't", "never")
+
+
+def bucket_polarity(polarity: float) -> dict:
+    """Map a polarity in [-1, 1] to the app's 1-10 sentiment_score and label."""
+    sentiment_score = int(((polarity + 1) / 2) * 9) + 1
+
+    if sentiment_score > 6:
+        sentiment_label = "Positive"
+    elif sentiment_score < 4:
+        sentiment_label = "Negative"
+    else:
+        sentiment_label = "Neutral"
+
+    return {
+        "polarity": polarity,
+        "sentiment_score": sentiment_score,
+        "sentiment_label": sentiment_label
+    }
+
+
+def _clamp(value: float) -> float:
+    return max(-1.0, min(value, 1.0))
+
+
+class SentimentEngine:
+    def __init__(self, lexicon: dict, emoticons: dict):
+        # word -> (polarity, intensity, is_modifier), for the rule walk
+        self.words = {
+            word: (float(scores[None][0]), float(scores[None][2]), "RB" in scores)
+            for word, scores in lexicon.items()
+        }
+        self.emoticons = emoticons
+
+        # Lookup table for the vectorized pass: every word that can matter, by hash.
+        table = {}
+        for word, (polarity, _, is_modifier) in self.words.items():
+            table[get_string_id(word)] = (polarity, True, is_modifier or word in NEGATIONS)
+        for word in list(NEGATIONS) + ["!"] + list(emoticons):
+            key = get_string_id(word)
+            polarity, known, _ = table.get(key, (0.0, False, True))
+            table[key] = (polarity, known, True)
+        keys = np.fromiter(table, dtype=np.uint64, count=len(table))
+        order = np.argsort(keys)
+        values = list(table.values())
+        self.keys = keys[order]
+        self.polarity = np.asarray([values[i][0] for i in order], dtype=np.float64)
+        self.known = np.asarray([values[i][1] for i in order], dtype=bool)
+        self.needs_rules = np.asarray([values[i][2] for i in order], dtype=bool)
+
+    def polarities(self, docs: Iterable) -> np.ndarray:
+        """Polarity of each doc, in order."""
+        docs = list(docs)
+        if not docs:
+            return np.zeros(0)
+        hashes = [doc.to_array(LOWER).astype(np.uint64, copy=False).reshape(-1) for doc in docs]
+        lengths = np.fromiter((len(h) for h in hashes), dtype=np.int64, count=len(hashes))
+        flat = np.concatenate(hashes)
+        doc_of = np.repeat(np.arange(len(docs)), lengths)
+
+        slot = np.minimum(np.searchsorted(self.keys, flat), len(self.keys) - 1)
+        found = self.keys[slot] == flat
+        known = found & self.known[slot]
+        sums = np.bincount(doc_of, weights=np.where(known, self.polarity[slot], 0.0), minlength=len(docs))
+        counts = np.bincount(doc_of, weights=known, minlength=len(docs))
+        result = sums / np.maximum(counts, 1)
+
+        needs_rules = np.bincount(doc_of, weights=found & self.needs_rules[slot], minlength=len(docs))
+        for i in np.flatnonzero(needs_rules):
+            result[i] = self.assess([token.lower_ for token in docs[i]])
+        return result
+
+    def assess(self, words: Sequence[str]) -> float:
+        """Polarity of a lowercase token sequence, walking pattern's modifier/negation rules."""
+        assessments = []  # [polarity, intensity, negated]
+        modifier: Optional[str] = None
+        negation: Optional[str] = None
+        for word in words:
+            entry = self.words.get(word)
+            if entry is not None:
+                polarity, intensity, is_modifier = entry
+                if modifier is None:
+                    assessments.append([polarity, intensity, False])
+                else:
+                    # "really good": the adverb's intensity scales this word.
+                    assessments[-1][0] = _clamp(polarity * assessments[-1][1])
+                    assessments[-1][1] = intensity
+                if negation is not None:
+                    assessments[-1][1] = 1.0 / assessments[-1][1]
+                    assessments[-1][2] = True
+                modifier = word if is_modifier else None
+                negation = word if word in NEGATIONS else None
+                continue
+
+            if word in NEGATIONS:
+                negation = word
+            elif negation and len(word.strip("'")) > 1:
+                # Negation carries across short words only ("not a good").
+                negation = None
+            if negation is not None and modifier is not None and modifier.endswith("ly"):
+                # "really not good"
+                assessments[-1][2] = True
+                negation = None
+            elif modifier and len(word) > 2:
+                modifier = None
+            if word == "!" and assessments:
+                assessments[-1][0] = _clamp(assessments[-1][0] * 1.25)
+            if not word.isalpha() and len(word) <= 5 and word not in PUNCTUATION and word in self.emoticons:
+                assessments.append([self.emoticons[word], 1.0, False])
+
+        if not assessments:
+            return 0.0
+        # "not good" = slightly bad, "not bad" = slightly good.
+        return sum(p * -0.5 if negated else p for p, _, negated in assessments) / len(assessments)
+
+    def analyze(self, docs: Iterable) -> List[dict]:
+        return [bucket_polarity(float(polarity)) for polarity in self.polarities(docs)]
+
+
+def load_emoticons() -> dict:
+    emoticons = {}
+    for (_, polarity), forms in EMOTICONS.items():
+        for form in forms:
+            emoticons.setdefault(form.lower(), polarity)
+    return emoticons
+
+
+_engine: Optional[SentimentEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> SentimentEngine:
+    """The process-wide engine, built from TextBlob's lexicon on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # items() loads the lexicon on first access (it is a lazy dict).
+                _engine = SentimentEngine(dict(pattern_sentiment.items()), load_emoticons())
+    return _engine
+
+
+def analyze_docs(docs: Iterable) -> List[dict]:
+    return get_engine().analyze(docs)
@@ -0,0 +1,102 @@
+# summarizer.py
+"""
+Vent summaries: the similarity key and memory text stored with each conversation.
+
+SUMMARIZER picks the implementation:
+  gemini     - asks Gemini for a 1-2 sentence summary (one extra upstream call
+               per vent, run alongside the reflection)
+  extractive - keeps the SUMMARY_MAX_SENTENCES sentences whose vectors are
+               most similar to the whole vent's vector, in their original
+               order. It uses the static spaCy vectors already loaded, so
+               no network call is needed. The summary's embedding (the mean
+               of the kept tokens' vectors) comes out of the same pass.
+
+Both expose `async summarize(text, analysis, priority) -> (summary, embedding)`;
+the embedding is None when the caller still has to embed the summary. With
+the extractive summarizer, nlp_executor.analyze_batch already adds "summary"
+and "summary_embedding" to the analysis, so /chat gets both from the NLP pass
+it runs anyway.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+from spacy.pipeline import Sentencizer
+from spacy.tokens import Doc
+
+from app.config import SUMMARIZER, SUMMARY_MAX_SENTENCES
+from app.services import nlp_executor
+from app.services.gemini_client import get_client, build_payload
+from app.services.gemini_scheduler import INTERACTIVE
+
+_sentencizer = Sentencizer()
+
+
+def build_summary_payload(vent_text: str) -> dict:
+    return build_payload(
+        f"Summarize this vent in 1-2 sentences without giving advice:\n\n{vent_text}",
+        maxOutputTokens=100,
+        temperature=0.3
+    )
+
+
+def split_sentences(doc: Doc) -> List:
+    """The doc's non-empty sentences; punctuation rules unless a pipeline component already set them."""
+    if not doc.has_annotation("SENT_START"):
+        doc = _sentencizer(doc)
+    return [sent for sent in doc.sents if sent.text.strip()]
+
+
+def extract(doc: Doc, max_sentences: int = SUMMARY_MAX_SENTENCES) -> Tuple[str, np.ndarray]:
+    """The extractive summary of a doc and its embedding."""
+    sentences = split_sentences(doc)
+    if len(sentences) > max_sentences:
+        vectors = np.asarray([sent.vector for sent in sentences], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        centroid = np.asarray(doc.vector, dtype=np.float32)
+        scores = (vectors @ centroid) / norms
+        # Best first, earlier sentences winning ties; then back to reading order.
+        keep = sorted(sorted(range(len(sentences)), key=lambda i: (-scores[i], i))[:max_sentences])
+        sentences = [sentences[i] for i in keep]
+    if not sentences:
+        return "", np.zeros(doc.vocab.vectors_length, dtype=np.float32)
+    # Same as embedding the summary text: the mean over the kept tokens.
+    tokens = sum(len(sent) for sent in sentences)
+    embedding = sum(sent.vector * len(sent) for sent in sentences) / tokens
+    return " ".join(sent.text.strip() for sent in sentences), np.asarray(embedding, dtype=np.float32)
+
+
+class GeminiSummarizer:
+    name = "gemini"
+
+    async def summarize(self, text: str, analysis: Optional[dict] = None,
+                        priority: int = INTERACTIVE) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        return await get_client().generate_text(build_summary_payload(text), priority=priority), None
+
+
+class ExtractiveSummarizer:
+    name = "extractive"
+
+    async def summarize(self, text: str, analysis: Optional[dict] = None,
+                        priority: int = INTERACTIVE) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        if analysis is None or "summary" not in analysis:
+            analysis = await nlp_executor.summarize(text)
+        if not analysis["summary"]:
+            return None, None
+        return analysis["summary"], analysis["summary_embedding"]
+
+
+SUMMARIZERS = {
+    "gemini": GeminiSummarizer,
+    "extractive": ExtractiveSummarizer,
+}
+
+_summarizer = None
+
+
+def get_summarizer():
+    """The configured summarizer; unknown names fall back to Gemini."""
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = SUMMARIZERS.get(SUMMARIZER, GeminiSummarizer)()
+    return _summarizer
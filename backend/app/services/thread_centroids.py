@@ -0,0 +1,137 @@
+# thread_centroids.py
+"""
+Per-thread centroid embeddings for thread resolution.
+
+A thread's centroid is the mean of its entries' L2-normalized embeddings
+(entries with an all-zero embedding don't count). Resolving a vent to a thread
+scores it against one centroid per thread, not against every past entry, so
+the cost grows with the number of threads, not with the user's history.
+
+Centroids are stored on the thread document (centroid, centroid_count) and
+kept up to date with a running mean on every save:
+
+    centroid' = centroid + (batch_mean - centroid) * k / (count + k)
+
+applied as an update pipeline, so concurrent saves to a thread don't
+overwrite each other. scheduler.thread_activity_updates sends it in the same
+statement as the thread's follow-up reset. Each worker's UserMemory loads the stored
+centroids (recomputing a thread from its entries only when the stored count
+disagrees with them) and applies the same update to entries it remembers.
+
+A vent joins a thread when it scores >= the threshold against the thread's
+centroid. That is stricter than scoring >= the threshold against any one of
+its entries: a tight thread matches as before, but a thread whose entries
+are spread out needs a vent close to all of them.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+
+def unit(vector) -> Optional[np.ndarray]:
+    """vector scaled to length 1, or None when it is all zeros (no known words)."""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
+
+
+class ThreadCentroids:
+    """Running-mean centroids; row i of `vectors` belongs to thread_ids[i]."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.thread_ids: List[str] = []
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.thread_ids)
+
+    def count(self, thread_id: str) -> int:
+        row = self._rows.get(thread_id)
+        return 0 if row is None else int(self.counts[row])
+
+    def update(self, thread_id: str, mean: np.ndarray, k: int = 1) -> None:
+        """Fold k unit vectors whose mean is `mean` into the thread's centroid."""
+        row = self._rows.get(thread_id)
+        if row is None:
+            self._rows[thread_id] = len(self.thread_ids)
+            self.thread_ids.append(thread_id)
+            self.counts = np.append(self.counts, k)
+            self.vectors = np.vstack([self.vectors, np.asarray(mean, dtype=np.float32)[None, :]])
+            return
+        self.counts[row] += k
+        self.vectors[row] += (mean - self.vectors[row]) * (k / self.counts[row])
+
+    def best(self, query: np.ndarray, threshold: float) -> Tuple[Optional[str], float]:
+        """
+        The thread whose centroid is most similar to query, if it scores >= threshold.
+        Ties go to the smallest thread id, so the answer doesn't depend on load order.
+        """
+        query = unit(query)
+        if query is None or not self.thread_ids:
+            return None, 0.0
+        norms = np.linalg.norm(self.vectors, axis=1)
+        norms[norms == 0] = 1.0
+        scores = (self.vectors @ query) / norms
+        top = float(scores.max())
+        if top < threshold:
+            return None, top
+        tied = np.flatnonzero(scores == top)
+        return min(self.thread_ids[i] for i in tied), top
+
+
+def group_means(pairs: Iterable[Tuple[str, object]]) -> Dict[str, Tuple[np.ndarray, int]]:
+    """(thread_id, embedding) pairs -> {thread_id: (mean unit vector, count)}, skipping zero vectors."""
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = {}
+    for thread_id, embedding in pairs:
+        if not thread_id or embedding is None:
+            continue
+        vector = unit(embedding)
+        if vector is None:
+            continue
+        if thread_id in sums:
+            sums[thread_id] += vector
+            counts[thread_id] += 1
+        else:
+            sums[thread_id] = vector.copy()
+            counts[thread_id] = 1
+    return {thread_id: (sums[thread_id] / counts[thread_id], counts[thread_id]) for thread_id in sums}
+
+
+def centroid_pipeline(user_id: str, mean: np.ndarray, k: int) -> List[dict]:
+    """Update pipeline applying the running mean to a thread document (creating it if needed)."""
+    mean = [float(x) for x in mean]
+    count = {"$ifNull": ["$centroid_count", 0]}
+    total = {"$add": [count, k]}
+    element = lambda array: {"$arrayElemAt": [array, "$$i"]}
+    folded = {
+        "$map": {
+            "input": {"$range": [0, len(mean)]},
+            "as": "i",
+            "in": {"$add": [
+                element("$centroid"),
+                {"$multiply": [{"$subtract": [element({"$literal": mean}), element("$centroid")]},
+                               {"$divide": [k, total]}]},
+            ]},
+        }
+    }
+    return [{"$set": {
+        "user_id": {"$literal": user_id},
+        "centroid_count": total,
+        "centroid": {"$cond": [{"$isArray": "$centroid"}, folded, {"$literal": mean}]},
+    }}]
+
+
+def repair_update(user_id: str, thread_id: str, mean: np.ndarray, k: int) -> UpdateOne:
+    """Overwrite a thread's stored centroid with one computed from all its entries."""
+    return UpdateOne({"_id": thread_id}, {"$set": {
+        "user_id": user_id,
+        "centroid": [float(x) for x in mean],
+        "centroid_count": k,
+    }}, upsert=True)
@@ -0,0 +1,173 @@
+# vector_index.py
+"""
+In-memory vector indexes for per-user memory retrieval.
+
+Every index stores L2-normalized float32 rows addressed by insertion position,
+and search(query, threshold) returns the positions (in insertion order) and
+cosine scores of the rows scoring >= threshold. That is exactly the contract of
+the brute-force scan in filtering.py, so indexes can be swapped freely:
+
+  - ExactIndex: brute-force, one mat-vec product over every row.
+  - IVFIndex:   inverted-file partitioning. Rows are clustered with spherical
+                k-means and a query only scores the rows of the `nprobe`
+                clusters whose centroids are closest. Results are still
+                filtered by the exact cosine score, so the threshold never lets
+                a worse match through; the approximation is only in recall.
+                Below `min_train_size` rows it behaves exactly like ExactIndex.
+"""
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class ExactIndex:
+    """Brute-force cosine search over a growable normalized matrix."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._buffer = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._buffer[:self._size]
+
+    def add(self, vectors: np.ndarray) -> np.ndarray:
+        """Append rows; returns the positions they were stored at."""
+        vectors = _normalize(np.atleast_2d(vectors))
+        needed = self._size + len(vectors)
+        if needed > len(self._buffer):
+            # Grow geometrically so incremental inserts stay amortized O(1).
+            grown = np.zeros((max(needed, 2 * len(self._buffer), 16), self.dim), dtype=np.float32)
+            grown[:self._size] = self.vectors
+            self._buffer = grown
+        self._buffer[self._size:needed] = vectors
+        positions = np.arange(self._size, needed)
+        self._size = needed
+        return positions
+
+    def search(self, query: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        if self._size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        sims = self.vectors @ _normalize(query)
+        positions = np.flatnonzero(sims >= threshold)
+        return positions, sims[positions]
+
+
+class IVFIndex:
+    """
+    Inverted-file index with spherical k-means partitioning.
+
+    New rows are assigned to their nearest existing centroid on insert; the
+    partitioning is retrained from scratch whenever the index has doubled in
+    size since the last training, which keeps the lists balanced as a user's
+    history grows without retraining on every vent.
+    """
+
+    def __init__(self, dim: int, nprobe: int = 8, min_train_size: int = 2048,
+                 kmeans_iters: int = 10, seed: int = 0):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iters = kmeans_iters
+        self._rng = np.random.default_rng(seed)
+        self._exact = ExactIndex(dim)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._exact.vectors
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def add(self, vectors: np.ndarray) -> np.ndarray:
+        positions = self._exact.add(vectors)
+        if len(self) >= max(self.min_train_size, 2 * self._trained_size):
+            self.train()
+        elif self.is_trained:
+            assignments = np.argmax(self.vectors[positions] @ self._centroids.T, axis=1)
+            for position, cluster in zip(positions.tolist(), assignments.tolist()):
+                self._lists[cluster].append(position)
+        return positions
+
+    def train(self) -> None:
+        data = self.vectors
+        n = len(data)
+        if n == 0:
+            return
+        nlist = max(1, int(math.sqrt(n)))
+        # k-means on a bounded sample; assigning the full set afterwards is one matmul.
+        sample_size = min(n, 64 * nlist)
+        sample = data[self._rng.choice(n, size=sample_size, replace=False)]
+        centroids = sample[self._rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iters):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Reseed empty clusters on random sample points.
+                sums[empty] = sample[self._rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assignments = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self._lists = [order[bounds[k]:bounds[k + 1]].tolist() for k in range(nlist)]
+        self._centroids = centroids
+        self._trained_size = n
+
+    def search(self, query: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.is_trained:
+            return self._exact.search(query, threshold)
+
+        query = _normalize(query)
+        centroid_sims = self._centroids @ query
+        nprobe = min(self.nprobe, len(self._centroids))
+        probe = np.argpartition(-centroid_sims, nprobe - 1)[:nprobe]
+        candidates = np.fromiter(
+            (p for k in probe for p in self._lists[k]), dtype=np.int64
+        )
+        if len(candidates) == 0:
+            return candidates, np.zeros(0, dtype=np.float32)
+
+        sims = self.vectors[candidates] @ query
+        keep = sims >= threshold
+        positions, scores = candidates[keep], sims[keep]
+        # Report hits in insertion order, like the exact scan.
+        order = np.argsort(positions)
+        return positions[order], scores[order]
+
+
+INDEX_TYPES = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+}
+
+
+def make_index(kind: str, dim: int, **options):
+    """Build an index by name; unknown names fall back to the exact index."""
+    index_cls = INDEX_TYPES.get(kind, ExactIndex)
+    if index_cls is ExactIndex:
+        return ExactIndex(dim)
+    return index_cls(dim, **options)
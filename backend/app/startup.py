@@ -0,0 +1,99 @@
+# startup.py
+"""
+Application lifespan: warm everything up before serving, tear it down after.
+
+Importing app.main is cheap. The MongoClient connects lazily, and spaCy and
+TextBlob are only imported here or by the first request that needs them.
+On startup the lifespan runs the slow steps concurrently in worker threads:
+  models - load the spaCy pipeline, build the context/sentiment engines and
+           start the NLP worker pool
+  mongo  - ping the database and create the indexes the queries rely on
+It then starts the write-behind queue and the follow-up scheduler. Each step's
+duration is logged and reported by /readyz.
+
+A failed step doesn't stop the process. /healthz keeps answering, but
+/readyz reports not ready until the models are loaded and MongoDB answers.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from app.config import READINESS_DB_TIMEOUT
+
+# Filled in by the lifespan, read by /readyz.
+state = {
+    "models_loaded": False,
+    "started": False,
+    "steps": {},   # step -> milliseconds
+    "errors": {},  # step -> message
+}
+
+
+def warm_models() -> None:
+    from app.services import nlp_models, nlp_executor
+    import app.services.gemini_service  # noqa: F401  (what the chat routes import)
+
+    nlp_executor.load_models()
+    # The first call through a pipeline allocates its buffers; pay that here.
+    nlp_models.process("Warming up the pipeline.", "context")
+    # Start the NLP worker processes (if NLP_POOL_SIZE > 0) and wait for their models.
+    nlp_executor.start()
+    state["models_loaded"] = True
+
+
+def connect_db() -> None:
+    from app.utils import db
+
+    db.ping()
+    db.ensure_indexes()
+
+
+async def run_step(name: str, fn) -> None:
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(fn)
+    except Exception as e:
+        state["errors"][name] = str(e) or type(e).__name__
+        print(f"Startup step {name} failed:", e)
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        state["steps"][name] = round(elapsed, 1)
+        print(f"Startup step {name} took {elapsed:.0f}ms")
+
+
+async def database_reachable() -> bool:
+    from app.utils import db
+
+    try:
+        await asyncio.wait_for(asyncio.to_thread(db.ping), READINESS_DB_TIMEOUT)
+        return True
+    except Exception:
+        return False
+
+
+@asynccontextmanager
+async def lifespan(app):
+    from app.services.gemini_client import close_client
+    from app.services import nlp_executor
+    from app.services.scheduler import start_scheduler, stop_scheduler
+    from app.services.gemini_service import record_stored
+    from app.utils.db import start_write_behind, stop_write_behind
+
+    start = time.perf_counter()
+    await asyncio.gather(run_step("models", warm_models), run_step("mongo", connect_db))
+    # Queue conversation saves off the request path (only if WRITE_BEHIND_ENABLED);
+    # the thread, topic and rollup writes follow each batch once it is stored
+    start_write_behind(on_written=record_stored)
+    # Start the scheduler for follow-ups
+    start_scheduler()
+    state["started"] = True
+    print(f"Startup finished in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    yield
+
+    stop_scheduler()
+    nlp_executor.shutdown()
+    # Release the pooled Gemini connections
+    await close_client()
+    # Flush any conversation saves still queued
+    stop_write_behind()
@@ -1,13 +1,433 @@
-from pymongo import MongoClient
-from app.config import MONGODB_URI
-
-client = None
-db = None
-
-def init_db():
-    global client, db
-    client = MongoClient(MONGODB_URI)
-    db = client.get_database("reflectin_db")
-    # Ensure the collections exist
-    if "sessions" not in db.list_collection_names():
-        db.create_collection("sessions")
+# db.py
+"""
+Data access for the conversations, threads, topic_stats, rollups, leases and
+checkpoints collections (and conversations_dead_letter).
+
+Services go through these functions instead of touching the collections, so
+every query has a matching index (created by ensure_indexes() at startup), a
+projection that only ships the fields the caller reads, and a cursor batch size
+instead of materializing whole result sets.
+
+With WRITE_BEHIND_ENABLED, conversation inserts are queued and written in
+batches by app.utils.write_behind; the conversation reads here merge in the
+still-pending documents so callers keep read-your-writes consistency.
+Conversations the queue gives up on go to conversations_dead_letter.
+"""
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.config import (
+    conversations,
+    conversations_dead_letter,
+    threads,
+    topic_stats,
+    rollups,
+    leases,
+    checkpoints,
+    MONGO_CURSOR_BATCH_SIZE,
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_MAX_QUEUE,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_PUT_TIMEOUT,
+    WRITE_BEHIND_RETRY_INTERVAL,
+    WRITE_BEHIND_MAX_RETRIES,
+)
+from app.utils.write_behind import DUPLICATE_KEY, WriteBehindQueue
+from app.services.metrics import register_collector
+
+# Projections for the read paths.
+VECTOR_FIELDS = {"summary": 1, "user_message": 1, "bot_reply": 1, "thread_id": 1, "embedding": 1}
+SUMMARY_FIELDS = {"summary": 1, "bot_reply": 1, "timestamp": 1}
+THREAD_DUE_FIELDS = {"next_notify_at": 1, "last_activity": 1, "notifications_sent": 1}
+THREAD_SUMMARY_FIELDS = {"turns": 1, "rolling_summary": 1, "summary_turns": 1, "summary_until": 1}
+THREAD_CHECKUP_FIELDS = {"last_activity": 1}
+# History views: "list" for light list screens, "full" for detail and export (never the embedding).
+CONVERSATION_LIST_FIELDS = {"thread_id": 1, "topic": 1, "summary": 1, "sentiment": 1, "timestamp": 1}
+CONVERSATION_FULL_FIELDS = {"user_id": 1, "thread_id": 1, "topic": 1, "user_message": 1, "summary": 1,
+                            "bot_reply": 1, "sentiment": 1, "context": 1, "timestamp": 1}
+
+
+def ping() -> None:
+    """Round-trip to the server; raises if it can't be reached."""
+    conversations.database.command("ping")
+
+def ensure_indexes() -> None:
+    """Create the indexes every query below relies on. Idempotent."""
+    # _id breaks timestamp ties, so keyset pages on (timestamp, _id) are served by these too.
+    conversations.create_index([("user_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)])
+    conversations.create_index([("thread_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    threads.create_index([("next_notify_at", ASCENDING)], sparse=True)
+    threads.create_index([("checkup_due_at", ASCENDING)], sparse=True)
+    rollups.create_index([("user_id", ASCENDING), ("kind", ASCENDING), ("granularity", ASCENDING), ("bucket_start", DESCENDING)])
+    rollups.create_index([("user_id", ASCENDING), ("kind", ASCENDING), ("last_at", DESCENDING)])
+    leases.create_index("expires_at", expireAfterSeconds=0)
+
+
+# --- write-behind ------------------------------------------------------------
+
+_write_behind: Optional[WriteBehindQueue] = None
+
+def start_write_behind(on_written: Optional[Callable[[List[dict]], None]] = None) -> None:
+    """
+    Start queuing conversation inserts, if WRITE_BEHIND_ENABLED is set.
+    `on_written` is called (from the writing thread) with each batch once it is stored.
+    """
+    global _write_behind
+    if WRITE_BEHIND_ENABLED and _write_behind is None:
+        _write_behind = WriteBehindQueue(
+            lambda batch: conversations.insert_many(batch, ordered=False),
+            max_queue=WRITE_BEHIND_MAX_QUEUE,
+            batch_size=WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+            put_timeout=WRITE_BEHIND_PUT_TIMEOUT,
+            retry_interval=WRITE_BEHIND_RETRY_INTERVAL,
+            max_retries=WRITE_BEHIND_MAX_RETRIES,
+            dead_letter=_dead_letter,
+            on_written=on_written,
+        )
+        _write_behind.start()
+
+def stop_write_behind() -> None:
+    """Flush pending inserts and go back to writing synchronously."""
+    global _write_behind
+    if _write_behind is not None:
+        _write_behind.stop()
+        _write_behind = None
+
+def _dead_letter(entries: List[dict], error: Exception) -> None:
+    failed_at = datetime.utcnow()
+    documents = [dict(entry, dead_letter_error=str(error), dead_lettered_at=failed_at) for entry in entries]
+    try:
+        conversations_dead_letter.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Already dead-lettered (e.g. before a restart): fine.
+        if any(write_error.get("code") != DUPLICATE_KEY for write_error in e.details.get("writeErrors", [])):
+            raise
+
+def _write_behind_metrics():
+    queue = _write_behind
+    stats = queue.stats if queue is not None else {"written": 0, "failed_flushes": 0, "dead_lettered": 0, "lost": 0}
+    return [
+        ("reflectin_write_behind_queue_depth", "gauge", "Conversation inserts waiting to be flushed.",
+         len(queue) if queue is not None else 0),
+        ("reflectin_write_behind_failed", "gauge", "Conversation inserts waiting to be retried after a failed flush.",
+         queue.failed() if queue is not None else 0),
+        ("reflectin_write_behind_written_total", "counter", "Conversation inserts written by the write-behind queue.",
+         stats["written"]),
+        ("reflectin_write_behind_failed_flushes_total", "counter", "Write-behind batches that failed every attempt.",
+         stats["failed_flushes"]),
+        ("reflectin_write_behind_dead_lettered_total", "counter",
+         "Conversation inserts moved to conversations_dead_letter after failing every retry.",
+         stats["dead_lettered"]),
+        ("reflectin_write_behind_lost_total", "counter", "Conversation inserts that could be neither written nor dead-lettered.",
+         stats["lost"]),
+    ]
+
+register_collector(_write_behind_metrics)
+
+def _pending(predicate) -> List[dict]:
+    return _write_behind.pending(predicate) if _write_behind is not None else []
+
+def _project(entry: dict, projection: dict) -> dict:
+    projected = {key: entry[key] for key in projection if key in entry}
+    projected["_id"] = entry["_id"]
+    return projected
+
+
+# --- conversations -----------------------------------------------------------
+
+def insert_conversation(entry: dict) -> bool:
+    """Insert (or queue) one conversation; True if it was queued for write-behind."""
+    if _write_behind is not None:
+        # Assign the _id now so the entry is addressable before it is written.
+        entry.setdefault("_id", ObjectId())
+        _write_behind.put(entry)
+        return True
+    conversations.insert_one(entry)
+    return False
+
+def insert_conversations(entries: List[dict]) -> bool:
+    """
+    Insert (or queue) conversations; True if they were queued for write-behind,
+    in which case start_write_behind's on_written sees them once stored.
+    """
+    if _write_behind is not None:
+        for entry in entries:
+            insert_conversation(entry)
+        return True
+    conversations.insert_many(entries, ordered=False)
+    return False
+
+def iter_user_conversations(user_id: str, projection: dict = VECTOR_FIELDS,
+                            batch_size: int = MONGO_CURSOR_BATCH_SIZE) -> Iterator[dict]:
+    """A user's conversations, oldest first, streamed from a cursor (pending writes last)."""
+    # Snapshot pending entries first: one may be flushed while we read the cursor,
+    # in which case it is yielded from the cursor and skipped here.
+    pending = {entry["_id"]: entry for entry in _pending(lambda entry: entry["user_id"] == user_id)}
+    cursor = (
+        conversations.find({"user_id": user_id}, projection)
+        .sort([("timestamp", ASCENDING), ("_id", ASCENDING)])
+        .batch_size(batch_size)
+    )
+    for doc in cursor:
+        pending.pop(doc["_id"], None)
+        yield doc
+    for entry in pending.values():
+        yield _project(entry, projection)
+
+def conversation_page(field: str, value: str, projection: dict, limit: int, before=None) -> List[dict]:
+    """
+    Up to `limit` conversations with `field` == value (user_id or thread_id),
+    newest first by (timestamp, _id), strictly older than the `before`
+    (timestamp, _id) key when given.
+    """
+    query = {field: value}
+    if before is not None:
+        timestamp, _id = before
+        query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": _id}}]
+    written = list(
+        conversations.find(query, projection)
+        .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit)
+    )
+    pending = _pending(lambda entry: entry.get(field) == value
+                       and (before is None or (entry["timestamp"], entry["_id"]) < before))
+    if not pending:
+        return written
+    seen = {doc["_id"] for doc in written}
+    merged = written + [_project(entry, projection) for entry in pending if entry["_id"] not in seen]
+    merged.sort(key=lambda doc: (doc["timestamp"], doc["_id"]), reverse=True)
+    return merged[:limit]
+
+def count_user_conversations(user_id: str) -> int:
+    written = conversations.count_documents({"user_id": user_id})
+    return written + len(_pending(lambda entry: entry["user_id"] == user_id))
+
+def latest_thread_conversation(thread_id: str, projection: dict = SUMMARY_FIELDS) -> Optional[dict]:
+    """The most recent conversation on a thread."""
+    pending = _pending(lambda entry: entry["thread_id"] == thread_id)
+    if pending:
+        return _project(max(pending, key=lambda entry: entry["timestamp"]), projection)
+    return conversations.find_one({"thread_id": thread_id}, projection, sort=[("timestamp", DESCENDING)])
+
+def thread_conversations_since(thread_id: str, since=None, projection: dict = SUMMARY_FIELDS) -> List[dict]:
+    """A thread's conversations newer than `since` (all of them when None), oldest first."""
+    query = {"thread_id": thread_id}
+    if since is not None:
+        query["timestamp"] = {"$gt": since}
+    written = list(conversations.find(query, projection).sort("timestamp", ASCENDING))
+    seen = {doc["_id"] for doc in written}
+    pending = [
+        _project(entry, projection)
+        for entry in _pending(lambda entry: entry["thread_id"] == thread_id
+                              and (since is None or entry["timestamp"] > since))
+        if entry["_id"] not in seen
+    ]
+    return written + sorted(pending, key=lambda entry: entry["timestamp"])
+
+def latest_thread_summaries(thread_ids: List[str]) -> dict:
+    """{thread_id: summary of its most recent conversation} for the given threads."""
+    latest = {
+        doc["_id"]: doc.get("summary")
+        for doc in conversations.aggregate([
+            {"$match": {"thread_id": {"$in": thread_ids}}},
+            {"$sort": {"thread_id": ASCENDING, "timestamp": DESCENDING}},
+            {"$group": {"_id": "$thread_id", "summary": {"$first": "$summary"}}},
+        ])
+    }
+    wanted = set(thread_ids)
+    newest = {}
+    for entry in _pending(lambda entry: entry["thread_id"] in wanted):
+        if entry["thread_id"] not in newest or entry["timestamp"] > newest[entry["thread_id"]]["timestamp"]:
+            newest[entry["thread_id"]] = entry
+    latest.update((thread_id, entry.get("summary")) for thread_id, entry in newest.items())
+    return latest
+
+def set_embeddings(pairs: Iterable[Tuple[object, list]]) -> None:
+    """Store embeddings for existing conversations, given (_id, vector) pairs."""
+    operations = [UpdateOne({"_id": _id}, {"$set": {"embedding": vector}}) for _id, vector in pairs]
+    if operations:
+        conversations.bulk_write(operations, ordered=False)
+
+
+# --- threads -----------------------------------------------------------------
+
+def update_thread(thread_id: str, update: dict, upsert: bool = False) -> None:
+    threads.update_one({"_id": thread_id}, update, upsert=upsert)
+
+def bulk_update_threads(operations: List[UpdateOne]) -> None:
+    if operations:
+        threads.bulk_write(operations, ordered=False)
+
+def get_thread(thread_id: str, projection: dict = THREAD_SUMMARY_FIELDS) -> Optional[dict]:
+    return threads.find_one({"_id": thread_id}, projection)
+
+def rolling_summaries(thread_ids: List[str]) -> dict:
+    """{thread_id: rolling_summary} for the threads that have one."""
+    cursor = threads.find({"_id": {"$in": thread_ids}, "rolling_summary": {"$exists": True}}, {"rolling_summary": 1})
+    return {doc["_id"]: doc["rolling_summary"] for doc in cursor}
+
+def set_thread_summary(thread_id: str, previous_until, update: dict) -> bool:
+    """
+    Store a new rolling summary unless another worker already replaced the one
+    it was built from (matched on summary_until). Returns whether it was stored.
+    """
+    result = threads.update_one({"_id": thread_id, "summary_until": previous_until}, {"$set": update})
+    return result.modified_count == 1
+
+def thread_centroids(user_id: str, thread_ids: List[str]) -> dict:
+    """{thread_id: (centroid, centroid_count)} for the user's threads that have a stored centroid."""
+    cursor = threads.find(
+        {"_id": {"$in": thread_ids}, "user_id": user_id, "centroid_count": {"$exists": True}},
+        {"centroid": 1, "centroid_count": 1},
+    ).batch_size(MONGO_CURSOR_BATCH_SIZE)
+    return {doc["_id"]: (doc.get("centroid"), doc["centroid_count"]) for doc in cursor}
+
+def get_checkup_message(thread_id: str) -> Optional[str]:
+    """The pre-generated check-up message stored on the thread, if there is a current one."""
+    doc = threads.find_one({"_id": thread_id}, {"checkup_message": 1})
+    return doc.get("checkup_message") if doc else None
+
+def checkups_due(now, limit: int) -> List[dict]:
+    """Up to `limit` threads whose check-up message should be generated, earliest first."""
+    return list(
+        threads.find({"checkup_due_at": {"$lte": now}}, THREAD_CHECKUP_FIELDS)
+        .sort("checkup_due_at", ASCENDING)
+        .limit(limit)
+    )
+
+def due_threads(now, limit: int) -> List[dict]:
+    """Up to `limit` threads whose follow-up is due, earliest first (served by the next_notify_at index)."""
+    return list(
+        threads.find({"next_notify_at": {"$lte": now}}, THREAD_DUE_FIELDS)
+        .sort("next_notify_at", ASCENDING)
+        .limit(limit)
+    )
+
+
+# --- topic statistics ----------------------------------------------------------
+# One document per user: {_id: user_id, docs: N, df: {term: documents containing it}}
+
+def get_topic_frequencies(user_id: str, terms: Iterable[str]) -> Tuple[int, dict]:
+    """The user's document count and the document frequency of each of `terms`."""
+    projection = {"docs": 1, **{f"df.{term}": 1 for term in terms}}
+    doc = topic_stats.find_one({"_id": user_id}, projection) or {}
+    return doc.get("docs", 0), doc.get("df", {})
+
+def increment_topic_frequencies(user_id: str, term_sets: List[set]) -> None:
+    """Add documents (each given as its set of terms) to the user's frequencies."""
+    if not term_sets:
+        return
+    increments = {"docs": len(term_sets)}
+    for terms in term_sets:
+        for term in terms:
+            key = f"df.{term}"
+            increments[key] = increments.get(key, 0) + 1
+    topic_stats.update_one({"_id": user_id}, {"$inc": increments}, upsert=True)
+
+def shift_topic_frequencies(user_id: str, changes: List[Tuple[set, set]]) -> None:
+    """Re-count documents whose terms changed from the first set to the second (the document count stays)."""
+    increments = {}
+    for old, new in changes:
+        for term in old - new:
+            increments[f"df.{term}"] = increments.get(f"df.{term}", 0) - 1
+        for term in new - old:
+            increments[f"df.{term}"] = increments.get(f"df.{term}", 0) + 1
+    increments = {key: count for key, count in increments.items() if count}
+    if increments:
+        topic_stats.update_one({"_id": user_id}, {"$inc": increments}, upsert=True)
+
+
+# --- rollups -------------------------------------------------------------------
+# See app.services.rollups for the document shapes.
+
+def bulk_update_rollups(operations: List[UpdateOne]) -> None:
+    # Ordered, so a batch's trajectory $pushes to one thread apply in save order.
+    if operations:
+        rollups.bulk_write(operations, ordered=True)
+
+def sentiment_rollups(user_id: str, granularity: str, limit: int) -> List[dict]:
+    """The user's `limit` most recent sentiment buckets, newest first."""
+    return list(
+        rollups.find({"user_id": user_id, "kind": "sentiment", "granularity": granularity})
+        .sort("bucket_start", DESCENDING)
+        .limit(limit)
+    )
+
+def topic_rollup(user_id: str) -> Optional[dict]:
+    return rollups.find_one({"_id": f"topics:{user_id}"})
+
+def thread_rollups(user_id: str, limit: int) -> List[dict]:
+    """The user's `limit` most recently active thread trajectories."""
+    return list(
+        rollups.find({"user_id": user_id, "kind": "thread"})
+        .sort("last_at", DESCENDING)
+        .limit(limit)
+    )
+
+def delete_rollups(user_id: Optional[str] = None) -> None:
+    rollups.delete_many({"user_id": user_id} if user_id is not None else {})
+
+def bulk_update_conversations(operations: List[UpdateOne]) -> None:
+    if operations:
+        conversations.bulk_write(operations, ordered=False)
+
+def iter_conversations_by_id(query: dict, projection: dict, after=None,
+                             batch_size: int = MONGO_CURSOR_BATCH_SIZE) -> Iterator[dict]:
+    """Conversations matching `query` in _id order, optionally resuming after an _id."""
+    if after is not None:
+        query = {**query, "_id": {"$gt": after}}
+    return iter(
+        conversations.find(query, projection)
+        .sort("_id", ASCENDING)
+        .batch_size(batch_size)
+    )
+
+
+# --- leases --------------------------------------------------------------------
+# {_id: lease name, holder, expires_at}; see app.services.leader_lease.
+
+def acquire_lease(name: str, holder: str, ttl_seconds: float) -> bool:
+    """Take or renew a lease for `holder` if it is free, expired or already theirs."""
+    # Expiry is computed and checked against the server's clock ($$NOW), so
+    # workers whose clocks disagree still agree on when a lease has expired.
+    # An upsert filter can't use $expr, so the check is made in the pipeline.
+    takeable = {"$or": [{"$eq": ["$holder", {"$literal": holder}]}, {"$lte": ["$expires_at", "$$NOW"]}]}
+    take = lambda value, current: {"$cond": [takeable, value, current]}
+    try:
+        doc = leases.find_one_and_update(
+            {"_id": name},
+            [{"$set": {
+                "holder": take({"$literal": holder}, "$holder"),
+                "expires_at": take({"$add": ["$$NOW", int(ttl_seconds * 1000)]}, "$expires_at"),
+                "renewed_at": take("$$NOW", "$renewed_at"),
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Two workers upserted a missing lease at once; the other one got it.
+        return False
+    return doc is not None and doc.get("holder") == holder
+
+def release_lease(name: str, holder: str) -> None:
+    leases.delete_one({"_id": name, "holder": holder})
+
+
+# --- checkpoints -----------------------------------------------------------------
+# {_id: job name, last_id, processed, updated, options, updated_at}
+
+def get_checkpoint(name: str) -> Optional[dict]:
+    return checkpoints.find_one({"_id": name})
+
+def save_checkpoint(name: str, state: dict) -> None:
+    checkpoints.update_one({"_id": name}, {"$set": {**state, "updated_at": datetime.utcnow()}}, upsert=True)
+
+def clear_checkpoint(name: str) -> None:
+    checkpoints.delete_one({"_id": name})
@@ -0,0 +1,251 @@
+# write_behind.py
+"""
+Write-behind queue for conversation inserts.
+
+put() registers the document as pending and hands it to a bounded in-process
+queue; a background thread flushes the queue with insert_many whenever it has
+`batch_size` documents or `flush_interval` seconds have passed since the first
+queued one. Pending documents stay visible through pending() until their batch
+is written, so reads can merge them in for read-your-writes consistency.
+
+When the queue is full, put() blocks up to `put_timeout` seconds and then
+writes the document synchronously, so a stalled database slows callers down
+instead of growing memory or dropping data.
+
+Inserts are unordered, so when some documents of a batch are rejected the
+rest are written and only the rejected ones fail. A document that still
+fails after `max_attempts` is not dropped: it stays pending (and visible to
+reads) and is written again every `retry_interval` seconds, up to
+`max_retries` times. After that it is handed to `dead_letter` (the caller
+stores it elsewhere for inspection) and leaves the queue, so one bad document
+can't hold the rest back. While `max_queue` documents are waiting for a
+retry, put() writes inline instead, and an inline write that fails raises to
+the caller, so nobody is told a conversation was saved when it wasn't.
+stop() drains and flushes; whatever still can't be written then is
+dead-lettered too. Documents that can't even be dead-lettered are logged and
+counted in stats["lost"].
+
+`on_written` is called with every batch once it is stored, from whichever
+thread wrote it, so writes derived from the documents happen only for
+documents that exist (and stay off the caller's path).
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, insert_many: Callable[[List[dict]], None], max_queue: int = 10000,
+                 batch_size: int = 200, flush_interval: float = 0.5, put_timeout: float = 2.0,
+                 max_attempts: int = 3, retry_interval: float = 5.0, max_retries: int = 12,
+                 dead_letter: Optional[Callable[[List[dict], Exception], None]] = None,
+                 on_written: Optional[Callable[[List[dict]], None]] = None):
+        self._insert_many = insert_many
+        self._dead_letter = dead_letter
+        self._on_written = on_written
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self._pending: "OrderedDict[object, dict]" = OrderedDict()
+        # _id -> failed flushes, for documents that failed every attempt; still pending, written again later.
+        self._failed: "OrderedDict[object, int]" = OrderedDict()
+        self._failed_at = 0.0
+        self.stats = {"written": 0, "failed_flushes": 0, "dead_lettered": 0, "lost": 0}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def failed(self) -> int:
+        """Documents waiting to be written again after a failed flush."""
+        with self._lock:
+            return len(self._failed)
+
+    def put(self, entry: dict) -> None:
+        """Queue a document; it must already carry its _id."""
+        with self._lock:
+            self._pending[entry["_id"]] = entry
+            backlog = len(self._failed)
+        if backlog >= self._queue.maxsize > 0:
+            self._write_inline(entry)
+            return
+        try:
+            self._queue.put(entry, timeout=self.put_timeout)
+        except queue.Full:
+            # Backpressure: the caller pays for the write itself.
+            self._write_inline(entry)
+
+    def _write_inline(self, entry: dict) -> None:
+        failed, error = self._write([entry])
+        with self._lock:
+            self._pending.pop(entry["_id"], None)
+            if not failed:
+                self.stats["written"] += 1
+        if failed:
+            raise error
+        self._written([entry])
+
+    def pending(self, predicate: Callable[[dict], bool]) -> List[dict]:
+        """Snapshot of queued-but-unwritten documents matching predicate, oldest first."""
+        with self._lock:
+            return [entry for entry in self._pending.values() if predicate(entry)]
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the worker and flush everything still queued."""
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        with self._lock:
+            remaining = [self._pending[_id] for _id in self._failed if _id in self._pending]
+            self._failed.clear()
+        remaining += self._drain(self._queue.qsize())
+        if not remaining:
+            return
+        failed, error = self._write(remaining)
+        written = self._settle(remaining, failed)
+        self._written(written)
+        if failed:
+            logger.error("Write-behind: %d conversations could not be written before shutdown: %s",
+                         len(failed), error)
+            self._bury(failed, error)
+
+    def _drain(self, limit: int) -> List[dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _collect(self) -> List[dict]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+            self._retry_failed()
+
+    def _retry_failed(self) -> None:
+        with self._lock:
+            if not self._failed or time.monotonic() - self._failed_at < self.retry_interval:
+                return
+            failed = [self._pending[_id] for _id in self._failed if _id in self._pending]
+        for start in range(0, len(failed), self.batch_size):
+            self._flush(failed[start:start + self.batch_size])
+
+    def _write(self, batch: List[dict]) -> Tuple[List[dict], Optional[Exception]]:
+        """insert_many with retries; returns the documents still not written and the last error."""
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._insert_many(batch)
+                return [], None
+            except BulkWriteError as e:
+                # Unordered: only the documents with a write error failed. A retried
+                # batch may have been partly written already; duplicates are fine.
+                rejected = {write_error["index"] for write_error in e.details.get("writeErrors", [])
+                            if write_error.get("code") != DUPLICATE_KEY}
+                batch = [entry for i, entry in enumerate(batch) if i in rejected]
+                if not batch:
+                    return [], None
+                error = e
+            except Exception as e:
+                error = e
+            if attempt < self.max_attempts:
+                time.sleep(0.1 * 2 ** attempt)
+        return batch, error
+
+    def _settle(self, batch: List[dict], failed: List[dict]) -> List[dict]:
+        """Stop tracking the written part of a batch; returns it."""
+        failed_ids = {entry["_id"] for entry in failed}
+        written = [entry for entry in batch if entry["_id"] not in failed_ids]
+        with self._lock:
+            for entry in written:
+                self._pending.pop(entry["_id"], None)
+                self._failed.pop(entry["_id"], None)
+            self.stats["written"] += len(written)
+        return written
+
+    def _flush(self, batch: List[dict]) -> None:
+        failed, error = self._write(batch)
+        written = self._settle(batch, failed)
+        self._written(written)
+        if not failed:
+            return
+        dead = []
+        with self._lock:
+            for entry in failed:
+                flushes = self._failed.pop(entry["_id"], 0) + 1
+                if flushes > self.max_retries:
+                    dead.append(entry)
+                else:
+                    self._failed[entry["_id"]] = flushes
+            self._failed_at = time.monotonic()
+            self.stats["failed_flushes"] += 1
+        retrying = len(failed) - len(dead)
+        if retrying:
+            logger.error("Write-behind: %d conversations not written after %d attempts, retrying in %.0fs: %s",
+                         retrying, self.max_attempts, self.retry_interval, error)
+        if dead:
+            logger.error("Write-behind: giving up on %d conversations after %d retries: %s",
+                         len(dead), self.max_retries, error)
+            self._bury(dead, error)
+
+    def _bury(self, entries: List[dict], error: Exception) -> None:
+        """Hand documents that can't be written to the dead-letter store and forget them."""
+        stored = False
+        if self._dead_letter is not None:
+            try:
+                self._dead_letter(entries, error)
+                stored = True
+            except Exception as e:
+                logger.error("Write-behind: dead-lettering %d conversations failed: %s", len(entries), e)
+        if not stored:
+            for entry in entries:
+                logger.error("Write-behind: lost conversation %r", entry)
+        with self._lock:
+            for entry in entries:
+                self._pending.pop(entry["_id"], None)
+            self.stats["dead_lettered" if stored else "lost"] += len(entries)
+
+    def _written(self, entries: List[dict]) -> None:
+        if not entries or self._on_written is None:
+            return
+        try:
+            self._on_written(entries)
+        except Exception:
+            logger.exception("Write-behind: follow-up writes for %d stored conversations failed", len(entries))
@@ -0,0 +1,243 @@
+# bench_chat.py
+"""
+Offline benchmark for the /chat hot path.
+
+Runs against an in-memory MongoDB stand-in (benchmarks.memory_mongo) and a
+local stub Gemini server (benchmarks.stub_gemini), with a synthetic history
+of each requested size for the benchmark user. Reports latency percentiles
+and allocation peaks for analyze_sentiment, analyze_context,
+query_similar_entries_with_thread (cold and warm), save_conversation and
+process_vent end to end, and saves everything as JSON so runs from different
+commits can be compared.
+
+    cd backend
+    python -m benchmarks.bench_chat --sizes 100 10000 100000
+    python -m benchmarks.bench_chat --compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import corpus, stub_gemini
+
+# process_vent still uses a fixed user id; history is seeded for the same one.
+BENCH_USER = "shivani"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "n": int(len(samples)),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+
+def measure(fn, inputs):
+    """Time fn over inputs, then take the allocation peak of one extra call."""
+    samples = []
+    for value in inputs:
+        start = time.perf_counter()
+        fn(value)
+        samples.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn(inputs[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = percentiles(samples)
+    stats["peak_alloc_kb"] = peak / 1024
+    return stats
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def seed_history(size: int, seed: int) -> float:
+    """Insert `size` conversations for BENCH_USER; returns seconds taken."""
+    from app.config import conversations
+    from app.services.filtering import get_embeddings
+    from app.services.gemini_service import build_conversation
+
+    start = time.perf_counter()
+    vents = corpus.make_vents(size, seed=seed)
+    base = datetime.utcnow() - timedelta(minutes=size)
+    threads = max(1, size // 20)
+    chunk = 2000
+    for offset in range(0, size, chunk):
+        texts = vents[offset:offset + chunk]
+        summaries = [text.split(".")[0] + "." for text in texts]
+        embeddings = get_embeddings(summaries)
+        entries = []
+        for i, (text, summary, embedding) in enumerate(zip(texts, summaries, embeddings)):
+            entry = build_conversation(
+                BENCH_USER, f"thread-{(offset + i) % threads}", "general", text, summary,
+                stub_gemini.REPLY, {"polarity": 0.0, "sentiment_score": 5, "sentiment_label": "Neutral"},
+                {"entities": [], "topics": []}, embedding,
+            )
+            entry["timestamp"] = base + timedelta(minutes=offset + i)
+            entries.append(entry)
+        conversations.insert_many(entries)
+    return time.perf_counter() - start
+
+
+def run_size(size: int, args, loop) -> dict:
+    from app.config import conversations, threads
+    from app.services import filtering, gemini_service
+
+    conversations.delete_many({})
+    threads.delete_many({})
+    filtering.forget_user_memory()
+
+    result = {"seed_s": seed_history(size, args.seed)}
+    queries = corpus.make_vents(args.iterations, seed=args.seed + 1)
+
+    result["analyze_sentiment"] = measure(gemini_service.analyze_sentiment, queries)
+    result["analyze_context"] = measure(gemini_service.analyze_context, queries)
+
+    filtering.forget_user_memory()
+    start = time.perf_counter()
+    filtering.query_similar_entries_with_thread(BENCH_USER, queries[0])
+    result["query_similar_entries_with_thread_cold_ms"] = (time.perf_counter() - start) * 1000
+    result["query_similar_entries_with_thread"] = measure(
+        lambda text: filtering.query_similar_entries_with_thread(BENCH_USER, text), queries
+    )
+
+    result["save_conversation"] = measure(
+        lambda text: gemini_service.save_conversation(
+            BENCH_USER, "bench-thread", "general", text, text, stub_gemini.REPLY,
+            {"polarity": 0.0, "sentiment_score": 5, "sentiment_label": "Neutral"},
+            {"entities": [], "topics": []},
+        ),
+        queries,
+    )
+
+    result["process_vent"] = measure(
+        lambda text: loop.run_until_complete(gemini_service.process_vent(text)), queries
+    )
+    result["max_rss_mb"] = max_rss_mb()
+    return result
+
+
+def run(args) -> dict:
+    server = stub_gemini.start(latency=args.gemini_latency)
+    # Must be configured before app.config is imported.
+    os.environ["GEMINI_API_KEY"] = "bench"
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["GEMINI_CACHE_ENABLED"] = "0"
+    os.environ["WRITE_BEHIND_ENABLED"] = "0"
+
+    from benchmarks import memory_mongo
+    memory_mongo.install()
+    from app.utils import db
+    db.ensure_indexes()
+
+    loop = asyncio.new_event_loop()
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "sizes": {},
+    }
+    for size in args.sizes:
+        print(f"history size {size}...", flush=True)
+        report["sizes"][str(size)] = run_size(size, args, loop)
+        print_size(size, report["sizes"][str(size)])
+    # Let background work (thread summary refreshes) finish before closing the loop.
+    pending = asyncio.all_tasks(loop)
+    if pending:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.close()
+    server.shutdown()
+    return report
+
+
+def print_size(size: int, result: dict) -> None:
+    print(f"  seeded in {result['seed_s']:.1f}s, cold similarity lookup "
+          f"{result['query_similar_entries_with_thread_cold_ms']:.1f}ms, max RSS {result['max_rss_mb']:.0f}MB")
+    for name, stats in result.items():
+        if isinstance(stats, dict):
+            print(f"  {name:<36} p50={stats['p50_ms']:8.2f}ms p95={stats['p95_ms']:8.2f}ms "
+                  f"p99={stats['p99_ms']:8.2f}ms peak={stats['peak_alloc_kb']:9.1f}KiB")
+
+
+def compare(old_path: str, new_path: str, tolerance: float) -> int:
+    """Print p50/p95 changes between two reports; non-zero exit if anything regressed."""
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    print(f"{old['meta']['commit'][:10]} -> {new['meta']['commit'][:10]}")
+    regressions = 0
+    for size, new_result in new["sizes"].items():
+        old_result = old["sizes"].get(size)
+        if old_result is None:
+            continue
+        print(f"history size {size}")
+        for name, stats in new_result.items():
+            if not isinstance(stats, dict) or name not in old_result:
+                continue
+            line = f"  {name:<36}"
+            for key in ("p50_ms", "p95_ms"):
+                before, after = old_result[name][key], stats[key]
+                change = (after - before) / before if before else 0.0
+                flag = ""
+                if change > tolerance:
+                    flag = " !"
+                    regressions += 1
+                line += f" {key[:-3]} {before:8.2f} -> {after:8.2f}ms ({change:+6.1%}){flag}"
+            print(line)
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="stub Gemini delay in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=str(RESULTS_DIR), help="directory for the JSON report")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved reports")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative slowdown flagged by --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.tolerance))
+
+    report = run(args)
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"{report['meta']['commit'][:10]}-{datetime.utcnow():%Y%m%d%H%M%S}.json"
+    path.write_text(json.dumps(report, indent=2))
+    print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    main()
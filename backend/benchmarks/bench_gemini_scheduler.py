@@ -0,0 +1,129 @@
+# bench_gemini_scheduler.py
+"""
+Gemini traffic under a quota, with and without the request scheduler.
+
+A simulated upstream (an httpx mock transport, no network) accepts --quota
+requests per second over a sliding one-second window. Past that it answers
+429 with Retry-After: 1, and each accepted request takes --latency ms. Against it
+run a background burst (--background requests at once, like a /chat/batch
+import) while interactive requests arrive at --interactive-rate per second.
+Every prompt is unique, so nothing is merged or cached. Two client setups:
+
+  direct     no limits and no retries (the behaviour before the scheduler)
+  scheduled  GeminiScheduler sized to the quota
+
+For each, the benchmark reports successful requests per second, 429s seen
+upstream, failed calls, and the interactive latency. A last line shows
+identical concurrent calls being merged into one upstream request.
+
+    cd backend
+    python -m benchmarks.bench_gemini_scheduler --quota 20 --background 200
+"""
+import argparse
+import asyncio
+import collections
+import time
+
+import httpx
+import numpy as np
+
+from app.services.gemini_client import GeminiClient, build_payload
+from app.services.gemini_scheduler import GeminiScheduler, INTERACTIVE, BACKGROUND
+
+
+class Upstream:
+    """Sliding-window quota in front of a fixed-latency model."""
+
+    def __init__(self, quota: int, latency: float):
+        self.quota = quota
+        self.latency = latency
+        self.accepted = collections.deque()
+        self.calls = 0
+        self.throttled = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        now = time.monotonic()
+        while self.accepted and now - self.accepted[0] >= 1.0:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.quota:
+            self.throttled += 1
+            return httpx.Response(429, headers={"Retry-After": "1"}, json={"error": {"code": 429}})
+        self.accepted.append(now)
+        await asyncio.sleep(self.latency)
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+
+
+def make_client(upstream: Upstream, scheduler: GeminiScheduler) -> GeminiClient:
+    return GeminiClient(api_key="bench", base_url="http://upstream", max_connections=1000,
+                        scheduler=scheduler, transport=httpx.MockTransport(upstream.handle))
+
+
+async def run_mode(name: str, scheduler: GeminiScheduler, args) -> None:
+    upstream = Upstream(args.quota, args.latency / 1000)
+    client = make_client(upstream, scheduler)
+    interactive_ms = []
+    outcomes = collections.Counter()
+
+    async def call(text: str, priority: int, latencies=None):
+        start = time.perf_counter()
+        try:
+            await client.generate(build_payload(text, maxOutputTokens=100), cache=False, priority=priority)
+            outcomes["ok"] += 1
+        except httpx.HTTPError:
+            outcomes["failed"] += 1
+        if latencies is not None:
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    async def interactive():
+        tasks = []
+        for i in range(int(args.duration * args.interactive_rate)):
+            tasks.append(asyncio.ensure_future(call(f"interactive {i}", INTERACTIVE, interactive_ms)))
+            await asyncio.sleep(1 / args.interactive_rate)
+        await asyncio.gather(*tasks)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        interactive(),
+        *(call(f"background {i}", BACKGROUND) for i in range(args.background)),
+    )
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    print(f"  {name:<10} {outcomes['ok'] / elapsed:6.1f} ok/s  {upstream.throttled:5d} x 429  "
+          f"{outcomes['failed']:4d} failed  interactive p50={np.percentile(interactive_ms, 50):7.0f}ms "
+          f"p95={np.percentile(interactive_ms, 95):7.0f}ms  ({elapsed:.1f}s)")
+
+
+async def run_coalescing(args) -> None:
+    upstream = Upstream(10 ** 6, args.latency / 1000)
+    client = make_client(upstream, GeminiScheduler(rpm=0, tpm=0))
+    payload = build_payload("the same summary prompt", maxOutputTokens=100)
+    await asyncio.gather(*(client.generate(payload, cache=False) for _ in range(50)))
+    await client.aclose()
+    print(f"  coalescing: 50 identical concurrent calls -> {upstream.calls} upstream request(s)")
+
+
+async def main_async(args) -> None:
+    print(f"quota {args.quota}/s, {args.background} background requests, "
+          f"{args.interactive_rate}/s interactive for {args.duration}s, {args.latency}ms upstream latency")
+    await run_mode("direct", GeminiScheduler(rpm=0, tpm=0, max_retries=0), args)
+    # A token bucket can send its burst plus a window's refill inside one quota window,
+    # so size it a little under the quota with a small burst.
+    await run_mode("scheduled", GeminiScheduler(rpm=args.quota * 60 * 0.95, tpm=0, burst_seconds=0.05,
+                                                max_retries=args.retries), args)
+    await run_coalescing(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quota", type=int, default=20, help="upstream requests per second")
+    parser.add_argument("--background", type=int, default=200)
+    parser.add_argument("--interactive-rate", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=8.0, help="seconds of interactive arrivals")
+    parser.add_argument("--latency", type=float, default=50.0, help="upstream latency in ms")
+    parser.add_argument("--retries", type=int, default=3)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
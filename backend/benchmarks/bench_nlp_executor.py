@@ -0,0 +1,92 @@
+# bench_nlp_executor.py
+"""
+Throughput of the /chat NLP stage (nlp_executor.analyze) by worker pool size.
+
+For each pool size, a fresh process submits --requests vents as concurrent
+single-text calls (--concurrency at a time, like simultaneous /chat requests)
+so the micro-batcher groups them. It reports texts/s, the speedup over
+NLP_POOL_SIZE=0 (the event loop's thread pool), and the worst event-loop lag
+measured by a 5ms ticker while the requests ran. Lag shows how much the NLP
+work is blocking other requests on the same worker.
+
+Needs the spaCy model named by SPACY_MODEL.
+
+    cd backend
+    python -m benchmarks.bench_nlp_executor --pool-sizes 0 1 2 4 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import corpus
+
+
+async def measure(args) -> dict:
+    from app.services import nlp_executor
+
+    nlp_executor.start()
+    texts = corpus.make_vents(args.requests, seed=args.seed)
+    lag = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal lag
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag = max(lag, time.perf_counter() - start - 0.005)
+
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one(text):
+        async with limit:
+            return await nlp_executor.analyze(text)
+
+    await asyncio.gather(*(one(text) for text in texts[:args.concurrency]))  # warm up
+    tick = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(one(text) for text in texts))
+    elapsed = time.perf_counter() - start
+    running = False
+    await tick
+    nlp_executor.shutdown()
+    return {"texts_per_s": len(texts) / elapsed, "elapsed_s": elapsed, "max_loop_lag_ms": lag * 1000}
+
+
+def run_pool_size(size: int, args) -> dict:
+    env = dict(os.environ, NLP_POOL_SIZE=str(size))
+    command = [sys.executable, "-m", "benchmarks.bench_nlp_executor", "--single",
+               "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--seed", str(args.seed)]
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # One measurement with this process's NLP_POOL_SIZE; prints a JSON line.
+        print(json.dumps(asyncio.run(measure(args))))
+        return
+
+    print(f"{os.cpu_count()} CPUs, {args.requests} requests, {args.concurrency} concurrent")
+    baseline = None
+    for size in args.pool_sizes:
+        result = run_pool_size(size, args)
+        baseline = baseline or result["texts_per_s"]
+        print(f"  NLP_POOL_SIZE={size:<3} {result['texts_per_s']:9.0f} texts/s  "
+              f"{result['texts_per_s'] / baseline:5.2f}x  max loop lag {result['max_loop_lag_ms']:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
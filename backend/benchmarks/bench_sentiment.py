@@ -0,0 +1,96 @@
+# bench_sentiment.py
+"""
+Agreement and speed of the lexicon sentiment engine against TextBlob.
+
+Scores a synthetic vent corpus (plus hand-written negation, intensifier,
+exclamation and emoticon cases) with both, then reports how often
+sentiment_score and sentiment_label agree, the polarity difference, and
+throughput: TextBlob per message, the engine from raw text (tokenizing
+included) and the engine on already-parsed docs (what /chat does).
+
+Only spaCy's tokenizer is needed, so a blank English pipeline is used unless
+--model is given.
+
+    cd backend
+    python -m benchmarks.bench_sentiment --size 5000
+    python -m benchmarks.bench_sentiment --show 10
+"""
+import argparse
+import time
+
+import numpy as np
+import spacy
+from textblob import TextBlob
+
+from app.services.sentiment_engine import SentimentEngine, bucket_polarity, get_engine
+from benchmarks import corpus
+
+CASES = [
+    "I am not happy at all.",
+    "This is really good!",
+    "I'm very very sad :(",
+    "Not a good day, honestly.",
+    "It was really not good.",
+    "I love my sister <3",
+    "Never been this anxious before!!",
+    "I'm not angry, just disappointed.",
+    "Today was incredibly, wonderfully calm.",
+    "My well-being has been terrible lately :-(",
+    "I can't believe how great the feedback was!",
+    "Everything is fine. Totally fine.",
+    "",
+]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def run(args) -> None:
+    texts = corpus.make_vents(args.size, seed=args.seed) + CASES
+    nlp = spacy.load(args.model) if args.model else spacy.blank("en")
+    engine: SentimentEngine = get_engine()
+
+    baseline, textblob_s = timed(lambda: [TextBlob(text).sentiment.polarity for text in texts])
+    from_text, engine_text_s = timed(lambda: engine.polarities(nlp.pipe(texts, batch_size=args.batch_size)))
+    docs = list(nlp.pipe(texts, batch_size=args.batch_size))
+    from_docs, engine_docs_s = timed(engine.polarities, docs)
+    assert np.allclose(from_text, from_docs)
+
+    expected = [bucket_polarity(p) for p in baseline]
+    actual = [bucket_polarity(float(p)) for p in from_docs]
+    score_match = np.mean([e["sentiment_score"] == a["sentiment_score"] for e, a in zip(expected, actual)])
+    label_match = np.mean([e["sentiment_label"] == a["sentiment_label"] for e, a in zip(expected, actual)])
+    diff = np.abs(np.asarray(baseline) - from_docs)
+
+    n = len(texts)
+    print(f"{n} texts ({args.size} synthetic vents + {len(CASES)} hand-written cases)")
+    print(f"  sentiment_score agreement  {score_match:7.2%}")
+    print(f"  sentiment_label agreement  {label_match:7.2%}")
+    print(f"  |polarity diff|            mean={diff.mean():.4f} max={diff.max():.4f}")
+    print(f"  textblob                   {textblob_s * 1000:9.1f}ms  {n / textblob_s:10.0f} texts/s")
+    print(f"  engine (tokenize + score)  {engine_text_s * 1000:9.1f}ms  {n / engine_text_s:10.0f} texts/s"
+          f"  {textblob_s / engine_text_s:5.1f}x")
+    print(f"  engine (parsed docs)       {engine_docs_s * 1000:9.1f}ms  {n / engine_docs_s:10.0f} texts/s"
+          f"  {textblob_s / engine_docs_s:5.1f}x")
+
+    if args.show:
+        disagreements = [i for i in np.argsort(-diff) if diff[i] > 1e-9][:args.show]
+        for i in disagreements:
+            print(f"  textblob={baseline[i]:+.3f} engine={from_docs[i]:+.3f}  {texts[i]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--model", help="spaCy pipeline to tokenize with (default: blank English)")
+    parser.add_argument("--show", type=int, default=0, help="print the N largest disagreements")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
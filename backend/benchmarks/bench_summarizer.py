@@ -0,0 +1,133 @@
+# bench_summarizer.py
+"""
+Summary quality of the extractive summarizer against simple baselines.
+
+Every synthetic vent has a reference summary: its event and feeling
+sentences, without the filler context sentences (up to --max-context per
+vent). Each method's summaries are scored against the reference:
+
+  key recall  share of reference sentences the summary kept (extractive methods only)
+  rouge-1 F1  unigram overlap with the reference
+  cosine      similarity of the summary's embedding to the reference's; the
+              embedding is what thread resolution and memory search compare
+  words       summary length relative to the vent
+
+Methods: extractive (summarizer.extract, what SUMMARIZER=extractive stores),
+lead (the first --sentences sentences) and full (the whole vent, the upper
+bound on recall). --gemini N also summarizes the first N vents with the
+Gemini summarizer (GEMINI_API_KEY and GEMINI_BASE_URL from the environment;
+e.g. point it at benchmarks.stub_gemini to check the plumbing offline).
+
+The word vectors matter, so this loads a real model (SPACY_MODEL unless
+--model is given).
+
+    cd backend
+    python -m benchmarks.bench_summarizer --size 2000
+    python -m benchmarks.bench_summarizer --size 200 --gemini 50 --show 5
+"""
+import argparse
+import asyncio
+import re
+import time
+from collections import Counter
+
+import numpy as np
+import spacy
+
+from app.config import SPACY_MODEL
+from app.services import summarizer
+from app.services.gemini_client import get_client
+from benchmarks import corpus
+
+WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> list:
+    return WORD.findall(text.lower())
+
+
+def rouge1(summary: str, reference: str) -> float:
+    got, want = Counter(words(summary)), Counter(words(reference))
+    overlap = sum((got & want).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(got.values()), overlap / sum(want.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def key_recall(summary: str, reference_sentences: list) -> float:
+    return sum(sentence in summary for sentence in reference_sentences) / len(reference_sentences)
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> float:
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+
+def lead(doc, n: int) -> str:
+    return " ".join(sent.text.strip() for sent in summarizer.split_sentences(doc)[:n])
+
+
+def score(name: str, summaries: list, labeled: list, nlp, extractive: bool, seconds: float = None) -> None:
+    references = [reference for _, reference in labeled]
+    summary_vectors = [doc.vector for doc in nlp.tokenizer.pipe(summaries)]
+    reference_vectors = [doc.vector for doc in nlp.tokenizer.pipe(references)]
+    recall = "       n/a"
+    if extractive:
+        reference_sentences = [[sent.text.strip() for sent in summarizer.split_sentences(nlp.make_doc(reference))]
+                               for reference in references]
+        recall = f"{np.mean([key_recall(s, r) for s, r in zip(summaries, reference_sentences)]):10.3f}"
+    rouge = np.mean([rouge1(s, r) for s, r in zip(summaries, references)])
+    sims = np.mean([cosine(s, r) for s, r in zip(summary_vectors, reference_vectors)])
+    ratio = np.mean([len(words(s)) / max(len(words(text)), 1) for s, (text, _) in zip(summaries, labeled)])
+    speed = f"{len(summaries) / seconds:10.0f}/s" if seconds else ""
+    print(f"  {name:<11} {len(summaries):6d}  {recall}  {rouge:10.3f}  {sims:7.3f}  {ratio:6.2f}  {speed}")
+
+
+async def gemini_summaries(texts: list) -> list:
+    gemini = summarizer.GeminiSummarizer()
+    results = await asyncio.gather(*(gemini.summarize(text) for text in texts), return_exceptions=True)
+    await get_client().aclose()
+    return ["" if isinstance(result, BaseException) or not result[0] else result[0] for result in results]
+
+
+def run(args) -> None:
+    labeled = corpus.make_labeled_vents(args.size, seed=args.seed, max_context=args.max_context)
+    texts = [text for text, _ in labeled]
+    nlp = spacy.load(args.model or SPACY_MODEL)
+
+    start = time.perf_counter()
+    extracted = [summarizer.extract(doc, args.sentences)[0] for doc in nlp.tokenizer.pipe(texts)]
+    extract_s = time.perf_counter() - start
+    leads = [lead(doc, args.sentences) for doc in nlp.tokenizer.pipe(texts)]
+
+    print(f"{args.size} vents, up to {args.max_context} filler sentences each, {args.sentences}-sentence summaries")
+    print(f"  {'method':<11} {'vents':>6}  {'key recall':>10}  {'rouge-1 F1':>10}  {'cosine':>7}  {'words':>6}")
+    score("extractive", extracted, labeled, nlp, True, extract_s)
+    score("lead", leads, labeled, nlp, True)
+    score("full", texts, labeled, nlp, True)
+    if args.gemini:
+        subset = labeled[:args.gemini]
+        start = time.perf_counter()
+        summaries = asyncio.run(gemini_summaries([text for text, _ in subset]))
+        score("gemini", summaries, subset, nlp, False, time.perf_counter() - start)
+        score("extractive", extracted[:args.gemini], subset, nlp, True)
+
+    for (text, reference), summary in list(zip(labeled, extracted))[:args.show]:
+        print(f"\n  vent:       {text}\n  reference:  {reference}\n  extractive: {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-context", type=int, default=3, help="filler sentences per vent, at most")
+    parser.add_argument("--sentences", type=int, default=2, help="sentences per extractive summary")
+    parser.add_argument("--model", help=f"spaCy model with word vectors (default {SPACY_MODEL})")
+    parser.add_argument("--gemini", type=int, default=0, help="also summarize this many vents with Gemini")
+    parser.add_argument("--show", type=int, default=0, help="print this many example summaries")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
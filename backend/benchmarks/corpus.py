@@ -0,0 +1,59 @@
+# corpus.py
+"""Synthetic vents for offline benchmarks and comparison harnesses."""
+import random
+from typing import List, Tuple
+
+SUBJECTS = [
+    "my boss", "my manager", "my mom", "my dad", "my best friend", "my roommate",
+    "my partner", "my professor", "my team", "my sister", "my brother", "my coworker",
+]
+EVENTS = [
+    "yelled at me in front of everyone", "ignored my messages all week",
+    "cancelled our plans again", "said my project was not good enough",
+    "forgot my birthday", "asked me to stay late for the third time",
+    "told me they were proud of me", "surprised me with dinner",
+    "gave me great feedback on my presentation", "picked a fight about money",
+]
+FEELINGS = [
+    "I feel exhausted and anxious", "I am so angry I can't sleep", "I feel completely alone",
+    "honestly I'm kind of relieved", "I feel hopeful for the first time in weeks",
+    "I am really happy about it", "I don't know how to feel", "I feel like I'm failing at everything",
+    "I'm stressed about the exam on Friday", "I feel calm and grateful today",
+]
+CONTEXTS = [
+    "Work has been overwhelming since the deadline moved.",
+    "School is piling up and finals are next week.",
+    "Things at home have been tense for a while.",
+    "I finally went for a run this morning.",
+    "I keep thinking about moving to a new city.",
+    "My sleep schedule is a mess.",
+    "At the end of the day, I just want some peace.",
+    "You know, I guess it could be worse.",
+]
+
+
+def make_labeled_vent(rng: random.Random, max_context: int = 2) -> Tuple[str, str]:
+    """A vent and its reference summary: the event and feeling sentences, in the vent's order."""
+    key = [
+        f"{rng.choice(SUBJECTS).capitalize()} {rng.choice(EVENTS)}.",
+        f"{rng.choice(FEELINGS)}.",
+    ]
+    sentences = list(key)
+    for _ in range(rng.randint(0, max_context)):
+        sentences.append(rng.choice(CONTEXTS))
+    rng.shuffle(sentences)
+    return " ".join(sentences), " ".join(sentence for sentence in sentences if sentence in key)
+
+
+def make_vent(rng: random.Random) -> str:
+    return make_labeled_vent(rng)[0]
+
+
+def make_vents(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [make_vent(rng) for _ in range(n)]
+
+
+def make_labeled_vents(n: int, seed: int = 0, max_context: int = 2) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    return [make_labeled_vent(rng, max_context) for _ in range(n)]
@@ -0,0 +1,469 @@
+# memory_mongo.py
+"""
+In-memory stand-in for the pymongo collections the backend uses, so
+benchmarks run without a MongoDB server.
+
+It covers only what app.utils.db and the services call: find/find_one with
+projections, sort, limit, skip and batch_size; count_documents; insert,
+update, replace and bulk_write with the common query and update operators,
+and update pipelines built from the expressions the services use.
+Equality filters on indexed fields (see create_index) use a hash lookup so
+the stand-in doesn't dominate the timings it is used to take.
+"""
+import copy
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set(doc: dict, path: str, value) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc: dict, path: str) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _compare(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$exists":
+                if (value is not _MISSING) != bool(operand):
+                    return False
+            elif value is _MISSING or value is None:
+                if op == "$ne":
+                    continue
+                if op == "$in" and None in operand:
+                    continue
+                return False
+            elif op == "$eq" and not value == operand:
+                return False
+            elif op == "$ne" and not value != operand:
+                return False
+            elif op == "$lt" and not value < operand:
+                return False
+            elif op == "$lte" and not value <= operand:
+                return False
+            elif op == "$gt" and not value > operand:
+                return False
+            elif op == "$gte" and not value >= operand:
+                return False
+            elif op == "$in" and value not in operand:
+                return False
+            elif op == "$nin" and value in operand:
+                return False
+        return True
+    if value is _MISSING:
+        return condition is None
+    return value == condition
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif not _compare(_get(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {key: 1 for key in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(not v for v in fields.values()):
+        out = copy.deepcopy(doc)
+        for key in fields:
+            _unset(out, key)
+    else:
+        out = {}
+        for key in fields:
+            value = _get(doc, key)
+            if value is not _MISSING:
+                _set(out, key, copy.deepcopy(value))
+    if include_id and "_id" in doc:
+        out["_id"] = doc["_id"]
+    elif not include_id:
+        out.pop("_id", None)
+    return out
+
+
+def evaluate(expression, doc: dict, variables: Optional[dict] = None):
+    """The aggregation expressions update pipelines use, evaluated against doc."""
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        return variables[expression[2:]]
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(item, doc, variables) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith("$"):
+        return {key: evaluate(value, doc, variables) for key, value in expression.items()}
+
+    op, operand = next(iter(expression.items()))
+    if op == "$literal":
+        return operand
+    if op == "$map":
+        items = evaluate(operand["input"], doc, variables)
+        name = operand.get("as", "this")
+        return [evaluate(operand["in"], doc, {**variables, name: item}) for item in items]
+    if op == "$cond":
+        # Only the branch taken is evaluated.
+        if isinstance(operand, dict):
+            operand = [operand["if"], operand["then"], operand["else"]]
+        return evaluate(operand[1] if evaluate(operand[0], doc, variables) else operand[2], doc, variables)
+    args = evaluate(operand, doc, variables)
+    if op == "$ifNull":
+        return next((arg for arg in args if arg is not None), None)
+    if op in ("$add", "$subtract", "$multiply", "$divide") and any(arg is None for arg in args):
+        return None
+    if op == "$add":
+        return sum(args)
+    if op == "$subtract":
+        return args[0] - args[1]
+    if op == "$multiply":
+        product = 1
+        for arg in args:
+            product *= arg
+        return product
+    if op == "$divide":
+        return args[0] / args[1]
+    if op == "$isArray":
+        return isinstance(args[0] if isinstance(operand, list) else args, list)
+    if op == "$arrayElemAt":
+        array, index = args
+        return array[index] if array is not None and -len(array) <= index < len(array) else None
+    if op == "$range":
+        return list(range(*args))
+    raise NotImplementedError(f"expression operator {op}")
+
+
+def apply_pipeline(doc: dict, pipeline: List[dict]) -> None:
+    """An update pipeline: $set/$addFields and $unset stages, each seeing the previous stage's result."""
+    for stage in pipeline:
+        op, fields = next(iter(stage.items()))
+        if op in ("$set", "$addFields"):
+            values = {path: evaluate(value, doc) for path, value in fields.items()}
+            for path, value in values.items():
+                _set(doc, path, value)
+        elif op == "$unset":
+            for path in [fields] if isinstance(fields, str) else fields:
+                _unset(doc, path)
+        else:
+            raise NotImplementedError(f"pipeline stage {op}")
+
+
+def apply_update(doc: dict, update, inserting: bool = False) -> None:
+    if isinstance(update, list):
+        apply_pipeline(doc, update)
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = _get(doc, path)
+            if op == "$set":
+                _set(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$min":
+                if current is _MISSING or value < current:
+                    _set(doc, path, value)
+            elif op == "$max":
+                if current is _MISSING or value > current:
+                    _set(doc, path, value)
+            elif op == "$push":
+                items = [] if current is _MISSING else current
+                if isinstance(value, dict) and "$each" in value:
+                    items.extend(copy.deepcopy(value["$each"]))
+                    if "$sort" in value:
+                        # Only the {field: 1 | -1} form.
+                        (key, direction), = value["$sort"].items()
+                        items.sort(key=lambda item: item.get(key), reverse=direction < 0)
+                    if "$slice" in value:
+                        limit = value["$slice"]
+                        items[:] = items[limit:] if limit < 0 else items[:limit]
+                else:
+                    items.append(copy.deepcopy(value))
+                _set(doc, path, items)
+            else:
+                raise NotImplementedError(f"update operator {op}")
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[dict], projection):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key_or_list, direction: int = 1) -> "MemoryCursor":
+        keys = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        for key, dir_ in reversed(keys):
+            self._docs.sort(key=lambda d: _sort_key(_get(d, key)), reverse=dir_ < 0)
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = n
+        return self
+
+    def skip(self, n: int) -> "MemoryCursor":
+        self._skip = n
+        return self
+
+    def batch_size(self, n: int) -> "MemoryCursor":
+        return self
+
+    def __iter__(self):
+        docs = self._docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        for doc in docs:
+            yield project(doc, self._projection)
+
+
+def _sort_key(value):
+    # Missing/None sort first, like Mongo.
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, ObjectId):
+        return (1, value.binary)
+    return (1, value)
+
+
+class MemoryCollection:
+    def __init__(self, name: str = "collection"):
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._indexed_fields = {"_id"}
+        self._hash: Dict[str, Dict[Any, Dict[Any, dict]]] = {}
+
+    # --- indexes ---
+
+    def create_index(self, keys, **kwargs) -> str:
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        field = keys[0][0]
+        if field not in self._indexed_fields and field != "_id":
+            self._indexed_fields.add(field)
+            self._hash[field] = {}
+            for doc in self._docs.values():
+                self._index_doc(field, doc)
+        return "_".join(f"{k}_{d}" for k, d in keys)
+
+    def _index_doc(self, field: str, doc: dict) -> None:
+        value = _get(doc, field)
+        if value is not _MISSING and _hashable(value):
+            self._hash[field].setdefault(value, {})[doc["_id"]] = doc
+
+    def _unindex_doc(self, doc: dict) -> None:
+        for field, table in self._hash.items():
+            value = _get(doc, field)
+            if value is not _MISSING and _hashable(value):
+                bucket = table.get(value)
+                if bucket:
+                    bucket.pop(doc["_id"], None)
+
+    def _reindex(self, doc: dict) -> None:
+        for field in self._hash:
+            self._index_doc(field, doc)
+
+    def _candidates(self, query: Optional[dict]) -> Iterable[dict]:
+        query = query or {}
+        if "_id" in query and _hashable(query["_id"]) and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            return [doc] if doc is not None else []
+        for field, table in self._hash.items():
+            value = query.get(field, _MISSING)
+            if value is not _MISSING and not isinstance(value, dict) and _hashable(value):
+                return list(table.get(value, {}).values())
+        return list(self._docs.values())
+
+    def _matching(self, query) -> List[dict]:
+        return [doc for doc in self._candidates(query) if matches(doc, query)]
+
+    # --- reads ---
+
+    def find(self, filter=None, projection=None, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self._matching(filter), projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs) -> Optional[dict]:
+        cursor = self.find(filter, projection, sort=sort)
+        return next(iter(cursor.limit(1)), None)
+
+    def count_documents(self, filter=None, **kwargs) -> int:
+        return len(self._matching(filter))
+
+    # --- writes ---
+
+    def insert_one(self, doc: dict):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"duplicate _id {doc['_id']}")
+        stored = copy.deepcopy(doc)
+        self._docs[stored["_id"]] = stored
+        self._reindex(stored)
+        return _Result(inserted_id=doc["_id"])
+
+    def insert_many(self, docs: List[dict], ordered: bool = True):
+        ids = [self.insert_one(doc).inserted_id for doc in docs]
+        return _Result(inserted_ids=ids)
+
+    def update_one(self, filter, update, upsert: bool = False):
+        found = self._matching(filter)
+        if found:
+            doc = found[0]
+            self._unindex_doc(doc)
+            apply_update(doc, update)
+            self._reindex(doc)
+            return _Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {k: v for k, v in (filter or {}).items() if not k.startswith("$") and not isinstance(v, dict)}
+            apply_update(doc, update, inserting=True)
+            self.insert_one(doc)
+            return _Result(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return _Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    def update_many(self, filter, update, upsert: bool = False):
+        found = self._matching(filter)
+        for doc in found:
+            self._unindex_doc(doc)
+            apply_update(doc, update)
+            self._reindex(doc)
+        if not found and upsert:
+            return self.update_one(filter, update, upsert=True)
+        return _Result(matched_count=len(found), modified_count=len(found), upserted_id=None)
+
+    def replace_one(self, filter, replacement: dict, upsert: bool = False):
+        found = self._matching(filter)
+        if found:
+            doc = found[0]
+            self._unindex_doc(doc)
+            _id = doc["_id"]
+            doc.clear()
+            doc.update(copy.deepcopy(replacement))
+            doc["_id"] = _id
+            self._reindex(doc)
+            return _Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = dict(replacement)
+            if "_id" in (filter or {}):
+                doc["_id"] = filter["_id"]
+            self.insert_one(doc)
+            return _Result(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return _Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    def delete_many(self, filter=None):
+        found = self._matching(filter)
+        for doc in found:
+            self._unindex_doc(doc)
+            del self._docs[doc["_id"]]
+        return _Result(deleted_count=len(found))
+
+    def bulk_write(self, requests, ordered: bool = True):
+        # pymongo's operation classes keep their arguments in these attributes.
+        counts = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "upserted_count": 0}
+        for request in requests:
+            kind = type(request).__name__
+            if kind == "InsertOne":
+                self.insert_one(request._doc)
+                counts["inserted_count"] += 1
+            elif kind == "UpdateOne":
+                result = self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+                counts["upserted_count"] += result.upserted_id is not None
+            elif kind == "UpdateMany":
+                result = self.update_many(request._filter, request._doc, upsert=bool(request._upsert))
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+            elif kind == "ReplaceOne":
+                result = self.replace_one(request._filter, request._doc, upsert=bool(request._upsert))
+                counts["matched_count"] += result.matched_count
+            else:
+                raise NotImplementedError(f"bulk operation {kind}")
+        return _Result(**counts)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+
+def _hashable(value) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+def install() -> MemoryDatabase:
+    """
+    Point app.config's collections at a fresh in-memory database. Call this
+    before importing anything under app.services or app.utils, since those
+    modules bind the collections at import time.
+    """
+    from app import config
+
+    database = MemoryDatabase()
+    config.db = database
+    for name in ("conversations", "conversations_dead_letter", "threads", "topic_stats", "rollups", "leases"):
+        setattr(config, name, database[name])
+    return database
+
@@ -0,0 +1,95 @@
+# stub_gemini.py
+"""
+Local stand-in for the Gemini generateContent / streamGenerateContent API.
+
+Answers every request with a short canned text after a configurable delay,
+so the backend's HTTP path (pooling, concurrency, streaming) can be exercised
+offline. Point the backend at it with GEMINI_BASE_URL=http://127.0.0.1:<port>.
+
+    cd backend
+    python -m benchmarks.stub_gemini --port 8765 --latency 0.3
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "It sounds like a lot has been weighing on you. What part of it feels heaviest right now?"
+
+
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    status = 200
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        time.sleep(self.latency)
+
+        if self.status != 200:
+            body = json.dumps({"error": {"code": self.status}}).encode()
+            self.send_response(self.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in REPLY.split(" "):
+                event = "data: " + json.dumps(_candidate(word + " ")) + "\r\n\r\n"
+                self._chunk(event.encode())
+            self._chunk(b"")
+            return
+
+        body = json.dumps(_candidate(REPLY)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def _candidate(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+def start(port: int = 0, latency: float = 0.0, status: int = 200) -> ThreadingHTTPServer:
+    """Serve in a daemon thread; returns the server (its port is server.server_port)."""
+    handler = type("Handler", (StubGeminiHandler,), {"latency": latency, "status": status})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-gemini", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--status", type=int, default=200, help="HTTP status to answer with")
+    args = parser.parse_args()
+    server = start(args.port, args.latency, args.status)
+    print(f"Stub Gemini listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()